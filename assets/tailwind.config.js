@@ -0,0 +1,23 @@
+// Tailwind build used by build_assets.py. Only classes that appear in the
+// templates and dashboard scripts end up in the bundle.
+module.exports = {
+  content: [
+    './templates/**/*.html',
+    './static/js/**/*.js',
+  ],
+  theme: {
+    extend: {
+      colors: {
+        'light-gold': '#f6cf9a',
+        'dark-slate': '#474454',
+        'medium-slate': '#76737c',
+        'muted-tan': '#d0bc8f',
+        'terracotta-rose': '#c0786a',
+      },
+      fontFamily: {
+        poppins: ['Poppins', 'system-ui', 'sans-serif'],
+        inter: ['Inter', 'system-ui', 'sans-serif'],
+      },
+    },
+  },
+}
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# --- Ingest / Latency Benchmark ---
+# Drives main.py's ingest path and /data endpoint in-process with simulated
+# helmet traffic, so regressions show up before they reach a site.
+#
+#   python bench_ingest.py                          # default sizes
+#   python bench_ingest.py --helmets 500 --packets 200000 --readers 16 --json bench.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class InstrumentedLock:
+    """
+    Drop-in replacement for data_lock that records how long callers waited
+    to acquire it and how long they held it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = []
+        self.holds = []
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = time.perf_counter()
+            self.waits.append(self.acquired_at - start)
+        return acquired
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def percentile_us(samples, q):
+    return float(np.percentile(samples, q) * 1e6) if len(samples) else 0.0
+
+def make_lines(helmets, count, corrupt_fraction):
+    fleet = [simulator.Helmet(i + 1, 200.0) for i in range(helmets)]
+    lines = []
+    for n in range(count):
+        line = fleet[n % helmets].packet()
+        if random.random() < corrupt_fraction:
+            line = simulator.corrupt(line)
+        lines.append(line.encode('utf-8', errors='surrogateescape'))
+    return lines
+
+def feed(parser, data, chunk_size):
+    """
+    Pushes a byte string through a parser in serial-sized chunks and ingests
+    every packet. Returns the number of packets ingested.
+    """
+    ingested = 0
+    for offset in range(0, len(data), chunk_size):
+        for key, parts in parser.feed(data[offset:offset + chunk_size]):
+            main.ingest_packet(parts, 'bench', key)
+            ingested += 1
+    return ingested
+
+def bench_ingest_throughput(args):
+    lines = make_lines(args.helmets, args.packets, 0.0)
+    data = b''.join(lines)
+    start = time.perf_counter()
+    ingested = feed(main.CsvParser('bench'), data, args.chunk_size)
+    csv_elapsed = time.perf_counter() - start
+
+    seq = 0
+    frames = []
+    for line in lines:
+        frames.append(main.encode_frame(seq, line.decode().strip().split(',')))
+        seq += 1
+    data = b''.join(frames)
+    start = time.perf_counter()
+    frame_ingested = feed(main.BinaryFrameParser('bench'), data, args.chunk_size)
+    binary_elapsed = time.perf_counter() - start
+    return {
+        "csv_packets_per_s": ingested / csv_elapsed,
+        "binary_packets_per_s": frame_ingested / binary_elapsed,
+    }
+
+def bench_parse_errors(args):
+    """
+    Compares the cost per line of clean and corrupted CSV lines.
+    Warnings are formatted as usual but handed to a sink that discards them
+    instead of the console queue, so this measures parsing and formatting,
+    not the queue or the speed of the console.
+    """
+    count = max(args.packets // 10, 1000)
+    results = {}
+    original_log_event = main.log_event
+    main.log_event = lambda message: None
+    try:
+        for label, fraction in (("clean", 0.0), ("corrupt", 1.0)):
+            data = b''.join(make_lines(args.helmets, count, fraction))
+            start = time.perf_counter()
+            feed(main.CsvParser('bench'), data, args.chunk_size)
+            elapsed = time.perf_counter() - start
+            results[f"{label}_line_us"] = elapsed / count * 1e6
+    finally:
+        main.log_event = original_log_event
+    return results
+
+def bench_data_latency(args):
+    """
+    Measures /data latency from concurrent readers while a writer ingests
+    packets at full speed, with data_lock instrumented.
+    """
+    lock = InstrumentedLock()
+    original_lock = main.data_lock
+    main.data_lock = lock
+    stop = threading.Event()
+    lines = make_lines(args.helmets, 20000, 0.0)
+
+    def writer():
+        parser = main.CsvParser('bench')
+        while not stop.is_set():
+            for line in lines:
+                if stop.is_set():
+                    break
+                for key, parts in parser.feed(line):
+                    main.ingest_packet(parts, 'bench', key)
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def reader():
+        client = main.app.test_client()
+        own = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.get('/data')
+            own.append(time.perf_counter() - start)
+            assert response.status_code == 200
+        with latencies_lock:
+            latencies.extend(own)
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    start = time.perf_counter()
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    writer_thread.join()
+    main.data_lock = original_lock
+
+    waits = np.array(lock.waits)
+    return {
+        "data_requests_per_s": len(latencies) / elapsed,
+        "data_p50_ms": percentile_us(latencies, 50) / 1000,
+        "data_p99_ms": percentile_us(latencies, 99) / 1000,
+        "lock_wait_p50_us": percentile_us(waits, 50),
+        "lock_wait_p99_us": percentile_us(waits, 99),
+        "lock_wait_max_us": float(waits.max() * 1e6) if len(waits) else 0.0,
+        "lock_hold_p50_us": percentile_us(lock.holds, 50),
+        "lock_hold_p99_us": percentile_us(lock.holds, 99),
+        "lock_contended_pct": float((waits > 10e-6).mean() * 100) if len(waits) else 0.0,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark main.py ingest throughput and /data latency.")
+    parser.add_argument('--helmets', type=int, default=100)
+    parser.add_argument('--packets', type=int, default=50000, help="packets for the throughput run")
+    parser.add_argument('--chunk-size', type=int, default=64, help="bytes per simulated serial read")
+    parser.add_argument('--readers', type=int, default=8, help="concurrent /data readers")
+    parser.add_argument('--requests', type=int, default=200, help="/data requests per reader")
+    parser.add_argument('--json', metavar='FILE', help="also write results to a JSON file")
+    args = parser.parse_args()
+
+    # Keep the users database and telemetry segments out of the working tree
+    sys.path.insert(0, HERE)
+    os.chdir(tempfile.mkdtemp(prefix='aura-bench-'))
+    import main
+    import simulator
+    main.app.logger.disabled = True
+
+    results = {"helmets": args.helmets}
+    results.update(bench_ingest_throughput(args))
+    results.update(bench_parse_errors(args))
+    results.update(bench_data_latency(args))
+
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:>12.2f}" if isinstance(value, float) else f"{name:<{width}}  {value:>12}")
+    if args.json:
+        with open(os.path.join(HERE, args.json) if not os.path.isabs(args.json) else args.json, 'w') as f:
+            json.dump(results, f, indent=4)
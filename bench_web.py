@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+# --- Web Endpoint Benchmark ---
+# Generates synthetic users.json stores of increasing size, imports each one
+# through main.py's one-shot migration, then drives login, signup, next_page,
+# add_box and details concurrently through the Flask test client.
+#
+#   python bench_web.py                                  # 10, 1000 and 10000 accounts
+#   python bench_web.py --sizes 10,1000,100000 --fanout 5 --depth 3 --json web.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROUTES = ["login", "signup", "next_page", "add_box", "details"]
+
+# Time spent inside these main.py functions is reported as the store share
+STORE_FUNCTIONS = ["get_user_by_username", "create_user", "load_user_boxes", "insert_box",
+                   "load_box_page", "load_box"]
+timings = threading.local()
+
+def timed(func, bucket):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            setattr(timings, bucket, getattr(timings, bucket, 0.0) + time.perf_counter() - start)
+    return wrapper
+
+def make_box_tree(fanout, depth, level=1):
+    boxes = []
+    for i in range(fanout):
+        box = {
+            'id': str(uuid.uuid4()),
+            'name': f"Zone {level}.{i}" if level == 1 else f"Worker {level}.{i}",
+            'location': f"Sector {i}",
+            'sub_boxes': make_box_tree(fanout, depth, level + 1) if level < depth else [],
+            'type': 'parent' if level == 1 else 'sub-box',
+        }
+        boxes.append(box)
+    return boxes
+
+def all_box_ids(boxes):
+    for box in boxes:
+        yield box['id']
+        yield from all_box_ids(box['sub_boxes'])
+
+def generate_store(path, accounts, fanout, depth):
+    """
+    Writes a users.json with the given number of accounts and returns
+    {username: (unique_id, password, sample of box ids)} for the workers.
+    """
+    users = []
+    logins = {}
+    unique_ids = random.sample(range(100000, 1000000), accounts)
+    for n, unique_id in enumerate(unique_ids):
+        username = f"user{n}"
+        boxes = make_box_tree(fanout, depth)
+        users.append({'unique_id': unique_id, 'username': username, 'password': 'pw', 'boxes': boxes})
+        logins[username] = (unique_id, 'pw', list(all_box_ids(boxes))[:50])
+    with open(path, 'w') as f:
+        json.dump(users, f)
+    return logins
+
+def use_store(directory):
+    """
+    Points main.py at a fresh database next to a generated users.json.
+    """
+    main.DATABASE_FILE = os.path.join(directory, 'users.db')
+    main.LEGACY_USERS_FILE = os.path.join(directory, 'users.json')
+    main.db_initialized = False
+    main.db_local.conn = None
+    main.box_cache = main.BoxCache(main.BOX_CACHE_TENANTS)
+    start = time.perf_counter()
+    main.get_db()
+    return time.perf_counter() - start
+
+def run_worker(logins, iterations, results, results_lock):
+    client = main.app.test_client()
+    username = random.choice(list(logins))
+    unique_id, password, box_ids = logins[username]
+    own = {route: [] for route in ROUTES}
+
+    def request(route, method, url, data=None):
+        timings.store = 0.0
+        timings.render = 0.0
+        start = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        elapsed = time.perf_counter() - start
+        assert response.status_code in (200, 302), (route, response.status_code)
+        own[route].append((elapsed, timings.store, timings.render))
+
+    for i in range(iterations):
+        request("login", "POST", "/login", {'login_username': username, 'login_unique_id': str(unique_id),
+                                            'login_password': password})
+        request("next_page", "GET", "/next_page")
+        request("details", "GET", f"/details/{random.choice(box_ids)}")
+        request("add_box", "POST", "/add_box", {'box_name': f"Bench {i}", 'box_location': "Yard"})
+        signup_client = main.app.test_client()
+        timings.store = timings.render = 0.0
+        start = time.perf_counter()
+        signup_client.post('/signup', data={'signup_username': f"new-{uuid.uuid4().hex[:12]}", 'signup_password': 'pw'})
+        own["signup"].append((time.perf_counter() - start, timings.store, timings.render))
+
+    with results_lock:
+        for route, samples in own.items():
+            results[route].extend(samples)
+
+def bench_size(accounts, args):
+    directory = tempfile.mkdtemp(prefix=f'aura-web-{accounts}-')
+    start = time.perf_counter()
+    logins = generate_store(os.path.join(directory, 'users.json'), accounts, args.fanout, args.depth)
+    generate_seconds = time.perf_counter() - start
+    migrate_seconds = use_store(directory)
+
+    results = {route: [] for route in ROUTES}
+    results_lock = threading.Lock()
+    workers = [threading.Thread(target=run_worker, args=(logins, args.iterations, results, results_lock))
+               for _ in range(args.workers)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    rows = []
+    for route in ROUTES:
+        samples = np.array(results[route])
+        total = samples[:, 0]
+        rows.append({
+            "accounts": accounts,
+            "route": route,
+            "requests": len(samples),
+            "req_per_s": len(samples) / elapsed,
+            "p50_ms": float(np.percentile(total, 50) * 1000),
+            "p99_ms": float(np.percentile(total, 99) * 1000),
+            "store_pct": float(samples[:, 1].sum() / total.sum() * 100),
+            "render_pct": float(samples[:, 2].sum() / total.sum() * 100),
+        })
+    print(f"   {accounts} accounts: generated in {generate_seconds:.1f} s, migrated in {migrate_seconds:.1f} s")
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the account and box routes against synthetic stores.")
+    parser.add_argument('--sizes', default='10,1000,10000', help="comma-separated account counts")
+    parser.add_argument('--fanout', type=int, default=4, help="boxes per level (default 4)")
+    parser.add_argument('--depth', type=int, default=2, help="levels of boxes/sub_boxes (default 2)")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent clients (default 8)")
+    parser.add_argument('--iterations', type=int, default=25, help="route rounds per client (default 25)")
+    parser.add_argument('--json', metavar='FILE', help="also write results to a JSON file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    os.chdir(tempfile.mkdtemp(prefix='aura-bench-'))
+    import main
+    main.app.logger.disabled = True
+    for name in STORE_FUNCTIONS:
+        setattr(main, name, timed(getattr(main, name), 'store'))
+    main.render_template = timed(main.render_template, 'render')
+
+    rows = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        rows.extend(bench_size(size, args))
+
+    print(f"{'accounts':>9} {'route':<10} {'reqs':>6} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'store %':>8} {'render %':>9}")
+    for row in rows:
+        print(f"{row['accounts']:>9} {row['route']:<10} {row['requests']:>6} {row['req_per_s']:>9.1f} "
+              f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['store_pct']:>8.1f} {row['render_pct']:>9.1f}")
+    if args.json:
+        with open(os.path.join(HERE, args.json) if not os.path.isabs(args.json) else args.json, 'w') as f:
+            json.dump(rows, f, indent=4)
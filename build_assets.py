@@ -0,0 +1,166 @@
+"""
+Builds the dashboard's static bundle so pages need no CDN at run time.
+
+  - compiles assets/app.css with Tailwind, keeping only the classes used in
+    templates/ and static/js/ (purged and minified)
+  - downloads the Inter and Poppins web fonts once and self-hosts them
+  - copies every file under static/js/ and static/img/, and points the
+    stylesheet's url(img/...) references at the fingerprinted images
+  - names each output after a hash of its contents and writes
+    static/dist/manifest.json mapping logical names to the hashed files,
+    which main.py serves with year-long cache headers
+
+Run it on a machine with internet access (Tailwind and the fonts are fetched
+the first time) and ship static/dist with the app:
+
+    python build_assets.py
+    python build_assets.py --tailwind ./tailwindcss-linux-x64   # standalone CLI, no Node
+    python build_assets.py --no-fonts                           # system fonts only
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(ROOT, 'assets')
+JS_DIR = os.path.join(ROOT, 'static', 'js')
+IMG_DIR = os.path.join(ROOT, 'static', 'img')
+DIST_DIR = os.path.join(ROOT, 'static', 'dist')
+FONT_CACHE_DIR = os.path.join(ASSETS_DIR, 'fonts')
+
+FONTS_URL = "https://fonts.googleapis.com/css2?family=Inter:wght@400;500;700&family=Poppins:wght@300;400;700;900&display=swap"
+# Google serves woff2 only to browsers it recognises
+FONTS_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+HASH_LENGTH = 10
+
+
+def fingerprint(name, data):
+    """
+    app.css -> app.<hash>.css
+    """
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def write_output(name, data):
+    path = os.path.join(DIST_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def run_tailwind(command):
+    """
+    Compiles assets/app.css and returns the minified CSS.
+    """
+    if command:
+        cmd = [command]
+    elif shutil.which('tailwindcss'):
+        cmd = ['tailwindcss']
+    else:
+        cmd = ['npx', '--yes', 'tailwindcss@3']
+    cmd += ['-c', os.path.join(ASSETS_DIR, 'tailwind.config.js'),
+            '-i', os.path.join(ASSETS_DIR, 'app.css'),
+            '--minify']
+    # Content globs in the config are relative to the working directory
+    result = subprocess.run(cmd, cwd=ROOT, capture_output=True)
+    if result.returncode != 0:
+        sys.exit(f"❌ Tailwind build failed ({' '.join(cmd)}):\n{result.stderr.decode(errors='replace')}")
+    return result.stdout
+
+
+def fetch(url, user_agent=None):
+    req = urllib.request.Request(url, headers={"User-Agent": user_agent or FONTS_USER_AGENT})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return response.read()
+
+
+def build_fonts():
+    """
+    Returns @font-face rules pointing at self-hosted, fingerprinted woff2 files.
+    Font files are cached in assets/fonts so later builds work offline.
+    """
+    os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+    css_cache = os.path.join(FONT_CACHE_DIR, 'fonts.css')
+    if not os.path.exists(css_cache):
+        print("⬇️  Downloading font stylesheet")
+        with open(css_cache, 'wb') as f:
+            f.write(fetch(FONTS_URL))
+    with open(css_cache, encoding='utf-8') as f:
+        css = f.read()
+
+    def self_host(match):
+        url = match.group(1)
+        cached = os.path.join(FONT_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest()[:16] + '.woff2')
+        if not os.path.exists(cached):
+            print(f"⬇️  Downloading {url}")
+            with open(cached, 'wb') as f:
+                f.write(fetch(url))
+        with open(cached, 'rb') as f:
+            data = f.read()
+        name = fingerprint('fonts/font.woff2', data)
+        write_output(name, data)
+        # The stylesheet lives in static/dist, next to the fonts directory
+        return f"url({name})"
+
+    css = re.sub(r"url\((https://fonts\.gstatic\.com/[^)]+)\)", self_host, css)
+    return css.encode('utf-8')
+
+
+def build(args):
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+    manifest = {}
+
+    for filename in sorted(os.listdir(IMG_DIR)):
+        with open(os.path.join(IMG_DIR, filename), 'rb') as f:
+            data = f.read()
+        name = fingerprint(f"img/{filename}", data)
+        write_output(name, data)
+        manifest[f"img/{filename}"] = f"dist/{name}"
+
+    css = run_tailwind(args.tailwind)
+    # The stylesheet sits in static/dist, next to the img directory
+    for logical, path in manifest.items():
+        css = re.sub(rb"url\((['\"]?)" + re.escape(logical.encode()) + rb"\1\)",
+                     b"url(" + path[len('dist/'):].encode() + b")", css)
+    if not args.no_fonts:
+        try:
+            css = build_fonts() + b"\n" + css
+        except OSError as e:
+            print(f"⚠️ Could not fetch fonts ({e}); falling back to system fonts")
+    name = fingerprint('app.css', css)
+    write_output(name, css)
+    manifest['app.css'] = f"dist/{name}"
+
+    for filename in sorted(os.listdir(JS_DIR)):
+        with open(os.path.join(JS_DIR, filename), 'rb') as f:
+            data = f.read()
+        name = fingerprint(filename, data)
+        write_output(name, data)
+        manifest[filename] = f"dist/{name}"
+
+    with open(os.path.join(DIST_DIR, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    for logical, path in manifest.items():
+        size = os.path.getsize(os.path.join(ROOT, 'static', path))
+        print(f"✅ {logical:16} -> static/{path} ({size / 1024:.1f} KB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the fingerprinted dashboard CSS/JS bundle")
+    parser.add_argument("--tailwind", help="Tailwind CLI to run (default: tailwindcss on PATH, else npx tailwindcss@3)")
+    parser.add_argument("--no-fonts", action="store_true", help="do not self-host the web fonts")
+    build(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
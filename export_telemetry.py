@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# --- Telemetry Export ---
+# Command-line twin of the /export endpoint: streams stored packets for a
+# helmet set or box and a time range to a file (or stdout) as CSV, NDJSON or
+# Parquet, without loading the range into memory. Run it next to main.py so
+# it finds the same telemetry/ directory and users.db.
+#
+#   python export_telemetry.py --start 2026-01-01 --end 2026-04-01 -o q1.csv
+#   python export_telemetry.py --box <box-id> --start 2026-03-01 --resolution 60 --format ndjson
+#   python export_telemetry.py --helmets 1,2,3 --start 1767225600 --format parquet -o audit.parquet
+
+def parse_time(value):
+    """
+    Accepts unix seconds or an ISO 8601 date/time (local time unless it has an offset).
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def box_helmets(main, box_id):
+    row = main.get_db().execute('SELECT owner_id FROM boxes WHERE id = ?', (box_id,)).fetchone()
+    box = main.get_box(row[0], box_id) if row else None
+    if box is None:
+        sys.exit(f"❌ Box '{box_id}' not found in {main.DATABASE_FILE}")
+    return main.numeric_helmet_ids(main.box_helmet_ids(box))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export stored helmet telemetry.")
+    parser.add_argument('--format', choices=['csv', 'ndjson', 'parquet'], default='csv')
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('--helmets', help="comma-separated helmet IDs (default: every helmet)")
+    selection.add_argument('--box', help="every helmet assigned to this box and its sub-boxes")
+    parser.add_argument('--start', required=True, type=parse_time, help="unix time or ISO date/time")
+    parser.add_argument('--end', type=parse_time, help="unix time or ISO date/time (default: now)")
+    parser.add_argument('--resolution', type=float, help="average each helmet over buckets of this many seconds")
+    parser.add_argument('-o', '--output', help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    import main
+
+    end = args.end if args.end is not None else datetime.now().timestamp()
+    if end <= args.start:
+        sys.exit("❌ --end must be after --start")
+    helmet_ids = None
+    if args.helmets:
+        helmet_ids = main.numeric_helmet_ids(args.helmets.split(','))
+    elif args.box:
+        helmet_ids = box_helmets(main, args.box)
+
+    try:
+        chunks = main.export_telemetry(args.format, args.start, end, helmet_ids, args.resolution)
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    binary = args.format == 'parquet'
+    if args.output:
+        out = open(args.output, 'wb' if binary else 'w', encoding=None if binary else 'utf-8', newline='')
+    elif binary:
+        out = sys.stdout.buffer
+    else:
+        out = sys.stdout
+    written = 0
+    for chunk in chunks:
+        out.write(chunk)
+        written += len(chunk)
+    if args.output:
+        out.close()
+        print(f"✅ Wrote {written} bytes to {args.output}", file=sys.stderr)
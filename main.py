@@ -1,279 +1,3496 @@
-import pandas as pd
+import numpy as np
 import os
+import sqlite3
 import random
 import uuid
-from flask import Flask, request, redirect, url_for, session, render_template, jsonify ,render_template_string
+import csv
+import io
+import re
+from flask import Flask, request, redirect, url_for, session, render_template, jsonify, Response, g
+import json
+from collections import OrderedDict, deque
 import time
 import threading
+import struct
+import atexit
+import binascii
+import socket
+import zipfile
+from multiprocessing import resource_tracker, shared_memory
+import bisect
+import heapq
+import math
+import functools
 import serial
 
-SERIAL_PORT = 'COM6'
+# Comma-separated list of HC-12 receivers, e.g. SERIAL_PORTS=COM6,COM7 or /dev/ttyUSB0,/dev/ttyUSB1
+# (any pyserial URL works too, e.g. socket://localhost:7777 for simulator.py)
+SERIAL_PORTS = [p.strip() for p in os.environ.get('SERIAL_PORTS', 'COM6').split(',') if p.strip()]
 BAUD_RATE = 9600
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 30
+# The same packet heard by two receivers within this window is only ingested once
+DEDUP_WINDOW_SECONDS = float(os.environ.get('DEDUP_WINDOW_SECONDS', 0.5))
+MAX_LINE_BYTES = 256
+# Uplink framing: 'csv' (text lines) or 'binary' (fixed-size frames, see BinaryFrameParser)
+SERIAL_FORMAT = os.environ.get('SERIAL_FORMAT', 'csv')
+
+# Field order of the helmet CSV packet (same labels the dashboard shows)
+SENSOR_LABELS = ["ID", "MQ2", "MQ7", "MQ135", "Fall dec", "X-cor", "Y-cor", "SP-O₂", "Heart rate"]
+NUM_FIELDS = len(SENSOR_LABELS)
+MAX_HELMETS = int(os.environ.get('MAX_HELMETS', 1024))
+
+# --- Metrics ---
+# Hot paths only bump counters and histogram buckets; everything is formatted
+# as Prometheus text when /metrics is scraped.
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+LOCK_BUCKETS = [0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05]
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels):
+        self.add(1, *labels)
+
+    def add(self, amount, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}      # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self.lock:
+            all_series = {labels: list(series) for labels, series in self.series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(all_series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names + ('le',), labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+packets_total = Counter("aura_packets_total", "Packets ingested per receiver port.", ("port",))
+helmet_packets_total = Counter("aura_helmet_packets_total", "Packets ingested per helmet.", ("helmet",))
+duplicate_packets_total = Counter("aura_duplicate_packets_total", "Packets dropped as cross-receiver duplicates.", ("port",))
+parse_failures_total = Counter("aura_parse_failures_total", "Unusable uplink data by port and reason.", ("port", "reason"))
+serial_reconnects_total = Counter("aura_serial_reconnects_total", "Serial port open failures and disconnects.", ("port",))
+pipeline_dropped_total = Counter("aura_pipeline_dropped_total", "Entries discarded by a full ingest stage queue.", ("stage", "reason"))
+pipeline_dropped_bytes_total = Counter("aura_pipeline_dropped_bytes_total", "Received bytes discarded because a parse stage fell behind.", ("stage",))
+lock_wait_seconds = Histogram("aura_data_lock_wait_seconds", "Time spent waiting for data_lock.", (), LOCK_BUCKETS)
+lock_hold_seconds = Histogram("aura_data_lock_hold_seconds", "Time data_lock was held.", (), LOCK_BUCKETS)
+request_seconds = Histogram("aura_http_request_seconds", "HTTP request latency by route.", ("route",), LATENCY_BUCKETS)
+user_store_seconds = Histogram("aura_user_store_seconds", "User store load/save duration by operation.", ("operation",), LATENCY_BUCKETS)
+
+class TimedLock:
+    """
+    threading.Lock that records wait and hold times into the lock histograms.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+        lock_wait_seconds.observe(self.acquired_at - start)
+        return self
+
+    def __exit__(self, *exc):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        lock_hold_seconds.observe(held)
+
+def timed_store(func):
+    """
+    Records the duration of a user store function in user_store_seconds.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            user_store_seconds.observe(time.perf_counter() - start, func.__name__)
+    return wrapper
 
 # --- Global Variables ---
 latest_data = {
     "values": [0.0] * 9
 }
-data_lock = threading.Lock()
+data_lock = TimedLock()
+
+# --- Per-Helmet Live State ---
+def to_float(value):
+    """
+    Converts a packet field to a float, returning NaN for non-numeric values.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+class HelmetTable:
+    """
+    Fixed-layout table holding the latest packet of every helmet, keyed by the
+    helmet ID in field 0. A helmet is given a row the first time it is heard,
+    after which an update is one dict lookup and one row write.
+    Every update bumps a table-wide version; each row and each field records
+    the version that last changed it, so deltas since any version are cheap.
+    Rows of evicted helmets (see evict_offline_helmets) have ID None and are
+    reused before the table grows.
+    All methods expect the caller to hold data_lock.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = {}                      # helmet_id -> row index
+        self.ids = []                        # row index -> helmet_id, None for a free row
+        self.free = []                       # rows of evicted helmets
+        self.raw = [None] * capacity         # packet fields exactly as received
+        self.values = np.full((capacity, NUM_FIELDS), np.nan)
+        self.updated = np.zeros(capacity)
+        self.version = 0
+        self.row_versions = np.zeros(capacity, dtype=np.int64)
+        self.field_versions = np.zeros((capacity, NUM_FIELDS), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def slot_for(self, helmet_id):
+        """
+        Returns the row of a helmet, allocating one if it is new.
+        Returns None when the table is full.
+        """
+        slot = self.slots.get(helmet_id)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+                self.ids[slot] = helmet_id
+            elif len(self.ids) >= self.capacity:
+                return None
+            else:
+                slot = len(self.ids)
+                self.ids.append(helmet_id)
+            self.slots[helmet_id] = slot
+        return slot
+
+    def load_ids(self, ids):
+        """
+        Recreates the row layout of a snapshot; None marks a free row.
+        """
+        self.ids = list(ids)
+        self.slots = {helmet_id: slot for slot, helmet_id in enumerate(ids) if helmet_id is not None}
+        self.free = [slot for slot, helmet_id in enumerate(ids) if helmet_id is None]
+
+    def clear_row(self, slot):
+        self.raw[slot] = None
+        self.values[slot] = np.nan
+        self.updated[slot] = 0
+        self.row_versions[slot] = 0
+        self.field_versions[slot] = 0
+
+    def evict(self, slot):
+        """
+        Forgets the helmet of a row and frees the row for reuse.
+        """
+        del self.slots[self.ids[slot]]
+        self.ids[slot] = None
+        self.clear_row(slot)
+        self.free.append(slot)
+
+    def update(self, parts, now):
+        """
+        Stores a parsed packet in its helmet's row and returns the row index.
+        """
+        slot = self.slot_for(parts[0])
+        if slot is None:
+            return None
+        self.version += 1
+        previous = self.raw[slot]
+        if previous is None:
+            self.field_versions[slot] = self.version
+        else:
+            for i, value in enumerate(parts):
+                if previous[i] != value:
+                    self.field_versions[slot, i] = self.version
+        self.row_versions[slot] = self.version
+        self.raw[slot] = parts
+        self.values[slot] = [to_float(p) for p in parts]
+        self.updated[slot] = now
+        return slot
+
+    def last_changes(self, slot):
+        """
+        Returns {field index: value} for the fields changed by the row's latest update.
+        """
+        changed = np.flatnonzero(self.field_versions[slot] == self.row_versions[slot])
+        return {int(i): self.raw[slot][i] for i in changed}
+
+    def delta(self, since, ids=None):
+        """
+        Copies what changed after version `since`: per helmet the update time
+        and the changed fields as {field index: value}.
+        """
+        if ids is None:
+            slots = np.flatnonzero(self.row_versions[:len(self.ids)] > since)
+        else:
+            slots = [self.slots[h] for h in ids if h in self.slots and self.row_versions[self.slots[h]] > since]
+        helmets = {}
+        for slot in slots:
+            changed = np.flatnonzero(self.field_versions[slot] > since)
+            helmet_id = self.ids[slot]
+            helmets[helmet_id] = {
+                "id": helmet_id,
+                "updated": float(self.updated[slot]),
+                "changes": {int(i): self.raw[slot][i] for i in changed},
+            }
+        return helmets
+
+    def row(self, helmet_id):
+        """
+        Returns a copy of one helmet's state, or None if it was never seen.
+        """
+        slot = self.slots.get(helmet_id)
+        if slot is None:
+            return None
+        return {"id": helmet_id, "values": list(self.raw[slot]), "updated": float(self.updated[slot])}
+
+    def snapshot(self, ids=None):
+        """
+        Copies the requested helmets (all of them when ids is None) so the
+        result can be serialized after data_lock is released.
+        """
+        if ids is None:
+            ids = self.ids
+        helmets = {}
+        for helmet_id in ids:
+            row = self.row(helmet_id)
+            if row is not None:
+                helmets[helmet_id] = row
+        return helmets
+
+helmet_table = HelmetTable(MAX_HELMETS)
+
+# --- Per-Helmet History ---
+# Every field after the ID is a history channel
+HISTORY_CHANNELS = SENSOR_LABELS[1:]
+HISTORY_SAMPLES = int(os.environ.get('HISTORY_SAMPLES', 21600))   # per helmet (6 h at 1 Hz)
+HISTORY_MAX_MB = float(os.environ.get('HISTORY_MAX_MB', 64))     # across all helmets
+MAX_HISTORY_BUCKETS = 2000
+
+class RingBuffer:
+    """
+    Fixed-size circular buffer of (timestamp, channel values) for one helmet.
+    """
+    def __init__(self, size, channels):
+        self.size = size
+        self.times = np.zeros(size)
+        self.samples = np.full((size, channels), np.nan, dtype=np.float32)
+        self.head = 0      # next write position
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.samples.nbytes
+
+    def append(self, t, row):
+        self.times[self.head] = t
+        self.samples[self.head] = row
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def extend(self, times, samples):
+        """
+        Appends many samples at once (oldest first); only the newest `size` are kept.
+        """
+        n = min(len(times), self.size)
+        positions = (self.head + np.arange(n)) % self.size
+        self.times[positions] = times[len(times) - n:]
+        self.samples[positions] = samples[len(samples) - n:]
+        self.head = (self.head + n) % self.size
+        self.count = min(self.count + n, self.size)
+
+    def since(self, start):
+        """
+        Returns copies of the samples recorded at or after start, oldest first.
+        """
+        if self.count < self.size:
+            first = np.searchsorted(self.times[:self.count], start)
+            return self.times[first:self.count].copy(), self.samples[first:self.count].copy()
+        # Each side of the write position is sorted; only the matching tail is copied
+        older = self.head + np.searchsorted(self.times[self.head:], start)
+        newer = np.searchsorted(self.times[:self.head], start)
+        return (np.concatenate((self.times[older:], self.times[newer:self.head])),
+                np.concatenate((self.samples[older:], self.samples[newer:self.head])))
+
+class HelmetHistory:
+    """
+    Ring buffers of recent readings, one per helmet row of the HelmetTable.
+    Buffers are allocated on a helmet's first packet until max_bytes is used up.
+    All methods expect the caller to hold data_lock.
+    """
+    def __init__(self, samples_per_helmet, max_bytes):
+        self.samples_per_helmet = samples_per_helmet
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.rings = {}          # helmet row -> RingBuffer
+        self.full = False
+
+    def ring_for(self, slot):
+        """
+        Returns the ring of a helmet row, allocating one while memory allows.
+        """
+        ring = self.rings.get(slot)
+        if ring is None:
+            if self.full:
+                return None
+            ring = RingBuffer(self.samples_per_helmet, len(HISTORY_CHANNELS))
+            if self.nbytes + ring.nbytes > self.max_bytes:
+                self.full = True
+                log_event(f"⚠️ Warning: History memory cap ({self.max_bytes / (1024 * 1024):g} MB) reached, "
+                          "new helmets will have no history")
+                return None
+            self.rings[slot] = ring
+            self.nbytes += ring.nbytes
+        return ring
+
+    def drop(self, slot):
+        ring = self.rings.pop(slot, None)
+        if ring is not None:
+            self.nbytes -= ring.nbytes
+            self.full = False
+
+    def append(self, slot, t, values):
+        ring = self.ring_for(slot)
+        if ring is not None:
+            ring.append(t, values[1:])
+
+    def since(self, slot, start):
+        ring = self.rings.get(slot)
+        if ring is None:
+            return np.zeros(0), np.zeros((0, len(HISTORY_CHANNELS)), dtype=np.float32)
+        return ring.since(start)
+
+helmet_history = HelmetHistory(HISTORY_SAMPLES, int(HISTORY_MAX_MB * 1024 * 1024))
+
+def nan_to_none(array):
+    """
+    Converts a NumPy array to a JSON-safe list, with NaN as None.
+    """
+    return [None if v != v else v for v in array.tolist()]
+
+def downsample(times, samples, start, resolution):
+    """
+    Groups samples into fixed-width time buckets and returns the bucket start
+    times, sample counts and per-channel min/max/mean.
+    Non-numeric readings are stored as NaN and ignored by the aggregates.
+    """
+    if len(times) == 0:
+        empty = np.zeros((0, samples.shape[1]))
+        return np.zeros(0), np.zeros(0, dtype=int), empty, empty, empty
+    buckets = ((times - start) // resolution).astype(np.int64)
+    bucket_ids, offsets, counts = np.unique(buckets, return_index=True, return_counts=True)
+    valid = ~np.isnan(samples)
+    sums = np.add.reduceat(np.where(valid, samples, 0).astype(np.float64), offsets, axis=0)
+    valid_counts = np.add.reduceat(valid, offsets, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / valid_counts
+    mins = np.fmin.reduceat(samples, offsets, axis=0)
+    maxs = np.fmax.reduceat(samples, offsets, axis=0)
+    return start + bucket_ids * resolution, counts, mins, maxs, means
+
+# --- Spatial Index of Helmet Positions ---
+SPATIAL_CELL_METRES = float(os.environ.get('SPATIAL_CELL_METRES', 10))
+NEAREST_MAX_K = int(os.environ.get('NEAREST_MAX_K', 100))
+
+class SpatialGrid:
+    """
+    Uniform grid over the latest X/Y of every helmet. Moving a helmet is a
+    dict update, and radius / nearest queries only visit the cells that can
+    contain an answer. All methods expect the caller to hold data_lock.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}          # (cx, cy) -> set of helmet IDs
+        self.positions = {}      # helmet_id -> (x, y, cell)
+
+    def cell_of(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def update(self, helmet_id, x, y):
+        previous = self.positions.get(helmet_id)
+        # float() also accepts "inf" from a packet, which has no grid cell
+        if not (math.isfinite(x) and math.isfinite(y)):
+            if previous is not None:
+                self.remove(helmet_id)
+            return
+        cell = self.cell_of(x, y)
+        if previous is not None and previous[2] != cell:
+            members = self.cells[previous[2]]
+            members.discard(helmet_id)
+            if not members:
+                del self.cells[previous[2]]
+        if previous is None or previous[2] != cell:
+            self.cells.setdefault(cell, set()).add(helmet_id)
+        self.positions[helmet_id] = (x, y, cell)
+
+    def remove(self, helmet_id):
+        x, y, cell = self.positions.pop(helmet_id)
+        members = self.cells[cell]
+        members.discard(helmet_id)
+        if not members:
+            del self.cells[cell]
+
+    def location(self, helmet_id):
+        position = self.positions.get(helmet_id)
+        return None if position is None else position[:2]
+
+    def within(self, x, y, radius):
+        """
+        Returns [(distance, helmet_id)] for helmets within radius of (x, y), nearest first.
+        """
+        low_x, low_y = self.cell_of(x - radius, y - radius)
+        high_x, high_y = self.cell_of(x + radius, y + radius)
+        found = []
+        if (high_x - low_x + 1) * (high_y - low_y + 1) > len(self.cells):
+            # The radius covers more cells than are occupied; walk the occupied ones
+            candidates = (h for (cx, cy), members in self.cells.items()
+                          if low_x <= cx <= high_x and low_y <= cy <= high_y for h in members)
+        else:
+            candidates = (h for cx in range(low_x, high_x + 1) for cy in range(low_y, high_y + 1)
+                          for h in self.cells.get((cx, cy), ()))
+        for helmet_id in candidates:
+            hx, hy, _ = self.positions[helmet_id]
+            distance = math.hypot(hx - x, hy - y)
+            if distance <= radius:
+                found.append((distance, helmet_id))
+        found.sort()
+        return found
+
+    def copy(self):
+        """
+        Returns an independent grid with the same helmets, so a long query can
+        run on it after data_lock is released.
+        """
+        grid = SpatialGrid(self.cell_size)
+        grid.cells = {cell: set(members) for cell, members in self.cells.items()}
+        grid.positions = dict(self.positions)
+        return grid
+
+    def nearest(self, x, y, k):
+        """
+        Returns the k nearest [(distance, helmet_id)], searching rings of cells
+        outward until no unvisited cell can hold anything closer. Once the rings
+        would cover more cells than are occupied, the remaining occupied cells
+        are scanned directly, so a far-away straggler cannot make the walk long.
+        """
+        if not self.positions or k <= 0:
+            return []
+        cx, cy = self.cell_of(x, y)
+        best = []
+
+        def consider(members):
+            for helmet_id in members:
+                hx, hy, _ = self.positions[helmet_id]
+                heapq.heappush(best, (-math.hypot(hx - x, hy - y), helmet_id))
+                if len(best) > k:
+                    heapq.heappop(best)
+
+        ring = 0
+        while True:
+            for ix in range(cx - ring, cx + ring + 1):
+                for iy in (range(cy - ring, cy + ring + 1) if ix in (cx - ring, cx + ring) else (cy - ring, cy + ring)):
+                    consider(self.cells.get((ix, iy), ()))
+            # Every point outside the rings visited so far is at least this far away
+            reach = ring * self.cell_size
+            if len(best) == k and -best[0][0] <= reach:
+                break
+            ring += 1
+            if (2 * ring + 1) ** 2 > len(self.cells):
+                # Walk the occupied cells outside the rings already visited
+                for (ix, iy), members in self.cells.items():
+                    if max(abs(ix - cx), abs(iy - cy)) >= ring:
+                        consider(members)
+                break
+        return sorted((-d, h) for d, h in best)
+
+helmet_grid = SpatialGrid(SPATIAL_CELL_METRES)
+
+# --- Per-Box Live Rollups ---
+STALE_SECONDS = float(os.environ.get('STALE_SECONDS', 30))
+GAS_FIELDS = [1, 2, 3]          # MQ2, MQ7, MQ135
+FALL_FIELD = 4
+SPO2_FIELD = 7
+
+class BoxRollup:
+    """
+    Live aggregates over the helmets of one box subtree.
+    """
+    def __init__(self):
+        self.members = set()
+        self.member_slots = None     # NumPy array of member rows, rebuilt when membership changes
+        self.worst_gas = [float('-inf')] * len(GAS_FIELDS)
+        self.worst_gas_helmet = [None] * len(GAS_FIELDS)
+        self.min_spo2 = float('inf')
+        self.min_spo2_helmet = None
+        self.fallen = 0
+        self.dirty = True
+
+class BoxRollups:
+    """
+    Keeps worst gas readings, minimum SpO2 and the fallen-worker count of
+    every box that has helmets in its subtree, updated as packets arrive.
+    A packet only touches the boxes that contain its helmet. When the helmet
+    holding a box's worst value improves, that box is marked dirty and
+    recomputed from its own members on the next read.
+    All methods expect the caller to hold data_lock.
+    """
+    def __init__(self):
+        self.loaded = False
+        self.parents = {}            # box_id -> parent box_id
+        self.direct = {}             # box_id -> helmet IDs assigned to that box itself
+        self.rollups = {}            # box_id -> BoxRollup for boxes with helmets in their subtree
+        self.helmet_boxes = {}       # helmet_id -> box IDs whose subtree contains it
+        self.fallen = set()
+
+    def load(self, rows):
+        """
+        Builds the assignment maps from (id, parent_id, helmet_ids JSON) rows.
+        """
+        self.parents = {row[0]: row[1] for row in rows}
+        self.direct = {row[0]: set(json.loads(row[2])) for row in rows if row[2] != '[]'}
+        self.rebuild()
+        self.loaded = True
+
+    def add_box(self, box_id, parent_id):
+        self.parents[box_id] = parent_id
+
+    def assign(self, box_id, helmet_ids):
+        self.assign_many([(box_id, helmet_ids)])
+
+    def assign_many(self, assignments):
+        """
+        Applies (box_id, helmet IDs) pairs with a single rebuild.
+        """
+        for box_id, helmet_ids in assignments:
+            if helmet_ids:
+                self.direct[box_id] = set(helmet_ids)
+            else:
+                self.direct.pop(box_id, None)
+        self.rebuild()
+
+    def rebuild(self):
+        self.rollups = {}
+        self.helmet_boxes = {}
+        for box_id, helmets in self.direct.items():
+            chain = []
+            while box_id is not None and box_id not in chain:
+                chain.append(box_id)
+                box_id = self.parents.get(box_id)
+            for ancestor in chain:
+                self.rollups.setdefault(ancestor, BoxRollup()).members |= helmets
+                for helmet_id in helmets:
+                    self.helmet_boxes.setdefault(helmet_id, set()).add(ancestor)
+
+    def on_packet(self, helmet_id, values, new_helmet):
+        # Track falls for every helmet so counts stay right when one is assigned later
+        fallen = values[FALL_FIELD] >= 0.5
+        fall_delta = 0
+        if fallen and helmet_id not in self.fallen:
+            self.fallen.add(helmet_id)
+            fall_delta = 1
+        elif not fallen and helmet_id in self.fallen:
+            self.fallen.discard(helmet_id)
+            fall_delta = -1
+        boxes = self.helmet_boxes.get(helmet_id)
+        if not boxes:
+            return
+        spo2 = values[SPO2_FIELD]
+        for box_id in boxes:
+            rollup = self.rollups[box_id]
+            rollup.fallen += fall_delta
+            if new_helmet:
+                rollup.member_slots = None
+            if rollup.dirty:
+                continue
+            for i, field in enumerate(GAS_FIELDS):
+                value = values[field]
+                if value > rollup.worst_gas[i]:
+                    rollup.worst_gas[i] = value
+                    rollup.worst_gas_helmet[i] = helmet_id
+                elif rollup.worst_gas_helmet[i] == helmet_id and not value == rollup.worst_gas[i]:
+                    rollup.dirty = True
+            if spo2 < rollup.min_spo2:
+                rollup.min_spo2 = spo2
+                rollup.min_spo2_helmet = helmet_id
+            elif rollup.min_spo2_helmet == helmet_id and not spo2 == rollup.min_spo2:
+                rollup.dirty = True
+
+    def forget(self, helmet_id):
+        """
+        Drops an evicted helmet from the live aggregates; it stays assigned.
+        """
+        self.fallen.discard(helmet_id)
+        for box_id in self.helmet_boxes.get(helmet_id, ()):
+            rollup = self.rollups[box_id]
+            rollup.member_slots = None
+            rollup.dirty = True
+
+    def recompute(self, rollup):
+        rollup.worst_gas = [float('-inf')] * len(GAS_FIELDS)
+        rollup.worst_gas_helmet = [None] * len(GAS_FIELDS)
+        rollup.min_spo2, rollup.min_spo2_helmet = float('inf'), None
+        rollup.fallen = 0
+        for helmet_id in rollup.members:
+            slot = helmet_table.slots.get(helmet_id)
+            if slot is None:
+                continue
+            values = helmet_table.values[slot]
+            for i, field in enumerate(GAS_FIELDS):
+                if values[field] > rollup.worst_gas[i]:
+                    rollup.worst_gas[i], rollup.worst_gas_helmet[i] = float(values[field]), helmet_id
+            if values[SPO2_FIELD] < rollup.min_spo2:
+                rollup.min_spo2, rollup.min_spo2_helmet = float(values[SPO2_FIELD]), helmet_id
+            if values[FALL_FIELD] >= 0.5:
+                rollup.fallen += 1
+        rollup.dirty = False
+
+    def summary(self, box_id, now):
+        """
+        Returns the aggregates of a box subtree, or None if it has no helmets.
+        """
+        rollup = self.rollups.get(box_id)
+        if rollup is None:
+            return None
+        if rollup.dirty:
+            self.recompute(rollup)
+        if rollup.member_slots is None:
+            rollup.member_slots = np.array([helmet_table.slots[h] for h in rollup.members if h in helmet_table.slots],
+                                           dtype=np.int64)
+        heard = len(rollup.member_slots)
+        stale = int((helmet_table.updated[rollup.member_slots] < now - STALE_SECONDS).sum()) + len(rollup.members) - heard
+
+        def finite(value):
+            return value if math.isfinite(value) else None
+
+        return {
+            "helmets": len(rollup.members),
+            "worst_gas": {SENSOR_LABELS[field]: {"value": finite(rollup.worst_gas[i]), "helmet": rollup.worst_gas_helmet[i]}
+                          for i, field in enumerate(GAS_FIELDS)},
+            "min_spo2": {"value": finite(rollup.min_spo2), "helmet": rollup.min_spo2_helmet},
+            "fallen": rollup.fallen,
+            "stale": stale,
+        }
+
+box_rollups = BoxRollups()
+
+# --- Streaming Anomaly Detection ---
+ANOMALY_CHANNELS = ["mq2", "mq7", "mq135", "fall", "x", "y", "spo2", "heart_rate"]   # fields 1-8
+ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA', 0.05))                # EWMA weight per packet
+ANOMALY_TREND_SECONDS = float(os.environ.get('ANOMALY_TREND_SECONDS', 600))  # rate-of-change time constant
+ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', 30))                  # packets before z-scores count
+FALL_WINDOW = int(os.environ.get('FALL_WINDOW', 8))                         # packets, at most 16
+# Smallest standard deviation used for z-scores, so a sensor that has read the
+# same value for a while does not flag its first one-unit wobble
+ANOMALY_MIN_STD = [5.0, 2.0, 5.0, 1.0, 1.0, 1.0, 0.5, 2.0]
+
+class AnomalyDetector:
+    """
+    Incremental per-helmet statistics for every numeric channel: EWMA mean and
+    variance, and an EWMA of the rate of change (per minute) with time constant
+    ANOMALY_TREND_SECONDS. Each packet costs a fixed handful of vector
+    operations on one row and no memory is allocated per helmet after start.
+    The detector only produces scores; the alert engine turns them into
+    alerts with its usual trigger/clear/debounce rules.
+      <channel>_z      z-score of the latest reading against the running mean
+      <channel>_trend  smoothed rate of change, units per minute
+      fall_hits        packets with the fall flag set among the last FALL_WINDOW
+    All methods expect the caller to hold data_lock.
+    """
+    def __init__(self, capacity):
+        channels = len(ANOMALY_CHANNELS)
+        self.mean = np.zeros((capacity, channels), dtype=np.float32)
+        self.var = np.zeros((capacity, channels), dtype=np.float32)
+        self.rate = np.zeros((capacity, channels), dtype=np.float32)
+        self.last_value = np.full((capacity, channels), np.nan, dtype=np.float32)
+        self.last_time = np.zeros(capacity)
+        self.count = np.zeros((capacity, channels), dtype=np.int32)
+        self.fall_bits = np.zeros(capacity, dtype=np.uint16)    # one bit per recent packet
+        self.min_std = np.array(ANOMALY_MIN_STD, dtype=np.float32)
+        self.names = ([f"{c}_z" for c in ANOMALY_CHANNELS] + [f"{c}_trend" for c in ANOMALY_CHANNELS]
+                      + ["fall_hits"])
+        self.scores = np.full((capacity, len(self.names)), np.nan, dtype=np.float32)
+        self.fall_mask = (1 << min(FALL_WINDOW, 16)) - 1
+
+    def update(self, slot, now, values):
+        """
+        Folds one packet (a HelmetTable row) into the helmet's statistics.
+        """
+        channels = len(ANOMALY_CHANNELS)
+        x = values[1:].astype(np.float32)
+        valid = np.isfinite(x)
+        mean, var, count = self.mean[slot], self.var[slot], self.count[slot]
+
+        # Score against the statistics before this packet is folded in
+        std = np.maximum(np.sqrt(var), self.min_std)
+        z = (x - mean) / std
+        self.scores[slot, :channels] = np.where(valid & (count >= ANOMALY_WARMUP), z, np.nan)
+
+        # The first reading seeds the mean; missing readings leave a channel untouched
+        alpha = np.where(valid, np.where(count == 0, 1, ANOMALY_ALPHA), 0).astype(np.float32)
+        diff = np.where(valid, x - mean, 0)
+        increment = alpha * diff
+        mean += increment
+        var[:] = (1 - alpha) * (var + diff * increment)
+        count += valid
+
+        dt = now - self.last_time[slot]
+        last = self.last_value[slot]
+        if self.last_time[slot] and dt > 0:
+            # Time-weighted EWMA of the slope, so irregular packet spacing does not bias it
+            weight = np.float32(1 - math.exp(-dt / ANOMALY_TREND_SECONDS))
+            step = np.isfinite(last) & valid
+            slope = np.where(step, (x - last) / np.float32(dt / 60), 0)
+            self.rate[slot] = np.where(step, self.rate[slot] + weight * (slope - self.rate[slot]), self.rate[slot])
+        self.scores[slot, channels:2 * channels] = self.rate[slot]
+        last[:] = np.where(valid, x, last)
+        self.last_time[slot] = now
+
+        fell = bool(values[FALL_FIELD] >= 0.5)
+        bits = ((int(self.fall_bits[slot]) << 1) | fell) & self.fall_mask
+        self.fall_bits[slot] = bits
+        self.scores[slot, -1] = bits.bit_count()
+
+    def reset(self, slot):
+        for array in (self.mean, self.var, self.rate, self.last_time, self.count, self.fall_bits):
+            array[slot] = 0
+        self.last_value[slot] = np.nan
+        self.scores[slot] = np.nan
+
+    def describe(self, slot):
+        """
+        Current statistics and scores of one helmet, for the API.
+        """
+        channels = {}
+        for i, name in enumerate(ANOMALY_CHANNELS):
+            channels[name] = {
+                "mean": float(self.mean[slot, i]),
+                "std": float(np.sqrt(self.var[slot, i])),
+                "trend_per_min": float(self.rate[slot, i]),
+                "z": None if math.isnan(self.scores[slot, i]) else float(self.scores[slot, i]),
+                "samples": int(self.count[slot, i]),
+            }
+        return {"channels": channels, "fall_hits": int(self.scores[slot, -1])}
+
+anomaly_detector = AnomalyDetector(MAX_HELMETS)
+
+# --- Per-Helmet Link Quality ---
+LINK_WINDOW_PACKETS = int(os.environ.get('LINK_WINDOW_PACKETS', 100))     # decay horizon of the rates
+LINK_DEGRADED_LOSS_PCT = float(os.environ.get('LINK_DEGRADED_LOSS_PCT', 20))
+LINK_DEGRADED_ERROR_PCT = float(os.environ.get('LINK_DEGRADED_ERROR_PCT', 10))
+LINK_WHEEL_TICK_SECONDS = 1.0
+LINK_WHEEL_SLOTS = 64
+LINK_STATES = ["ok", "degraded", "stale"]
+
+class LinkQuality:
+    """
+    Radio link statistics per helmet row: last seen, the nominal packet
+    interval, inter-arrival jitter (RFC 3550 style, against the nominal
+    interval), and loss and parse-error percentages over roughly the last
+    LINK_WINDOW_PACKETS packets.
+    Loss comes from sequence gaps when packets carry a sequence number
+    (binary frames) and otherwise from arrival gaps of whole nominal intervals.
+    Silence is detected with a hashed timer wheel: a helmet sits in the slot
+    of its deadline (last seen + STALE_SECONDS) and a packet only moves the
+    deadline, so no per-tick scan of every helmet is needed. When a slot
+    comes due, entries whose deadline moved are re-filed and the rest
+    become stale.
+    All methods expect the caller to hold data_lock.
+    """
+    def __init__(self, capacity):
+        self.last_seen = np.zeros(capacity)
+        self.nominal = np.zeros(capacity)           # seconds between packets
+        self.jitter = np.zeros(capacity)
+        self.last_seq = np.full(capacity, -1, dtype=np.int64)
+        self.received = np.zeros(capacity)          # decayed packet counts
+        self.lost = np.zeros(capacity)
+        self.errors = np.zeros(capacity)
+        self.stale = np.zeros(capacity, dtype=bool)
+        self.changed = np.zeros(capacity, dtype=bool)   # stale flag flipped since the alert engine looked
+        self.deadline = np.zeros(capacity)
+        self.scheduled = np.zeros(capacity, dtype=bool)
+        self.wheel = [[] for _ in range(LINK_WHEEL_SLOTS)]
+        self.wheel_tick = None                      # last tick processed
+        self.decay = 1 - 1 / LINK_WINDOW_PACKETS
+        self.names = ["link_stale", "link_loss_pct", "link_error_pct", "link_jitter"]
+
+    def on_packet(self, slot, now, seq=None):
+        missed = 0
+        interval = now - self.last_seen[slot]
+        # A silence longer than STALE_SECONDS is reported as stale, not as loss
+        if self.last_seen[slot] and interval <= STALE_SECONDS:
+            if seq is not None and self.last_seq[slot] >= 0:
+                gap = (seq - self.last_seq[slot] - 1) % 65536
+                missed = gap if gap < 1000 else 0       # larger jumps are a helmet reboot
+            elif self.nominal[slot]:
+                missed = max(round(interval / self.nominal[slot]) - 1, 0)
+            if not self.nominal[slot]:
+                self.nominal[slot] = interval
+            elif missed == 0:
+                # Learn the packet rate and jitter from gap-free intervals only
+                self.jitter[slot] += (abs(interval - self.nominal[slot]) - self.jitter[slot]) / 16
+                self.nominal[slot] += (interval - self.nominal[slot]) / 16
+        if seq is not None:
+            self.last_seq[slot] = seq
+        # Every missed packet counts as a slot of the decay window too
+        decay = self.decay ** (missed + 1)
+        self.received[slot] = self.received[slot] * decay + 1
+        self.lost[slot] = self.lost[slot] * decay + missed
+        self.errors[slot] *= self.decay
+        self.last_seen[slot] = now
+        self.deadline[slot] = now + STALE_SECONDS
+        if self.stale[slot]:
+            self.stale[slot] = False
+            self.changed[slot] = True
+        if not self.scheduled[slot]:
+            self.schedule(slot)
+
+    def on_parse_error(self, slot):
+        self.errors[slot] += 1
+
+    def reset(self, slot):
+        if self.scheduled[slot]:
+            for bucket in self.wheel:
+                if slot in bucket:
+                    bucket.remove(slot)
+        for array in (self.last_seen, self.nominal, self.jitter, self.received, self.lost, self.errors,
+                      self.stale, self.changed, self.deadline, self.scheduled):
+            array[slot] = 0
+        self.last_seq[slot] = -1
+
+    def schedule(self, slot, earliest_tick=None):
+        tick = int(self.deadline[slot] // LINK_WHEEL_TICK_SECONDS)
+        if earliest_tick is not None:
+            tick = max(tick, earliest_tick)
+        self.wheel[tick % LINK_WHEEL_SLOTS].append(slot)
+        self.scheduled[slot] = True
+
+    def advance(self, now):
+        """
+        Processes the wheel slots that came due since the last call and
+        returns the rows that just went stale.
+        """
+        current = int(now // LINK_WHEEL_TICK_SECONDS)
+        if self.wheel_tick is None:
+            self.wheel_tick = current - 1
+        # After a long pause one lap of the wheel visits every slot
+        first = max(self.wheel_tick + 1, current - LINK_WHEEL_SLOTS + 1)
+        expired = []
+        for tick in range(first, current + 1):
+            bucket = self.wheel[tick % LINK_WHEEL_SLOTS]
+            self.wheel[tick % LINK_WHEEL_SLOTS] = []
+            for slot in bucket:
+                if self.deadline[slot] > now:
+                    # Heard from since, or not due yet. A deadline later in the
+                    # current tick goes to the next one; filing it back into the
+                    # slot being drained would delay it by a whole lap.
+                    self.schedule(slot, current + 1)
+                else:
+                    self.scheduled[slot] = False
+                    self.stale[slot] = True
+                    self.changed[slot] = True
+                    expired.append(slot)
+        self.wheel_tick = current
+        return expired
+
+    def reschedule(self, count, now):
+        """
+        Files every helmet that is not already stale in the wheel after its
+        statistics were restored from a snapshot. Deadlines that passed while
+        the server was down come due on the next tick.
+        """
+        heard = self.last_seen[:count] > 0
+        self.deadline[:count] = np.where(heard, self.last_seen[:count] + STALE_SECONDS, 0)
+        current = int(now // LINK_WHEEL_TICK_SECONDS)
+        for slot in np.flatnonzero(heard & ~self.stale[:count]):
+            tick = max(int(self.deadline[slot] // LINK_WHEEL_TICK_SECONDS), current)
+            self.wheel[tick % LINK_WHEEL_SLOTS].append(slot)
+            self.scheduled[slot] = True
+        self.wheel_tick = current - 1
+
+    def loss_pct(self, slot):
+        total = self.received[slot] + self.lost[slot]
+        return 100 * self.lost[slot] / total if total else 0.0
+
+    def error_pct(self, slot):
+        total = self.received[slot] + self.errors[slot]
+        return 100 * self.errors[slot] / total if total else 0.0
+
+    def state(self, slot):
+        if self.stale[slot]:
+            return "stale"
+        if self.loss_pct(slot) > LINK_DEGRADED_LOSS_PCT or self.error_pct(slot) > LINK_DEGRADED_ERROR_PCT:
+            return "degraded"
+        return "ok"
+
+    def scores(self, count):
+        """
+        Columns for the alert engine, in the order of self.names.
+        """
+        received = self.received[:count]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            loss = 100 * self.lost[:count] / (received + self.lost[:count])
+            errors = 100 * self.errors[:count] / (received + self.errors[:count])
+        return np.column_stack([self.stale[:count], loss, errors, self.jitter[:count]])
+
+    def take_changed(self, count):
+        changed = self.changed[:count].copy()
+        self.changed[:count] = False
+        return changed
+
+    def describe(self, slot, now):
+        return {
+            "state": self.state(slot),
+            "last_seen": float(self.last_seen[slot]),
+            "silent_for": float(now - self.last_seen[slot]),
+            "interval": float(self.nominal[slot]),
+            "jitter": float(self.jitter[slot]),
+            "loss_pct": round(float(self.loss_pct(slot)), 2),
+            "parse_error_pct": round(float(self.error_pct(slot)), 2),
+        }
+
+link_quality = LinkQuality(MAX_HELMETS)
+
+# --- Live Push Feed (Server-Sent Events) ---
+STREAM_COALESCE_SECONDS = float(os.environ.get('STREAM_COALESCE_SECONDS', 0.25))
+STREAM_KEEPALIVE_SECONDS = 15
+
+class StreamSubscriber:
+    """
+    One streaming client: an optional helmet filter, the changes queued for it
+    and an event that wakes its response generator.
+    """
+    def __init__(self, helmet_ids=None):
+        self.helmet_ids = helmet_ids
+        self.pending = {}
+        self.event = threading.Event()
+
+class LiveFeed:
+    """
+    Fans changed helmet fields out to streaming subscribers.
+    Each subscriber keeps a pending dict of helmet_id -> {field index: value};
+    changes that arrive before the subscriber wakes up are merged into it, so
+    a burst of packets becomes a single push.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    def subscribe(self, helmet_ids=None):
+        subscriber = StreamSubscriber(helmet_ids)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, helmet_id, changes):
+        with self.lock:
+            for subscriber in self.subscribers:
+                if subscriber.helmet_ids is not None and helmet_id not in subscriber.helmet_ids:
+                    continue
+                subscriber.pending.setdefault(helmet_id, {}).update(changes)
+                subscriber.event.set()
+
+    def take(self, subscriber):
+        """
+        Returns and clears everything queued for a subscriber.
+        """
+        with self.lock:
+            pending = subscriber.pending
+            subscriber.pending = {}
+            subscriber.event.clear()
+        return pending
+
+live_feed = LiveFeed()
+
+# --- Persistent Telemetry Store ---
+TELEMETRY_DIR = os.environ.get('TELEMETRY_DIR', 'telemetry')
+TELEMETRY_SEGMENT_SECONDS = int(os.environ.get('TELEMETRY_SEGMENT_SECONDS', 3600))
+TELEMETRY_FLUSH_SECONDS = float(os.environ.get('TELEMETRY_FLUSH_SECONDS', 1.0))
+TELEMETRY_FSYNC_SECONDS = float(os.environ.get('TELEMETRY_FSYNC_SECONDS', 10.0))
+TELEMETRY_MAX_PENDING = int(os.environ.get('TELEMETRY_MAX_PENDING', 100000))   # rows buffered for the writer
+
+# One file per column per segment; rows are appended in arrival order, so
+# every column of a segment is sorted by time.
+TELEMETRY_COLUMNS = [
+    ("time", "<f8"), ("helmet", "<i4"),
+    ("mq2", "<f4"), ("mq7", "<f4"), ("mq135", "<f4"), ("fall", "<f4"),
+    ("x", "<f4"), ("y", "<f4"), ("spo2", "<f4"), ("heart_rate", "<f4"),
+]
+
+class TelemetryStore:
+    """
+    Append-only on-disk store of every ingested packet.
+    Packets are buffered in memory and written by a background thread in
+    batches, one fixed-width binary file per column, in segment directories
+    rotated every TELEMETRY_SEGMENT_SECONDS. Files are fsynced at most every
+    TELEMETRY_FSYNC_SECONDS. Reads map the column files with numpy.memmap, so
+    a range scan only pages in the rows it touches.
+    """
+    def __init__(self, directory, segment_seconds):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.lock = threading.Lock()
+        self.pending = deque(maxlen=TELEMETRY_MAX_PENDING)
+        self.open_files = {}        # column -> file of the current segment
+        self.open_segment = None
+        self.last_fsync = time.time()
+
+    def append(self, t, values):
+        """
+        Queues one packet (the helmet table row, ID in column 0) for writing.
+        """
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                # The disk is not keeping up; the deque discards the oldest row
+                pipeline_dropped_total.inc("telemetry", "dropped")
+            self.pending.append((t, *values))
+
+    def segment_path(self, segment_start):
+        return os.path.join(self.directory, f"seg-{int(segment_start)}")
+
+    def segments(self):
+        """
+        Returns (start time, path) of every segment, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith('seg-'):
+                found.append((int(name[4:]), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def open_segment_files(self, segment_start):
+        if self.open_segment == segment_start:
+            return self.open_files
+        self.close_files()
+        path = self.segment_path(segment_start)
+        os.makedirs(path, exist_ok=True)
+        self.open_files = {name: open(os.path.join(path, f"{name}.bin"), 'ab') for name, _ in TELEMETRY_COLUMNS}
+        self.open_segment = segment_start
+        # A crash between column writes can leave columns of unequal length;
+        # cut them back to the rows every column has before appending
+        rows = min(f.seek(0, os.SEEK_END) // np.dtype(dtype).itemsize
+                   for (name, dtype), f in zip(TELEMETRY_COLUMNS, self.open_files.values()))
+        for name, dtype in TELEMETRY_COLUMNS:
+            f = self.open_files[name]
+            if f.tell() != rows * np.dtype(dtype).itemsize:
+                f.truncate(rows * np.dtype(dtype).itemsize)
+        return self.open_files
+
+    def abandon_files(self):
+        """
+        Closes the current segment after a failed write without syncing, so the
+        next flush reopens and realigns it.
+        """
+        for f in self.open_files.values():
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.open_files = {}
+        self.open_segment = None
+
+    def close_files(self):
+        for f in self.open_files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self.open_files = {}
+        self.open_segment = None
+
+    def flush(self):
+        """
+        Writes every queued packet. Called from the writer thread only.
+        """
+        with self.lock:
+            rows = list(self.pending)
+            self.pending.clear()
+        if not rows:
+            return 0
+        batch = np.array(rows, dtype=np.float64)
+        helmet = batch[:, 1]
+        columns = {
+            "time": batch[:, 0],
+            "helmet": np.where(np.isnan(helmet), -1, helmet).astype('<i4'),
+        }
+        for i, (name, dtype) in enumerate(TELEMETRY_COLUMNS[2:], start=2):
+            columns[name] = batch[:, i].astype(dtype)
+        segment_ids = (batch[:, 0] // self.segment_seconds).astype(np.int64)
+        # Split the batch where it crosses a segment boundary
+        boundaries = np.flatnonzero(np.diff(segment_ids)) + 1
+        try:
+            for lo, hi in zip(np.r_[0, boundaries], np.r_[boundaries, len(batch)]):
+                files = self.open_segment_files(segment_ids[lo] * self.segment_seconds)
+                for name, dtype in TELEMETRY_COLUMNS:
+                    files[name].write(columns[name][lo:hi].astype(dtype, copy=False).tobytes())
+            for f in self.open_files.values():
+                f.flush()
+        except OSError:
+            self.abandon_files()
+            raise
+        if time.time() - self.last_fsync >= TELEMETRY_FSYNC_SECONDS:
+            for f in self.open_files.values():
+                os.fsync(f.fileno())
+            self.last_fsync = time.time()
+        return len(rows)
+
+    def scan(self, start, end, helmet_ids=None, block_rows=None):
+        """
+        Yields one dict of column arrays per segment for rows with
+        start <= time < end, optionally restricted to a set of numeric
+        helmet IDs. Arrays are views of memory-mapped files, copied only when
+        a helmet filter is applied. With block_rows, segments are yielded in
+        slices of at most that many rows, so memory use does not grow with
+        the segment length.
+        """
+        helmets = None
+        if helmet_ids is not None:
+            helmets = np.array([int(h) for h in helmet_ids], dtype='<i4')
+        for segment_start, path in self.segments():
+            if segment_start + self.segment_seconds <= start or segment_start >= end:
+                continue
+            sizes = []
+            for name, dtype in TELEMETRY_COLUMNS:
+                file_path = os.path.join(path, f"{name}.bin")
+                sizes.append(os.path.getsize(file_path) // np.dtype(dtype).itemsize if os.path.exists(file_path) else 0)
+            # A crash between column writes can leave columns of unequal length
+            rows = min(sizes)
+            if rows == 0:
+                continue
+            mapped = {name: np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode='r', shape=(rows,))
+                      for name, dtype in TELEMETRY_COLUMNS}
+            lo, hi = np.searchsorted(mapped["time"], [start, end])
+            step = block_rows or max(hi - lo, 1)
+            for block_lo in range(lo, hi, step):
+                block_hi = min(block_lo + step, hi)
+                chunk = {name: column[block_lo:block_hi] for name, column in mapped.items()}
+                if helmets is not None:
+                    mask = np.isin(chunk["helmet"], helmets)
+                    if not mask.any():
+                        continue
+                    chunk = {name: column[mask] for name, column in chunk.items()}
+                yield chunk
+
+telemetry_store = TelemetryStore(TELEMETRY_DIR, TELEMETRY_SEGMENT_SECONDS)
+
+def run_telemetry_writer():
+    """
+    Flushes queued packets to disk every TELEMETRY_FLUSH_SECONDS.
+    """
+    while True:
+        time.sleep(TELEMETRY_FLUSH_SECONDS)
+        try:
+            telemetry_store.flush()
+        except OSError as e:
+            log_event(f"❌ Error writing telemetry to {TELEMETRY_DIR}. Reason: {e}")
+
+# --- Telemetry Export ---
+# Exports stream the store block by block (EXPORT_BLOCK_ROWS rows at a time),
+# so memory use is the same for an hour or for months of data.
+EXPORT_BLOCK_ROWS = int(os.environ.get('EXPORT_BLOCK_ROWS', 50000))
+EXPORT_LABELS = ["Time"] + SENSOR_LABELS            # same channel labels as the dashboard
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Parquet export is optional; pyarrow is slow to import, so it is loaded on first use
+pa = pq = None
+
+def load_pyarrow():
+    """
+    Imports pyarrow the first time it is needed. Returns False if it is not installed.
+    """
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+def export_blocks(start, end, helmet_ids=None):
+    """
+    Yields (times, helmet numbers, readings) blocks of stored packets, in time order.
+    """
+    channels = [name for name, _ in TELEMETRY_COLUMNS[2:]]
+    for chunk in telemetry_store.scan(start, end, helmet_ids, EXPORT_BLOCK_ROWS):
+        yield (np.asarray(chunk["time"]), np.asarray(chunk["helmet"]),
+               np.column_stack([chunk[name] for name in channels]).astype(np.float64))
+
+def downsample_blocks(blocks, start, resolution):
+    """
+    Averages each helmet's readings over `resolution`-second buckets.
+    Blocks are time-ordered, so every bucket older than the newest one of a
+    block is complete; only the newest is carried over as running sums.
+    Readings that were missing are left out of the mean. The fall column
+    becomes the fraction of packets with the fall flag set.
+    """
+    carry = None
+    for times, helmets, readings in blocks:
+        buckets = ((times - start) // resolution).astype(np.int64)
+        present = ~np.isnan(readings)
+        sums = np.where(present, readings, 0.0)
+        counts = present.astype(np.int64)
+        if carry is not None:
+            buckets, helmets, sums, counts = (np.concatenate([c, a]) for c, a in zip(carry, (buckets, helmets, sums, counts)))
+        order = np.lexsort((helmets, buckets))
+        buckets, helmets = buckets[order], helmets[order]
+        first = np.flatnonzero(np.r_[True, (buckets[1:] != buckets[:-1]) | (helmets[1:] != helmets[:-1])])
+        group = (buckets[first], helmets[first],
+                 np.add.reduceat(sums[order], first, axis=0), np.add.reduceat(counts[order], first, axis=0))
+        newest = group[0] == group[0][-1]
+        carry = tuple(column[newest] for column in group)
+        done = tuple(column[~newest] for column in group)
+        if len(done[0]):
+            yield bucket_means(done, start, resolution)
+    if carry is not None and len(carry[0]):
+        yield bucket_means(carry, start, resolution)
+
+def bucket_means(group, start, resolution):
+    buckets, helmets, sums, counts = group
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return start + buckets * resolution, helmets, means
+
+def export_columns(times, helmets, readings):
+    """
+    Formats a block as one list of strings per column, missing readings as ''.
+    """
+    columns = [np.char.mod('%.3f', times).tolist(), helmets.astype(str).tolist()]
+    for i in range(readings.shape[1]):
+        column = readings[:, i]
+        columns.append(np.where(np.isnan(column), '', np.char.mod('%.7g', column)).tolist())
+    return columns
+
+def export_csv(blocks):
+    yield ",".join(EXPORT_LABELS) + "\n"
+    for block in blocks:
+        rows = zip(*export_columns(*block))
+        yield "".join(",".join(row) + "\n" for row in rows)
+
+def export_ndjson(blocks):
+    for times, helmets, readings in blocks:
+        lines = []
+        for t, helmet, values in zip(times.tolist(), helmets.tolist(), readings.tolist()):
+            record = {"Time": t, "ID": str(helmet)}
+            for label, value in zip(SENSOR_LABELS[1:], values):
+                record[label] = None if value != value else value
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield "\n".join(lines) + "\n" if lines else ""
+
+class ExportSink:
+    """
+    Write-only file object that hands Parquet output back in pieces.
+    """
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def export_parquet(blocks):
+    """
+    Writes each block as one Parquet row group and yields the bytes as they are produced.
+    """
+    schema = pa.schema([("Time", pa.float64()), ("ID", pa.string())]
+                       + [(label, pa.float32()) for label in SENSOR_LABELS[1:]])
+    sink = ExportSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    for times, helmets, readings in blocks:
+        arrays = [pa.array(times), pa.array(helmets.astype(str))]
+        arrays += [pa.array(readings[:, i].astype(np.float32), from_pandas=True) for i in range(readings.shape[1])]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def export_telemetry(fmt, start, end, helmet_ids=None, resolution=None):
+    """
+    Returns a generator of str (CSV, NDJSON) or bytes (Parquet) chunks with
+    every stored packet between start and end, optionally restricted to
+    numeric helmet IDs and averaged over `resolution` seconds.
+    """
+    blocks = export_blocks(start, end, helmet_ids)
+    if resolution:
+        blocks = downsample_blocks(blocks, start, resolution)
+    if fmt == "csv":
+        return export_csv(blocks)
+    if fmt == "ndjson":
+        return export_ndjson(blocks)
+    if fmt == "parquet":
+        if not load_pyarrow():
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+        return export_parquet(blocks)
+    raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}")
+
+def numeric_helmet_ids(helmet_ids):
+    """
+    The telemetry store keys packets by numeric helmet ID; other IDs have no stored rows.
+    """
+    return sorted(int(h) for h in helmet_ids if str(h).strip().lstrip('-').isdigit())
+
+# --- Ingest Pipeline Queues ---
+# Ingest runs as stages connected by bounded queues:
+#   serial read -> frame/parse (one per port) -> state update -> sinks
+# plus a console stage for log lines. A stage never waits on a full queue:
+# it discards the oldest entry (or bytes), or overwrites a queued entry with
+# the same key (coalescing), so a slow consumer costs data but never stalls
+# a reader.
+RAW_QUEUE_BYTES = int(os.environ.get('RAW_QUEUE_BYTES', 65536))       # per port
+PACKET_QUEUE_SIZE = int(os.environ.get('PACKET_QUEUE_SIZE', 4096))
+SINK_QUEUE_SIZE = int(os.environ.get('SINK_QUEUE_SIZE', 8192))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 1000))
+
+class StageQueue:
+    """
+    Bounded FIFO between two ingest stages whose put() never blocks.
+    When full, put() replaces the queued entry with the same key (counted as
+    "coalesced") or else discards the oldest entry (counted as "dropped").
+    """
+    def __init__(self, stage, maxsize):
+        self.stage = stage
+        self.maxsize = maxsize
+        self.entries = deque()      # [key, item]
+        self.by_key = {}            # key -> its queued entry
+        self.cond = threading.Condition()
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, item, key=None):
+        with self.cond:
+            if len(self.entries) >= self.maxsize:
+                queued = self.by_key.get(key) if key is not None else None
+                if queued is not None:
+                    queued[1] = item
+                    pipeline_dropped_total.inc(self.stage, "coalesced")
+                    return
+                self.unlink(self.entries.popleft())
+                pipeline_dropped_total.inc(self.stage, "dropped")
+            entry = [key, item]
+            self.entries.append(entry)
+            if key is not None:
+                self.by_key[key] = entry
+            self.high_water = max(self.high_water, len(self.entries))
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the oldest item, or None if nothing arrives within `timeout` seconds.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.entries, timeout):
+                return None
+            entry = self.entries.popleft()
+            self.unlink(entry)
+            return entry[1]
+
+    def unlink(self, entry):
+        if entry[0] is not None and self.by_key.get(entry[0]) is entry:
+            del self.by_key[entry[0]]
+
+class ByteQueue:
+    """
+    Received bytes of one port waiting for its parse stage. Chunks join one
+    buffer, so a parser that falls behind takes everything in one get().
+    Past maxbytes the oldest bytes are discarded and the parser resyncs.
+    """
+    def __init__(self, stage, maxbytes):
+        self.stage = stage
+        self.maxbytes = maxbytes
+        self.buffer = bytearray()
+        self.reconnected = False
+        self.cond = threading.Condition()
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def put(self, chunk):
+        with self.cond:
+            self.buffer += chunk
+            overflow = len(self.buffer) - self.maxbytes
+            if overflow > 0:
+                del self.buffer[:overflow]
+                pipeline_dropped_bytes_total.add(overflow, self.stage)
+            self.high_water = max(self.high_water, len(self.buffer))
+            self.cond.notify()
+
+    def reconnect(self):
+        """
+        Discards bytes from the previous connection and tells the parser to start afresh.
+        """
+        with self.cond:
+            self.buffer.clear()
+            self.reconnected = True
+            self.cond.notify()
+
+    def get(self):
+        """
+        Returns (reconnected since the last get, all buffered bytes).
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.buffer or self.reconnected)
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            reconnected, self.reconnected = self.reconnected, False
+            return reconnected, data
+
+packet_queue = StageQueue("state", PACKET_QUEUE_SIZE)
+sink_queue = StageQueue("sinks", SINK_QUEUE_SIZE)
+log_queue = StageQueue("console", LOG_QUEUE_SIZE)
+raw_queues = {}             # port -> ByteQueue
+
+def log_event(message):
+    """
+    Queues a line for the console stage, so a blocked terminal cannot stall ingest.
+    """
+    log_queue.put(message)
+
+def run_console():
+    while True:
+        message = log_queue.get()
+        print(message, flush=True)
+
+class PacketDeduplicator:
+    """
+    Drops copies of a helmet packet heard by more than one receiver.
+    A packet is a duplicate when the same helmet sent the same key (the
+    sequence number, or the whole CSV payload) on a different port within
+    DEDUP_WINDOW_SECONDS. Repeats on the same port are real packets.
+    Expects the caller to hold data_lock.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.last = {}      # helmet_id -> (key, time, port)
+
+    def is_duplicate(self, helmet_id, key, now, port):
+        previous = self.last.get(helmet_id)
+        if previous is not None:
+            prev_key, prev_time, prev_port = previous
+            if prev_key == key and prev_port != port and now - prev_time <= self.window:
+                return True
+        self.last[helmet_id] = (key, now, port)
+        return False
+
+packet_dedup = PacketDeduplicator(DEDUP_WINDOW_SECONDS)
+
+def update_state(parts, port=None, key=None):
+    """
+    State stage: applies one validated 9-field packet to the live table,
+    history, detectors and indexes. Returns (time, helmet_id, row, changes)
+    for the sinks, or None when the packet was a duplicate or did not fit.
+    key identifies the packet for cross-receiver de-duplication and defaults
+    to the packet fields themselves.
+    """
+    with data_lock:
+        # Timestamp under the lock so sinks receive rows in time order
+        now = time.time()
+        if packet_dedup.is_duplicate(parts[0], key if key is not None else tuple(parts), now, port):
+            duplicate_packets_total.inc(str(port))
+            return None
+        latest_data["values"] = parts
+        new_helmet = parts[0] not in helmet_table.slots
+        slot = helmet_table.update(parts, now)
+        if slot is not None:
+            changes = helmet_table.last_changes(slot)
+            values = helmet_table.values[slot]
+            helmet_history.append(slot, now, values)
+            anomaly_detector.update(slot, now, values)
+            # Binary frames carry a sequence number as their dedup key
+            link_quality.on_packet(slot, now, key if isinstance(key, int) else None)
+            helmet_grid.update(parts[0], values[5], values[6])
+            box_rollups.on_packet(parts[0], values, new_helmet)
+            if shared_table is not None:
+                shared_table.publish(helmet_table, slot)
+            row = values.tolist()
+    if slot is None:
+        parse_failures_total.inc(str(port), "helmet_table_full")
+        log_event(f"⚠️ Warning: Helmet table full ({MAX_HELMETS}), dropping packet from helmet '{parts[0]}'")
+        return None
+    packets_total.inc(str(port))
+    helmet_packets_total.inc(parts[0])
+    return now, parts[0], row, changes
+
+def run_sinks(update):
+    """
+    Sink stage: queues the packet for the telemetry store and pushes the
+    fields that changed to streaming clients.
+    """
+    now, helmet_id, row, changes = update
+    telemetry_store.append(now, row)
+    if changes:
+        live_feed.publish(helmet_id, changes)
+
+def ingest_packet(parts, port=None, key=None):
+    """
+    Runs the state and sink stages for one packet in the calling thread.
+    The serial pipeline uses the stages separately; this is for tools and tests.
+    """
+    update = update_state(parts, port, key)
+    if update is not None:
+        run_sinks(update)
+
+# --- Uplink Packet Parsers ---
+# Helmet IDs are numbers (binary frames carry them as u16). A corrupted CSV
+# line can still split into 9 fields, so the ID and readings are checked
+# before a packet may claim a helmet row.
+HELMET_ID_PATTERN = re.compile(r'[0-9]{1,5}')
+
+def packet_problem(parts):
+    """
+    Returns why a 9-field packet is unusable, or None if it is valid.
+    Empty readings are allowed (a missing sensor); anything else must be a number.
+    """
+    if not HELMET_ID_PATTERN.fullmatch(parts[0]):
+        return "bad_helmet_id"
+    for value in parts[1:]:
+        if value:
+            try:
+                float(value)
+            except ValueError:
+                return "bad_value"
+    return None
+
+class CsvParser:
+    """
+    Splits the receive buffer into newline-terminated CSV packets.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.buffer = bytearray()
+
+    def feed(self, chunk):
+        """
+        Adds received bytes and yields (dedup key, fields) for every valid line.
+        """
+        self.buffer += chunk
+        newline = self.buffer.find(b'\n')
+        while newline >= 0:
+            parts = self.parse_line(bytes(self.buffer[:newline]))
+            del self.buffer[:newline + 1]
+            if parts is not None:
+                yield None, parts
+            newline = self.buffer.find(b'\n')
+        if len(self.buffer) > MAX_LINE_BYTES:
+            parse_failures_total.inc(self.port, "line_too_long")
+            log_event(f"⚠️ Warning: Discarding {len(self.buffer)} bytes without a newline on {self.port}")
+            self.buffer.clear()
+
+    def parse_line(self, raw_line):
+        try:
+            line = raw_line.decode('utf-8').strip()
+        except UnicodeDecodeError as e:
+            parse_failures_total.inc(self.port, "decode")
+            log_event(f"❌ Error parsing data on {self.port}: {raw_line!r}. Reason: {e}")
+            return None
+        if not line:
+            return None
+        parts = [p.strip() for p in line.split(',')]
+        if parts[0] == 'ACK' and len(parts) == 3:
+            # Downlink acknowledgement: ACK,<helmet id>,<frame seq>
+            downlink.acknowledge(parts[1], parts[2])
+            return None
+        if len(parts) != 9:
+            note_parse_error(parts[0])
+            parse_failures_total.inc(self.port, "field_count")
+            log_event(f"⚠️ Warning: Received {len(parts)} values, expected 9. Data: '{line}'")
+            return None
+        problem = packet_problem(parts)
+        if problem:
+            note_parse_error(parts[0])
+            parse_failures_total.inc(self.port, problem)
+            log_event(f"⚠️ Warning: Discarding malformed packet on {self.port} ({problem}). Data: '{line}'")
+            return None
+        return parts
+
+def note_parse_error(helmet_id):
+    """
+    Charges an unusable line to a helmet's link statistics when its first
+    field still names a known helmet.
+    """
+    with data_lock:
+        slot = helmet_table.slots.get(helmet_id)
+        if slot is not None:
+            link_quality.on_parse_error(slot)
+
+# Binary frame, little-endian, 22 bytes:
+#   sync 0xAA 0x55 | version u8 | seq u16 | helmet id u16 | MQ2 u16 | MQ7 u16 | MQ135 u16
+#   | fall u8 | X i16 (0.1 m) | Y i16 (0.1 m) | SpO2 u8 | heart rate u8 | CRC u16
+# The CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over version..heart rate.
+# Downlink acknowledgements share the sync word, 9 bytes:
+#   sync 0xAA 0x55 | type 0xA1 u8 | helmet id u16 | downlink seq u16 | CRC u16 (over type..seq)
+FRAME_SYNC = b'\xaa\x55'
+FRAME_VERSION = 1
+FRAME_BODY = struct.Struct('<BHHHHHBhhBB')
+FRAME_CRC = struct.Struct('<H')
+FRAME_SIZE = len(FRAME_SYNC) + FRAME_BODY.size + FRAME_CRC.size
+ACK_FRAME_TYPE = 0xA1
+ACK_FRAME_BODY = struct.Struct('<BHH')
+ACK_FRAME_SIZE = len(FRAME_SYNC) + ACK_FRAME_BODY.size + FRAME_CRC.size
+
+def encode_frame(seq, values):
+    """
+    Packs a sequence number and the 9 packet fields into a binary frame.
+    """
+    helmet_id, mq2, mq7, mq135, fall, x, y, spo2, heart_rate = values
+    body = FRAME_BODY.pack(FRAME_VERSION, seq & 0xFFFF, int(helmet_id), round(float(mq2)), round(float(mq7)),
+                           round(float(mq135)), int(fall), round(float(x) * 10), round(float(y) * 10),
+                           round(float(spo2)), round(float(heart_rate)))
+    return FRAME_SYNC + body + FRAME_CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+def encode_ack_frame(helmet_id, seq):
+    """
+    Packs a helmet's acknowledgement of downlink frame `seq`.
+    """
+    body = ACK_FRAME_BODY.pack(ACK_FRAME_TYPE, int(helmet_id), seq & 0xFFFF)
+    return FRAME_SYNC + body + FRAME_CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+class BinaryFrameParser:
+    """
+    Extracts fixed-size frames from the receive buffer.
+    Frames are decoded in place through a memoryview; after a bad CRC or an
+    unknown version the parser skips one byte and searches for the next sync
+    word, so a corrupted frame costs at most that frame. ACK frames are
+    handed to the downlink scheduler.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, chunk):
+        """
+        Adds received bytes and yields (sequence number, fields) for every valid frame.
+        """
+        self.buffer += chunk
+        view = memoryview(self.buffer)
+        pos = 0
+        try:
+            while True:
+                pos = self.buffer.find(FRAME_SYNC, pos)
+                if pos < 0:
+                    # Keep a trailing half sync word
+                    pos = len(self.buffer) - 1 if self.buffer.endswith(FRAME_SYNC[:1]) else len(self.buffer)
+                    break
+                body_start = pos + len(FRAME_SYNC)
+                if len(self.buffer) <= body_start:
+                    break
+                is_ack = view[body_start] == ACK_FRAME_TYPE
+                if len(self.buffer) - pos < (ACK_FRAME_SIZE if is_ack else FRAME_SIZE):
+                    break
+                body_end = body_start + (ACK_FRAME_BODY.size if is_ack else FRAME_BODY.size)
+                (crc,) = FRAME_CRC.unpack_from(view, body_end)
+                valid = binascii.crc_hqx(view[body_start:body_end], 0xFFFF) == crc
+                if valid and is_ack:
+                    (_, helmet_id, seq) = ACK_FRAME_BODY.unpack_from(view, body_start)
+                    pos += ACK_FRAME_SIZE
+                    downlink.acknowledge(str(helmet_id), seq)
+                    continue
+                if not valid or view[body_start] != FRAME_VERSION:
+                    self.crc_errors += 1
+                    parse_failures_total.inc(self.port, "bad_frame")
+                    log_event(f"❌ Error parsing data on {self.port}: bad frame at offset {pos}, resyncing")
+                    pos += 1
+                    continue
+                (_, seq, helmet_id, mq2, mq7, mq135, fall, x, y, spo2, heart_rate) = FRAME_BODY.unpack_from(view, body_start)
+                pos += FRAME_SIZE
+                yield seq, [str(helmet_id), str(mq2), str(mq7), str(mq135), str(fall),
+                            f"{x / 10:.1f}", f"{y / 10:.1f}", str(spo2), str(heart_rate)]
+        finally:
+            view.release()
+            del self.buffer[:pos]
+
+def make_parser(port):
+    if SERIAL_FORMAT == 'binary':
+        return BinaryFrameParser(port)
+    return CsvParser(port)
+
+# --- Downlink Commands ---
+# Commands go out on the same HC-12 ports as broadcast text frames:
+#   !<seq>,<code>,<id>;<id>;...*<crc>\n
+# where seq is 0-65535, code is one of DOWNLINK_COMMANDS' values and crc is
+# the CRC-16/CCITT-FALSE of everything between '!' and '*', as 4 hex digits.
+# A helmet listed in a frame runs the command and answers with the uplink
+# line ACK,<helmet id>,<seq> (an ACK frame with SERIAL_FORMAT=binary). One
+# frame carries the same command for as many helmets as fit, so a whole box
+# is usually one frame.
+# A delivery is given up after DOWNLINK_MAX_ATTEMPTS frames or
+# DOWNLINK_TTL_SECONDS without an ACK, whichever comes first, and can be
+# cancelled before that with DELETE /commands.
+# The link is half duplex at BAUD_RATE: a frame waits until the port has been
+# quiet for DOWNLINK_QUIET_SECONDS (a gap between uplink packets), for at most
+# DOWNLINK_MAX_DEFER_SECONDS on a busy link, and downlink airtime is capped at
+# DOWNLINK_DUTY of the link by a token bucket.
+# Each frame is sent on every connected port, since a helmet may be in range
+# of only one receiver. Ports keep their own outbox, bucket and quiet timer,
+# so a busy or slow port does not hold the others back.
+DOWNLINK_COMMANDS = {"evacuate": "EVAC", "acknowledge": "ACKN", "buzzer": "BUZZ"}   # in priority order
+DOWNLINK_MAX_FRAME_BYTES = int(os.environ.get('DOWNLINK_MAX_FRAME_BYTES', 60))
+DOWNLINK_DUTY = float(os.environ.get('DOWNLINK_DUTY', 0.25))
+DOWNLINK_QUIET_SECONDS = float(os.environ.get('DOWNLINK_QUIET_SECONDS', 0.05))
+DOWNLINK_MAX_DEFER_SECONDS = float(os.environ.get('DOWNLINK_MAX_DEFER_SECONDS', 0.5))
+DOWNLINK_RETRY_MIN_SECONDS = float(os.environ.get('DOWNLINK_RETRY_MIN_SECONDS', 1.0))
+DOWNLINK_RETRY_MAX_SECONDS = float(os.environ.get('DOWNLINK_RETRY_MAX_SECONDS', 30.0))
+DOWNLINK_MAX_ATTEMPTS = int(os.environ.get('DOWNLINK_MAX_ATTEMPTS', 20))
+DOWNLINK_TTL_SECONDS = float(os.environ.get('DOWNLINK_TTL_SECONDS', 600))
+DOWNLINK_TICK_SECONDS = 0.02
+DOWNLINK_FRAME_HISTORY = 256            # sent frames remembered for matching late ACKs
+DOWNLINK_OUTBOX_FRAMES = 8              # frames waiting per port; older ones are dropped and retried
+DOWNLINK_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0]
+
+downlink_frames_total = Counter("aura_downlink_frames_total", "Command frames transmitted per port.", ("port",))
+downlink_retries_total = Counter("aura_downlink_retries_total", "Command deliveries sent again without an ACK.", ("command",))
+downlink_expired_total = Counter("aura_downlink_expired_total", "Command deliveries given up without an ACK.", ("command",))
+downlink_latency_seconds = Histogram("aura_downlink_latency_seconds", "Time from queuing a command to the helmet's ACK.", ("command",), DOWNLINK_BUCKETS)
+
+serial_handles = {}         # port -> open serial handle, shared by its reader and the downlink
+
+class Delivery:
+    """
+    One command owed to one helmet, retried until the helmet acknowledges it
+    or it expires.
+    """
+    def __init__(self, helmet_id, command, now):
+        self.helmet_id = helmet_id
+        self.command = command
+        self.queued_at = now
+        self.attempts = 0
+        self.next_attempt = now
+
+class DownlinkScheduler:
+    """
+    Queues commands per helmet, packs due ones into broadcast frames, paces
+    transmissions per port and matches ACKs back to deliveries.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}               # (helmet_id, command) -> Delivery
+        self.frames = OrderedDict()     # seq -> (command, helmet IDs)
+        self.seq = 0
+        self.latency = {}               # helmet_id -> {command: seconds} of the last delivery
+        self.last_rx = {}               # port -> time bytes were last received
+        self.buckets = {}               # port -> [tokens, refill time]
+        self.deferred_since = {}        # port -> when a due frame started waiting for a gap
+        self.outboxes = {}              # port -> frames built but not yet sent on that port
+
+    def send(self, command, helmet_ids, now=None):
+        """
+        Queues a command for each helmet. A command already owed to a helmet
+        is not duplicated, but its next attempt is brought forward.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            for helmet_id in helmet_ids:
+                delivery = self.pending.get((helmet_id, command))
+                if delivery is None:
+                    self.pending[(helmet_id, command)] = Delivery(helmet_id, command, now)
+                else:
+                    delivery.next_attempt = now
+
+    def acknowledge(self, helmet_id, seq, now=None):
+        now = time.time() if now is None else now
+        try:
+            seq = int(seq)
+        except ValueError:
+            return False
+        with self.lock:
+            frame = self.frames.get(seq)
+            if frame is None or helmet_id not in frame[1]:
+                return False
+            delivery = self.pending.pop((helmet_id, frame[0]), None)
+            if delivery is None:
+                return False            # already acknowledged through another frame
+            latency = now - delivery.queued_at
+            self.latency.setdefault(helmet_id, {})[delivery.command] = latency
+        downlink_latency_seconds.observe(latency, delivery.command)
+        return True
+
+    def cancel(self, helmet_ids, command=None):
+        """
+        Drops the deliveries owed to the given helmets (of one command, or of
+        every command). Returns how many were dropped.
+        """
+        with self.lock:
+            keys = [key for key in self.pending if key[0] in helmet_ids and command in (None, key[1])]
+            for key in keys:
+                del self.pending[key]
+        return len(keys)
+
+    def expire(self, now):
+        """
+        Gives up on deliveries past DOWNLINK_TTL_SECONDS, or that have used
+        DOWNLINK_MAX_ATTEMPTS and whose last retry interval has run out.
+        """
+        with self.lock:
+            expired = [d for d in self.pending.values()
+                       if now - d.queued_at >= DOWNLINK_TTL_SECONDS
+                       or (d.attempts >= DOWNLINK_MAX_ATTEMPTS and d.next_attempt <= now)]
+            for delivery in expired:
+                del self.pending[(delivery.helmet_id, delivery.command)]
+        for delivery in expired:
+            downlink_expired_total.inc(delivery.command)
+            log_event(f"⚠️ Warning: Gave up on {delivery.command} for helmet {delivery.helmet_id} "
+                      f"after {delivery.attempts} attempts without an ACK")
+        return expired
+
+    def note_rx(self, port, now):
+        self.last_rx[port] = now
+
+    def has_due(self, now):
+        with self.lock:
+            return any(d.next_attempt <= now for d in self.pending.values())
+
+    def can_transmit(self, port, now):
+        """
+        True when the port's airtime budget covers a full frame and the port
+        is quiet, or has been busy for longer than a frame may be deferred.
+        """
+        rate = BAUD_RATE / 10 * DOWNLINK_DUTY           # bytes per second, 8N1
+        bucket = self.buckets.setdefault(port, [DOWNLINK_MAX_FRAME_BYTES, now])
+        bucket[0] = min(bucket[0] + (now - bucket[1]) * rate, 2 * DOWNLINK_MAX_FRAME_BYTES)
+        bucket[1] = now
+        if bucket[0] < DOWNLINK_MAX_FRAME_BYTES:
+            return False
+        if now - self.last_rx.get(port, 0) < DOWNLINK_QUIET_SECONDS:
+            since = self.deferred_since.setdefault(port, now)
+            if now - since < DOWNLINK_MAX_DEFER_SECONDS:
+                return False
+        self.deferred_since.pop(port, None)
+        return True
+
+    def spend(self, port, nbytes):
+        self.buckets[port][0] -= nbytes
+
+    def next_frame(self, now):
+        """
+        Builds the next frame from due deliveries, highest-priority command
+        first, or returns None if nothing is due.
+        """
+        with self.lock:
+            due = [d for d in self.pending.values() if d.next_attempt <= now]
+            if not due:
+                return None
+            command = min((d.command for d in due), key=list(DOWNLINK_COMMANDS).index)
+            due = sorted((d for d in due if d.command == command), key=lambda d: d.next_attempt)
+            self.seq = (self.seq + 1) % 65536
+            head = f"{self.seq},{DOWNLINK_COMMANDS[command]},"
+            ids = []
+            size = len(head) + 7            # '!' + '*' + 4 CRC digits + newline
+            for delivery in due:
+                extra = len(delivery.helmet_id) + (1 if ids else 0)
+                if ids and size + extra > DOWNLINK_MAX_FRAME_BYTES:
+                    break
+                ids.append(delivery.helmet_id)
+                size += extra
+                if delivery.attempts:
+                    downlink_retries_total.inc(command)
+                delivery.attempts += 1
+                backoff = min(DOWNLINK_RETRY_MIN_SECONDS * 2 ** (delivery.attempts - 1), DOWNLINK_RETRY_MAX_SECONDS)
+                delivery.next_attempt = now + backoff * random.uniform(0.8, 1.2)
+            self.frames[self.seq] = (command, set(ids))
+            while len(self.frames) > DOWNLINK_FRAME_HISTORY:
+                self.frames.popitem(last=False)
+            body = (head + ";".join(ids)).encode('utf-8')
+        crc = binascii.crc_hqx(body, 0xFFFF)
+        return b"!" + body + f"*{crc:04X}\n".encode('ascii')
+
+    def fill_outboxes(self, ports, now):
+        """
+        Builds the next due frame and queues it on every port, once some
+        port has sent everything it was given. Called by the downlink thread.
+        """
+        for port in list(self.outboxes):
+            if port not in ports:
+                del self.outboxes[port]         # disconnected; its deliveries are retried
+        self.expire(now)
+        outboxes = [self.outboxes.setdefault(port, deque(maxlen=DOWNLINK_OUTBOX_FRAMES)) for port in ports]
+        if not any(len(outbox) == 0 for outbox in outboxes) or not self.has_due(now):
+            return
+        frame = self.next_frame(now)
+        if frame is not None:
+            for outbox in outboxes:
+                outbox.append(frame)
+
+    def take_frame(self, port, now):
+        """
+        Returns the port's next frame if it may transmit now, else None.
+        """
+        outbox = self.outboxes.get(port)
+        if not outbox or not self.can_transmit(port, now):
+            return None
+        return outbox.popleft()
+
+    def status(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            pending = [{"helmet": d.helmet_id, "command": d.command, "attempts": d.attempts,
+                        "waiting": now - d.queued_at} for d in self.pending.values()]
+            latency = {helmet: dict(commands) for helmet, commands in self.latency.items()}
+        return {"pending": pending, "latency": latency}
+
+downlink = DownlinkScheduler()
+
+def run_downlink():
+    """
+    Sends each due command frame on every connected port as airtime allows.
+    """
+    while True:
+        time.sleep(DOWNLINK_TICK_SECONDS)
+        ports = list(serial_handles.items())
+        if not ports:
+            continue
+        downlink.fill_outboxes([port for port, _ in ports], time.time())
+        for port, ser in ports:
+            frame = downlink.take_frame(port, time.time())
+            if frame is None:
+                continue
+            try:
+                ser.write(frame)
+            except (serial.SerialException, OSError):
+                continue                # the reader notices and reconnects; the delivery is retried
+            downlink.spend(port, len(frame))
+            downlink_frames_total.inc(port)
+
+# --- Background Tasks for Reading Serial Data ---
+def read_from_port(port):
+    """
+    Read stage: moves bytes from one serial port into its raw queue.
+    Reads whatever bytes are waiting instead of blocking in readline(), does
+    no other work, and reconnects with exponential backoff without affecting
+    other ports.
+    """
+    chunks = raw_queues[port]
+    delay = RECONNECT_MIN_SECONDS
+    while True:
+        ser = None
+        try:
+            ser = serial.serial_for_url(port, BAUD_RATE, timeout=1)
+            log_event(f"✅ Successfully connected to {port}")
+            delay = RECONNECT_MIN_SECONDS
+            chunks.reconnect()
+            serial_handles[port] = ser
+
+            while ser.is_open:
+                # Returns as soon as any bytes arrive, or after the 1 s timeout
+                chunk = ser.read(ser.in_waiting or 1)
+                if chunk:
+                    downlink.note_rx(port, time.time())
+                    chunks.put(chunk)
+
+        except serial.SerialException:
+            serial_handles.pop(port, None)
+            serial_reconnects_total.inc(port)
+            log_event(f"🔌 Port {port} not found or disconnected. Retrying in {delay} seconds...")
+            if ser and ser.is_open:
+                ser.close()
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+def parse_port(port):
+    """
+    Parse stage: frames and validates one port's bytes into packets.
+    When the state stage falls behind, a helmet's queued packet is replaced
+    by its newer one.
+    """
+    chunks = raw_queues[port]
+    parser = make_parser(port)
+    while True:
+        reconnected, data = chunks.get()
+        if reconnected:
+            parser = make_parser(port)
+        for key, parts in parser.feed(data):
+            packet_queue.put((parts, port, key), key=parts[0])
+
+def run_state_stage():
+    """
+    State stage: the only writer of live helmet state in the pipeline.
+    """
+    while True:
+        parts, port, key = packet_queue.get()
+        update = update_state(parts, port, key)
+        if update is not None:
+            sink_queue.put(update)
+
+def run_sink_stage():
+    while True:
+        run_sinks(sink_queue.get())
+
+def start_serial_readers(ports):
+    """
+    Starts the ingest pipeline: a read and a parse thread per serial port,
+    then one state, one sink, one console and one downlink thread.
+    """
+    threads = []
+    for port in ports:
+        raw_queues[port] = ByteQueue(f"parse:{port}", RAW_QUEUE_BYTES)
+        threads.append(threading.Thread(target=read_from_port, args=(port,), name=f"serial-{port}", daemon=True))
+        threads.append(threading.Thread(target=parse_port, args=(port,), name=f"parse-{port}", daemon=True))
+    threads.append(threading.Thread(target=run_state_stage, name="ingest-state", daemon=True))
+    threads.append(threading.Thread(target=run_sink_stage, name="ingest-sinks", daemon=True))
+    threads.append(threading.Thread(target=run_console, name="console", daemon=True))
+    threads.append(threading.Thread(target=run_downlink, name="downlink", daemon=True))
+    for thread in threads:
+        thread.start()
+    return threads
+
+# --- Server-Side Alert Engine ---
+ALERT_TICK_SECONDS = float(os.environ.get('ALERT_TICK_SECONDS', 0.5))
+ALERT_LOG_SIZE = int(os.environ.get('ALERT_LOG_SIZE', 10000))
+
+# A rule raises when the field crosses `trigger` and clears only once it is
+# back past `clear` (hysteresis). Both transitions need `debounce` consecutive
+# fresh packets, so a single noisy MQ reading never flips the state.
+# Gas limits are defaults for the MQ sensors and should be calibrated per site.
+ALERT_RULES = [
+    {"name": "co_high", "field": 2, "direction": "above", "trigger": 50, "clear": 35, "debounce": 3},
+    {"name": "mq2_gas_high", "field": 1, "direction": "above", "trigger": 1000, "clear": 800, "debounce": 3},
+    {"name": "mq135_air_quality", "field": 3, "direction": "above", "trigger": 1000, "clear": 800, "debounce": 3},
+    {"name": "fall_detected", "field": 4, "direction": "above", "trigger": 0.5, "clear": 0.5, "debounce": 1},
+    {"name": "spo2_low", "field": 7, "direction": "below", "trigger": 90, "clear": 94, "debounce": 2},
+    {"name": "heart_rate_high", "field": 8, "direction": "above", "trigger": 130, "clear": 120, "debounce": 3},
+    {"name": "heart_rate_low", "field": 8, "direction": "below", "trigger": 45, "clear": 50, "debounce": 3},
+    # Rules on AnomalyDetector scores instead of raw fields
+    {"name": "co_spike", "score": "mq7_z", "direction": "above", "trigger": 4, "clear": 2, "debounce": 2},
+    {"name": "co_rising", "score": "mq7_trend", "direction": "above", "trigger": 1.0, "clear": 0.3, "debounce": 5},
+    {"name": "mq2_spike", "score": "mq2_z", "direction": "above", "trigger": 4, "clear": 2, "debounce": 2},
+    {"name": "mq135_rising", "score": "mq135_trend", "direction": "above", "trigger": 5.0, "clear": 1.5, "debounce": 5},
+    {"name": "spo2_dropping", "score": "spo2_trend", "direction": "below", "trigger": -0.5, "clear": -0.1, "debounce": 5},
+    {"name": "heart_rate_spike", "score": "heart_rate_z", "direction": "above", "trigger": 4, "clear": 2, "debounce": 3},
+    {"name": "heart_rate_drifting_up", "score": "heart_rate_trend", "direction": "above", "trigger": 0.5, "clear": 0.2, "debounce": 10},
+    {"name": "fall_confirmed", "score": "fall_hits", "direction": "above", "trigger": 2.5, "clear": 0.5, "debounce": 1},
+    # Rules on LinkQuality scores
+    {"name": "helmet_silent", "score": "link_stale", "direction": "above", "trigger": 0.5, "clear": 0.5, "debounce": 1},
+    {"name": "link_lossy", "score": "link_loss_pct", "direction": "above", "trigger": LINK_DEGRADED_LOSS_PCT, "clear": LINK_DEGRADED_LOSS_PCT / 2, "debounce": 5},
+    {"name": "link_corrupt", "score": "link_error_pct", "direction": "above", "trigger": LINK_DEGRADED_ERROR_PCT, "clear": LINK_DEGRADED_ERROR_PCT / 2, "debounce": 5},
+]
+
+class AlertEngine:
+    """
+    Evaluates every rule against every helmet in one NumPy pass per tick.
+    Rules are stored as parallel arrays and per-helmet state as (helmet, rule)
+    matrices, so the cost of a tick does not depend on how many rules fire.
+    Only helmets with a packet newer than the previous tick advance their
+    debounce counters.
+    A rule reads either a packet field ("field") or an AnomalyDetector or
+    LinkQuality score ("score"); scores are appended after the packet fields
+    as extra columns. Each tick also advances the link timer wheel, and a
+    helmet whose link went stale or recovered counts as fresh.
+    """
+    def __init__(self, rules, capacity, log_size):
+        self.rules = rules
+        self.names = [rule["name"] for rule in rules]
+        score_names = anomaly_detector.names + link_quality.names
+        self.fields = np.array([rule["field"] if "field" in rule else NUM_FIELDS + score_names.index(rule["score"])
+                                for rule in rules])
+        sign = np.array([1.0 if rule["direction"] == "above" else -1.0 for rule in rules])
+        self.sign = sign
+        self.signed_trigger = sign * np.array([rule["trigger"] for rule in rules], dtype=float)
+        self.signed_clear = sign * np.array([rule["clear"] for rule in rules], dtype=float)
+        self.debounce = np.array([rule["debounce"] for rule in rules])
+        self.active = np.zeros((capacity, len(rules)), dtype=bool)
+        self.streak = np.zeros((capacity, len(rules)), dtype=np.int32)
+        self.raised_at = np.zeros((capacity, len(rules)))
+        self.last_tick = 0.0
+        self.lock = threading.Lock()       # guards log and active alerts for readers
+        self.log = deque(maxlen=log_size)
+
+    def tick(self, now=None):
+        """
+        Runs one evaluation over the current helmet table.
+        """
+        now = time.time() if now is None else now
+        with data_lock:
+            count = len(helmet_table)
+            ids = list(helmet_table.ids)
+            link_quality.advance(now)
+            values = np.hstack([helmet_table.values[:count], anomaly_detector.scores[:count],
+                                link_quality.scores(count)])
+            updated = helmet_table.updated[:count].copy()
+            link_changed = link_quality.take_changed(count)
+        fresh = (updated > self.last_tick) | link_changed
+        if not fresh.any():
+            return []
+
+        self.last_tick = max(self.last_tick, updated.max())
+        readings = values[:, self.fields]                 # (helmets, rules)
+        signed = readings * self.sign
+        with np.errstate(invalid='ignore'):
+            breach = signed > self.signed_trigger
+            recovered = signed < self.signed_clear
+        events = []
+        # Snapshots and active_alerts() read these arrays under self.lock, so
+        # every write to them happens there too
+        with self.lock:
+            active = self.active[:count]
+            streak = self.streak[:count]
+            # While inactive count consecutive breaches, while active count recoveries
+            toward = np.where(active, recovered, breach)
+            streak[:] = np.where(fresh[:, None], np.where(toward, streak + 1, 0), streak)
+            flip = streak >= self.debounce
+            if flip.any():
+                active ^= flip
+                streak[flip] = 0
+                for helmet, rule in zip(*np.nonzero(flip)):
+                    raised = bool(active[helmet, rule])
+                    if raised:
+                        self.raised_at[helmet, rule] = now
+                    event = {
+                        "time": now,
+                        "helmet": ids[helmet],
+                        "rule": self.names[rule],
+                        "state": "raised" if raised else "cleared",
+                        "value": None if np.isnan(readings[helmet, rule]) else float(readings[helmet, rule]),
+                    }
+                    self.log.append(event)
+                    events.append(event)
+        return events
+
+    def reset(self, slot):
+        with self.lock:
+            self.active[slot] = False
+            self.streak[slot] = 0
+            self.raised_at[slot] = 0
+
+    def active_alerts(self):
+        with self.lock:
+            helmets, rules = np.nonzero(self.active)
+            raised_at = self.raised_at[helmets, rules]
+        with data_lock:
+            ids = list(helmet_table.ids)
+        return [{"helmet": ids[h], "rule": self.names[r], "since": float(t)}
+                for h, r, t in zip(helmets, rules, raised_at)]
+
+    def query(self, helmet=None, rule=None, since=None, limit=500):
+        """
+        Returns logged transitions, newest first.
+        """
+        with self.lock:
+            events = list(self.log)
+        results = []
+        for event in reversed(events):
+            if since is not None and event["time"] < since:
+                break
+            if helmet is not None and event["helmet"] != helmet:
+                continue
+            if rule is not None and event["rule"] != rule:
+                continue
+            results.append(event)
+            if len(results) >= limit:
+                break
+        return results
+
+alert_engine = AlertEngine(ALERT_RULES, MAX_HELMETS, ALERT_LOG_SIZE)
+
+def run_alert_engine():
+    """
+    Evaluates alert rules every ALERT_TICK_SECONDS in a background thread.
+    """
+    while True:
+        for event in alert_engine.tick():
+            icon = "🚨" if event["state"] == "raised" else "✅"
+            log_event(f"{icon} Alert {event['rule']} {event['state']} for helmet {event['helmet']} (value {event['value']})")
+        time.sleep(ALERT_TICK_SECONDS)
+
+# --- Offline Helmet Eviction ---
+# A helmet silent for HELMET_OFFLINE_SECONDS gives up its row, so helmets that
+# left the site (or IDs that slipped through corrupted) do not hold rows, and
+# their history memory, forever. The helmet gets a fresh row if it returns.
+HELMET_OFFLINE_SECONDS = float(os.environ.get('HELMET_OFFLINE_SECONDS', 12 * 3600))
+HELMET_EVICT_CHECK_SECONDS = 60
+
+def reset_helmet_row(slot):
+    """
+    Clears the per-row statistics of a helmet row. Caller holds data_lock.
+    """
+    helmet_history.drop(slot)
+    anomaly_detector.reset(slot)
+    link_quality.reset(slot)
+    alert_engine.reset(slot)
+
+def evict_offline_helmets(now=None):
+    """
+    Frees the rows of helmets not heard from for HELMET_OFFLINE_SECONDS and
+    returns their IDs.
+    """
+    now = time.time() if now is None else now
+    evicted = []
+    with data_lock:
+        updated = helmet_table.updated[:len(helmet_table)]
+        for slot in np.flatnonzero((updated > 0) & (updated < now - HELMET_OFFLINE_SECONDS)).tolist():
+            helmet_id = helmet_table.ids[slot]
+            helmet_table.evict(slot)
+            reset_helmet_row(slot)
+            if helmet_grid.location(helmet_id) is not None:
+                helmet_grid.remove(helmet_id)
+            box_rollups.forget(helmet_id)
+            packet_dedup.last.pop(helmet_id, None)
+            if SERVER_ROLE == 'ingest' and shared_table is not None:
+                shared_table.clear(slot)
+            evicted.append(helmet_id)
+    if evicted:
+        log_event(f"🧹 Freed the rows of {len(evicted)} helmets silent for over {HELMET_OFFLINE_SECONDS / 3600:g} h")
+    return evicted
+
+def run_helmet_eviction():
+    """
+    Background thread: evicts offline helmets every HELMET_EVICT_CHECK_SECONDS.
+    """
+    while True:
+        time.sleep(HELMET_EVICT_CHECK_SECONDS)
+        evict_offline_helmets()
+
+# --- Warm Restart Snapshots ---
+# Every STATE_SNAPSHOT_SECONDS the live state (helmet table, the last
+# STATE_SNAPSHOT_HISTORY_SECONDS of ring history, anomaly and link statistics,
+# alert state) is copied under the locks and written as an uncompressed .npz
+# by a background thread, replacing the previous file atomically. On startup
+# it is loaded before the serial readers start, so the dashboard shows the
+# last known readings immediately instead of zeros.
+STATE_SNAPSHOT_FILE = os.environ.get('STATE_SNAPSHOT_FILE', 'state_snapshot.npz')     # empty disables
+STATE_SNAPSHOT_SECONDS = float(os.environ.get('STATE_SNAPSHOT_SECONDS', 10))
+STATE_SNAPSHOT_HISTORY_SECONDS = float(os.environ.get('STATE_SNAPSHOT_HISTORY_SECONDS', 900))
+STATE_SNAPSHOT_MAX_AGE_SECONDS = float(os.environ.get('STATE_SNAPSHOT_MAX_AGE_SECONDS', 6 * 3600))
+STATE_SNAPSHOT_FORMAT = 1
+
+state_snapshot_seconds = Histogram("aura_state_snapshot_seconds", "Warm-restart snapshot time by phase.", ("phase",), LATENCY_BUCKETS)
+
+# Per-helmet-row arrays saved and restored as they are: (key, owner, attribute)
+SNAPSHOT_ARRAYS = [
+    ("table.values", helmet_table, "values"),
+    ("table.updated", helmet_table, "updated"),
+    ("table.row_versions", helmet_table, "row_versions"),
+    ("table.field_versions", helmet_table, "field_versions"),
+] + [(f"anomaly.{name}", anomaly_detector, name)
+     for name in ("mean", "var", "rate", "last_value", "last_time", "count", "fall_bits", "scores")] \
+  + [(f"link.{name}", link_quality, name)
+     for name in ("last_seen", "nominal", "jitter", "last_seq", "received", "lost", "errors", "stale")]
+
+# Alert state is saved per rule name, so adding or removing rules keeps the rest
+ALERT_SNAPSHOT_ARRAYS = ["active", "streak", "raised_at"]
+
+def capture_state():
+    """
+    Copies everything a snapshot holds. Only array copies happen under the
+    locks; the file is written after they are released.
+    """
+    with data_lock:
+        now = time.time()
+        count = len(helmet_table)
+        state = {key: getattr(owner, name)[:count].copy() for key, owner, name in SNAPSHOT_ARRAYS}
+        # Free rows are saved as empty IDs and readings to keep the row layout
+        state["table.ids"] = np.array([h or '' for h in helmet_table.ids], dtype=str)
+        state["table.raw"] = np.array([r or [''] * NUM_FIELDS for r in helmet_table.raw[:count]],
+                                      dtype=str).reshape(count, NUM_FIELDS)
+        slots, times, samples = [], [], []
+        for slot, ring in helmet_history.rings.items():
+            t, v = ring.since(now - STATE_SNAPSHOT_HISTORY_SECONDS)
+            slots.append(slot)
+            times.append(t)
+            samples.append(v)
+        state["meta"] = np.array([STATE_SNAPSHOT_FORMAT, now, helmet_table.version, NUM_FIELDS], dtype=np.float64)
+    state["history.slots"] = np.array(slots, dtype=np.int64)
+    state["history.lengths"] = np.array([len(t) for t in times], dtype=np.int64)
+    state["history.times"] = np.concatenate(times) if times else np.zeros(0)
+    state["history.samples"] = (np.concatenate(samples) if samples
+                                else np.zeros((0, len(HISTORY_CHANNELS)), dtype=np.float32))
+    with alert_engine.lock:
+        for name in ALERT_SNAPSHOT_ARRAYS:
+            state[f"alerts.{name}"] = getattr(alert_engine, name)[:count].copy()
+        state["alerts.last_tick"] = np.array(alert_engine.last_tick)
+    state["alerts.rules"] = np.array(alert_engine.names, dtype=str)
+    return state
+
+def save_state():
+    """
+    Writes a snapshot next to the previous one and swaps it in, so a crash
+    mid-write leaves the last good snapshot in place.
+    """
+    if not STATE_SNAPSHOT_FILE:
+        return
+    start = time.perf_counter()
+    state = capture_state()
+    captured = time.perf_counter()
+    state_snapshot_seconds.observe(captured - start, "capture")
+    temp_path = STATE_SNAPSHOT_FILE + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **state)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, STATE_SNAPSHOT_FILE)
+    state_snapshot_seconds.observe(time.perf_counter() - captured, "write")
+
+def run_state_snapshots():
+    """
+    Background thread: saves a snapshot every STATE_SNAPSHOT_SECONDS.
+    """
+    while True:
+        time.sleep(STATE_SNAPSHOT_SECONDS)
+        try:
+            save_state()
+        except OSError as e:
+            log_event(f"⚠️ Warning: Could not write state snapshot {STATE_SNAPSHOT_FILE}: {e}")
+
+def restore_state():
+    """
+    Loads the last snapshot into the empty live state. Called once at startup
+    before packets arrive. Derived indexes (positions, box rollups, the link
+    timer wheel) are rebuilt from the restored rows. Returns the number of
+    helmets restored.
+    """
+    if not STATE_SNAPSHOT_FILE or not os.path.exists(STATE_SNAPSHOT_FILE):
+        return 0
+    start = time.perf_counter()
+    try:
+        with np.load(STATE_SNAPSHOT_FILE) as snapshot:
+            state = {key: snapshot[key] for key in snapshot.files}
+        snapshot_format, saved_at, version, fields = state["meta"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"⚠️ Ignoring unreadable state snapshot {STATE_SNAPSHOT_FILE}: {e}")
+        return 0
+    if snapshot_format != STATE_SNAPSHOT_FORMAT or fields != NUM_FIELDS:
+        print(f"⚠️ Ignoring state snapshot {STATE_SNAPSHOT_FILE} written by an incompatible version")
+        return 0
+    now = time.time()
+    if now - saved_at > STATE_SNAPSHOT_MAX_AGE_SECONDS:
+        print(f"⚠️ Ignoring state snapshot {STATE_SNAPSHOT_FILE}, it is {(now - saved_at) / 3600:.1f} h old")
+        return 0
+
+    # Rows that were free, or whose ID is not a valid helmet ID, come back free
+    ids = [h if HELMET_ID_PATTERN.fullmatch(h) else None for h in state["table.ids"].tolist()[:MAX_HELMETS]]
+    count = len(ids)
+    with data_lock:
+        if len(helmet_table):
+            return 0
+        helmet_table.load_ids(ids)
+        helmet_table.raw[:count] = state["table.raw"][:count].tolist()
+        for key, owner, name in SNAPSHOT_ARRAYS:
+            getattr(owner, name)[:count] = state[key][:count]
+        for slot in helmet_table.free:
+            helmet_table.clear_row(slot)
+            reset_helmet_row(slot)
+        helmet_table.version = int(version)
+        link_quality.reschedule(count, now)
+
+        ends = np.cumsum(state["history.lengths"])
+        for slot, end, length in zip(state["history.slots"].tolist(), ends.tolist(), state["history.lengths"].tolist()):
+            ring = helmet_history.ring_for(slot) if slot < count else None
+            if ring is not None:
+                ring.extend(state["history.times"][end - length:end], state["history.samples"][end - length:end])
+
+        for slot, helmet_id in enumerate(ids):
+            if helmet_id is None:
+                continue
+            values = helmet_table.values[slot]
+            helmet_grid.update(helmet_id, values[5], values[6])
+            box_rollups.on_packet(helmet_id, values, True)
+            if shared_table is not None:
+                shared_table.publish(helmet_table, slot)
+        if len(helmet_table.slots):
+            latest_data["values"] = helmet_table.raw[int(np.argmax(helmet_table.row_versions[:count]))]
+
+    saved_rules = state["alerts.rules"].tolist()
+    with alert_engine.lock:
+        for column, rule in enumerate(saved_rules):
+            if rule not in alert_engine.names:
+                continue
+            target = alert_engine.names.index(rule)
+            for name in ALERT_SNAPSHOT_ARRAYS:
+                getattr(alert_engine, name)[:count, target] = state[f"alerts.{name}"][:count, column]
+        for slot in helmet_table.free:
+            alert_engine.active[slot] = False
+            alert_engine.streak[slot] = 0
+        alert_engine.last_tick = float(state["alerts.last_tick"])
+        active = int(alert_engine.active[:count].sum())
+    state_snapshot_seconds.observe(time.perf_counter() - start, "restore")
+    restored = len(helmet_table.slots)
+    print(f"♻️ Restored {restored} helmets and {active} active alerts from {STATE_SNAPSHOT_FILE} "
+          f"(saved {now - saved_at:.0f} s ago) in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return restored
+
+def start_background_work():
+    """
+    Starts the threads of a process that owns the serial ports. Loading the
+    box assignments for rollups is not needed to serve the dashboard, so it
+    runs here rather than before the server starts.
+    """
+    threading.Thread(target=ensure_rollups_loaded, name="rollup-loader", daemon=True).start()
+    threading.Thread(target=run_alert_engine, name="alert-engine", daemon=True).start()
+    threading.Thread(target=run_telemetry_writer, name="telemetry-writer", daemon=True).start()
+    threading.Thread(target=run_helmet_eviction, name="helmet-eviction", daemon=True).start()
+    atexit.register(telemetry_store.flush)
+    if STATE_SNAPSHOT_FILE:
+        threading.Thread(target=run_state_snapshots, name="state-snapshots", daemon=True).start()
+        atexit.register(save_state)
+
+# --- Multi-Process Serving (Shared Memory) ---
+# standalone: one process reads the serial ports and serves HTTP (default)
+# ingest:     owns the serial ports and publishes helmet state to shared memory, no HTTP
+# web:        WSGI worker (e.g. under gunicorn) that follows the shared table
+SERVER_ROLE = os.environ.get('AURA_ROLE', 'standalone')
+SHARED_TABLE_NAME = os.environ.get('SHARED_TABLE_NAME', 'aura_helmets')
+SHARED_POLL_SECONDS = float(os.environ.get('SHARED_POLL_SECONDS', 0.1))
+SHARED_REATTACH_SECONDS = float(os.environ.get('SHARED_REATTACH_SECONDS', 2.0))
+SHARED_FIELD_BYTES = 16          # fixed width of the ID and every raw field
+
+class SharedHelmetTable:
+    """
+    HelmetTable rows in a multiprocessing.shared_memory block.
+    A single writer (the ingest process) wraps each row update in a seqlock:
+    the sequence counter is odd while a write is in progress. Readers take
+    no lock; they copy what they need and retry if the counter was odd or
+    moved while they were copying.
+    Every block gets a new epoch when it is created and is marked closed when
+    the ingest process exits, so a worker still mapping an unlinked block can
+    tell it has been replaced.
+    Raw fields longer than SHARED_FIELD_BYTES are truncated.
+    """
+    HEADER = 8           # int64 slots: seq, version, count, capacity, epoch, closed, (reserved)
+    ARRAYS = ("header", "ids", "raw", "values", "updated", "row_versions", "field_versions")
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        arrays = [
+            ("header", np.int64, (self.HEADER,)),
+            ("ids", f"S{SHARED_FIELD_BYTES}", (capacity,)),
+            ("raw", f"S{SHARED_FIELD_BYTES}", (capacity, NUM_FIELDS)),
+            ("values", np.float64, (capacity, NUM_FIELDS)),
+            ("updated", np.float64, (capacity,)),
+            ("row_versions", np.int64, (capacity,)),
+            ("field_versions", np.int64, (capacity, NUM_FIELDS)),
+        ]
+        offset = 0
+        for name, dtype, shape in arrays:
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+    @staticmethod
+    def size_for(capacity):
+        per_row = SHARED_FIELD_BYTES * (1 + NUM_FIELDS) + 8 * NUM_FIELDS + 8 + 8 + 8 * NUM_FIELDS
+        return 8 * SharedHelmetTable.HEADER + capacity * per_row
+
+    @classmethod
+    def create(cls, name, capacity):
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size_for(capacity))
+        table = cls(shm, capacity)
+        table.header[:] = 0
+        table.header[3] = capacity
+        table.header[4] = time.time_ns()
+        return table
 
-# --- Background Task for Reading Serial Data ---
-def read_from_port():
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # Before Python 3.13 every attaching process registers the block with
+        # its resource tracker, which unlinks it when that process exits;
+        # only the ingest process that created it should do that
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        capacity = int(np.ndarray((cls.HEADER,), dtype=np.int64, buffer=shm.buf)[3])
+        return cls(shm, capacity)
+
+    @property
+    def epoch(self):
+        return int(self.header[4])
+
+    @property
+    def closed(self):
+        return bool(self.header[5])
+
+    def close(self):
+        """
+        Unmaps the block. The arrays are views of it and have to go first.
+        """
+        for name in self.ARRAYS:
+            delattr(self, name)
+        self.shm.close()
+
+    def publish(self, table, slot):
+        """
+        Copies one HelmetTable row. Called by the ingest process with data_lock held.
+        """
+        header = self.header
+        header[0] += 1                   # odd: write in progress
+        self.ids[slot] = table.ids[slot].encode('utf-8')[:SHARED_FIELD_BYTES]
+        self.raw[slot] = [p.encode('utf-8')[:SHARED_FIELD_BYTES] for p in table.raw[slot]]
+        self.values[slot] = table.values[slot]
+        self.updated[slot] = table.updated[slot]
+        self.field_versions[slot] = table.field_versions[slot]
+        self.row_versions[slot] = table.row_versions[slot]
+        header[1] = table.version
+        header[2] = len(table)
+        header[0] += 1                   # even: consistent again
+
+    def clear(self, slot):
+        """
+        Blanks an evicted row so workers replaying the table skip it.
+        """
+        header = self.header
+        header[0] += 1
+        self.ids[slot] = b''
+        self.row_versions[slot] = 0
+        header[0] += 1
+
+    def read_since(self, since):
+        """
+        Returns (version, rows) with every row changed after `since`, where a
+        row is (id, raw fields, values, updated, row version, field versions).
+        """
+        while True:
+            start = int(self.header[0])
+            if start & 1:
+                time.sleep(0)
+                continue
+            version = int(self.header[1])
+            count = int(self.header[2])
+            slots = np.flatnonzero(self.row_versions[:count] > since)
+            ids = self.ids[slots].copy()
+            raw = self.raw[slots].copy()
+            values = self.values[slots].copy()
+            updated = self.updated[slots].copy()
+            row_versions = self.row_versions[slots].copy()
+            field_versions = self.field_versions[slots].copy()
+            if int(self.header[0]) == start:
+                break
+        rows = []
+        for i in range(len(slots)):
+            rows.append((ids[i].decode('utf-8'), [p.decode('utf-8') for p in raw[i]], values[i],
+                         float(updated[i]), int(row_versions[i]), field_versions[i]))
+        return version, rows
+
+shared_table = None
+follower_started = False
+follower_lock = threading.Lock()
+
+def apply_shared_rows(version, rows):
     """
-    Reads data from the serial port in a background thread.
-    This function runs in a continuous loop.
+    Replays rows read from the shared table into this worker's local state,
+    keeping versions identical to the ingest process so ETags and ?since=
+    work across workers. History, anomaly, link and alert state stay in the
+    ingest process (see ingest_query).
     """
-    global latest_data
-    
+    published = []
+    with data_lock:
+        newest = None
+        for helmet_id, raw, values, updated, row_version, field_versions in rows:
+            new_helmet = helmet_id not in helmet_table.slots
+            slot = helmet_table.slot_for(helmet_id)
+            if slot is None:
+                continue
+            previous_version = helmet_table.row_versions[slot]
+            helmet_table.raw[slot] = raw
+            helmet_table.values[slot] = values
+            helmet_table.updated[slot] = updated
+            helmet_table.row_versions[slot] = row_version
+            helmet_table.field_versions[slot] = field_versions
+            changed = np.flatnonzero(field_versions > previous_version)
+            published.append((helmet_id, {int(i): raw[i] for i in changed}))
+            helmet_grid.update(helmet_id, values[5], values[6])
+            box_rollups.on_packet(helmet_id, helmet_table.values[slot], new_helmet)
+            if newest is None or row_version > newest[0]:
+                newest = (row_version, raw)
+        helmet_table.version = max(helmet_table.version, version)
+        if newest is not None:
+            latest_data["values"] = newest[1]
+    for helmet_id, changes in published:
+        if changes:
+            live_feed.publish(helmet_id, changes)
+
+def find_replacement(table):
+    """
+    Returns the block now published under SHARED_TABLE_NAME if it is not the
+    one this worker maps (the ingest process restarted), else None.
+    """
+    try:
+        current = SharedHelmetTable.attach(SHARED_TABLE_NAME)
+    except FileNotFoundError:
+        return None
+    if current.epoch == table.epoch:
+        current.close()
+        return None
+    return current
+
+def follow_shared_table():
+    """
+    Web worker thread: attaches to the ingest process's table and applies
+    changed rows every SHARED_POLL_SECONDS. When the block is marked closed,
+    or has been quiet for SHARED_REATTACH_SECONDS, it checks whether the
+    ingest process published a new one and switches to it.
+    """
+    global shared_table
+    while shared_table is None:
+        try:
+            shared_table = SharedHelmetTable.attach(SHARED_TABLE_NAME)
+            print(f"✅ Attached to shared helmet table '{SHARED_TABLE_NAME}'")
+        except FileNotFoundError:
+            print(f"🔌 Shared helmet table '{SHARED_TABLE_NAME}' not found, is the ingest process running? Retrying...")
+            time.sleep(RECONNECT_MIN_SECONDS)
+    ensure_rollups_loaded()
+    last_seq = int(shared_table.header[0])
+    last_change = time.monotonic()
     while True:
-        ser = None
+        if shared_table.closed or time.monotonic() - last_change >= SHARED_REATTACH_SECONDS:
+            replacement = find_replacement(shared_table)
+            if replacement is not None:
+                shared_table.close()
+                shared_table = replacement
+                print(f"♻️ Ingest process restarted, reattached to shared helmet table '{SHARED_TABLE_NAME}'")
+                with data_lock:
+                    # Versions restart with the new table; replay every row
+                    helmet_table.version = 0
+                    helmet_table.row_versions[:] = 0
+                    helmet_table.field_versions[:] = 0
+            last_change = time.monotonic()
+        seq = int(shared_table.header[0])
+        if seq != last_seq:
+            last_seq = seq
+            last_change = time.monotonic()
+        with data_lock:
+            since = helmet_table.version
+        version, rows = shared_table.read_since(since)
+        if rows:
+            apply_shared_rows(version, rows)
+        time.sleep(SHARED_POLL_SECONDS)
+
+def start_web_worker():
+    """
+    Starts the shared-table follower of a web worker once, on its first
+    request (after gunicorn has forked it).
+    """
+    global follower_started
+    with follower_lock:
+        if follower_started:
+            return
+        follower_started = True
+    threading.Thread(target=follow_shared_table, name="shared-table-follower", daemon=True).start()
+    threading.Thread(target=run_helmet_eviction, name="helmet-eviction", daemon=True).start()
+
+# Web workers have no serial ports, so they hand downlink commands (and
+# GET /commands status requests) to the ingest process over a localhost TCP
+# socket: one JSON line per request, one JSON line per reply.
+COMMAND_FORWARD_PORT = int(os.environ.get('COMMAND_FORWARD_PORT', 7790))
+COMMAND_FORWARD_MAX_BYTES = 65536
+COMMAND_REPLY_MAX_BYTES = 16 * 1024 * 1024      # /history replies can be large
+
+def handle_forwarded(message):
+    if message.get("op") == "send" and message.get("command") in DOWNLINK_COMMANDS:
+        downlink.send(message["command"], [str(h) for h in message.get("helmets", [])])
+        return {"queued": True}
+    if message.get("op") == "cancel" and message.get("command") in (None, *DOWNLINK_COMMANDS):
+        return {"cancelled": downlink.cancel({str(h) for h in message.get("helmets", [])}, message["command"])}
+    if message.get("op") == "status":
+        return downlink.status()
+    if message.get("op") == "query" and message.get("name") in INGEST_QUERIES:
+        body, status = INGEST_QUERIES[message["name"]](message.get("args") or {}, *message.get("path", []))
+        return {"body": body, "status": status}
+    return {"error": "unknown request"}
+
+def serve_forwarded(conn):
+    with conn:
         try:
-            ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-            print(f"✅ Successfully connected to {SERIAL_PORT}")
-            
-            while True:
-                if not ser.is_open:
-                    break
-                
-                line = ser.readline().decode('utf-8').strip()
-
-                if line:
-                    try:
-                        parts = [p.strip() for p in line.split(',')]
-                        
-                        if len(parts) == 9:
-                            with data_lock:
-                                latest_data["values"] = parts
-                        else:
-                            print(f"⚠️ Warning: Received {len(parts)} values, expected 9. Data: '{line}'")
-                    
-                    except (ValueError, IndexError) as e:
-                        print(f"❌ Error parsing data: '{line}'. Reason: {e}")
+            conn.settimeout(2)
+            line = conn.makefile('rb').readline(COMMAND_FORWARD_MAX_BYTES)
+            reply = handle_forwarded(json.loads(line))
+            conn.sendall(json.dumps(reply).encode('utf-8') + b"\n")
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            log_event(f"⚠️ Warning: Bad forwarded command request: {e}")
 
-        except serial.SerialException:
-            print(f"🔌 Port {SERIAL_PORT} not found or disconnected. Retrying in 5 seconds...")
-            if ser and ser.is_open:
-                ser.close()
-            time.sleep(5)
+def run_command_listener(server):
+    """
+    Ingest process thread: serves forwarded requests from web workers, one
+    thread per connection so a slow query never holds up a command.
+    """
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=serve_forwarded, args=(conn,), name="command-request", daemon=True).start()
+
+def forward_to_ingest(message):
+    """
+    Sends one request to the ingest process and returns its reply.
+    Raises OSError when the ingest process cannot be reached.
+    """
+    with socket.create_connection(('127.0.0.1', COMMAND_FORWARD_PORT), timeout=2) as conn:
+        conn.sendall(json.dumps(message).encode('utf-8') + b"\n")
+        reply = conn.makefile('rb').readline(COMMAND_REPLY_MAX_BYTES)
+    try:
+        return json.loads(reply)
+    except ValueError:
+        raise OSError("no reply from the ingest process")
+
+def run_ingest_process():
+    """
+    Production ingest role: serial readers, alerting and telemetry, with the
+    helmet table published to shared memory for the web workers.
+    """
+    global shared_table
+    shared_table = SharedHelmetTable.create(SHARED_TABLE_NAME, MAX_HELMETS)
+    print(f"📡 Publishing helmet state to shared memory '{SHARED_TABLE_NAME}'")
+
+    def release():
+        # Tell web workers still mapping this block to look for the next one
+        shared_table.header[5] = 1
+        shared_table.shm.unlink()
+        shared_table.close()
+    atexit.register(release)
+
+    command_server = socket.create_server(('127.0.0.1', COMMAND_FORWARD_PORT))
+    threading.Thread(target=run_command_listener, args=(command_server,), name="command-listener", daemon=True).start()
+    print(f"📨 Accepting commands from web workers on 127.0.0.1:{COMMAND_FORWARD_PORT}")
+    restore_state()
+    start_serial_readers(SERIAL_PORTS)
+    start_background_work()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 # A secret key is required to use Flask sessions
 app.secret_key = 'a_very_secret_key_for_this_app'
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if SERVER_ROLE == 'web' and not follower_started:
+        start_web_worker()
+
+@app.after_request
+def record_request_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        request_seconds.observe(time.perf_counter() - start, request.endpoint or "unmatched")
+    return response
+
+# --- Static Assets ---
+# build_assets.py writes content-hashed bundles to static/dist and maps logical
+# names to them in manifest.json. A hashed file never changes, so browsers may
+# keep it for a year; a rebuild produces new names instead.
+ASSET_MANIFEST_FILE = os.path.join(app.static_folder, 'dist', 'manifest.json')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+asset_manifest = load_asset_manifest()
+
+@app.context_processor
+def inject_asset_url():
+    def asset_url(name):
+        """
+        URL of a built asset, or None when the bundle has not been built.
+        """
+        path = asset_manifest.get(name)
+        return url_for('static', filename=path) if path else None
+    return {"asset_url": asset_url}
+
+@app.after_request
+def cache_built_assets(response):
+    if request.endpoint == 'static' and request.path.startswith('/static/dist/') \
+            and not request.path.endswith('manifest.json') and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
 # --- Configuration ---
-DATABASE_FILE = 'users.json'
+DATABASE_FILE = os.environ.get('DATABASE_FILE', 'users.db')
+# Pre-SQLite store; imported once into an empty database
+LEGACY_USERS_FILE = 'users.json'
 
 # --- Helper Functions for Data Handling ---
-def load_users():
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    unique_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    id TEXT PRIMARY KEY,
+    owner_id INTEGER NOT NULL REFERENCES users(unique_id),
+    parent_id TEXT REFERENCES boxes(id),
+    name TEXT NOT NULL,
+    location TEXT,
+    type TEXT NOT NULL,
+    helmet_ids TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS idx_boxes_owner_parent ON boxes(owner_id, parent_id);
+CREATE INDEX IF NOT EXISTS idx_boxes_parent ON boxes(parent_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+db_local = threading.local()
+db_init_lock = threading.Lock()
+db_initialized = False
+
+def get_db():
     """
-    Loads user data from a JSON file into a pandas DataFrame.
-    If the file doesn't exist, it creates an empty DataFrame.
+    Returns this thread's SQLite connection, creating the schema (and running
+    the users.json migration) the first time the process touches the database.
     """
-    if os.path.exists(DATABASE_FILE) and os.path.getsize(DATABASE_FILE) > 0:
-        df = pd.read_json(DATABASE_FILE)
-    else:
-        # Create a new, empty DataFrame with the required columns
-        df = pd.DataFrame(columns=['unique_id', 'username', 'password', 'boxes'])
-    return df
+    global db_initialized
+    conn = getattr(db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_FILE, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        db_local.conn = conn
+    if not db_initialized:
+        with db_init_lock:
+            if not db_initialized:
+                with conn:
+                    conn.executescript(SCHEMA)
+                migrate_legacy_users(conn)
+                db_initialized = True
+    return conn
+
+def insert_box_tree(conn, owner_id, box, parent_id=None):
+    """
+    Inserts a box dict and its nested sub_boxes.
+    """
+    conn.execute(
+        'INSERT INTO boxes (id, owner_id, parent_id, name, location, type, helmet_ids) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (box['id'], owner_id, parent_id, box.get('name', ''), box.get('location'),
+         box.get('type', 'parent' if parent_id is None else 'sub-box'),
+         json.dumps([str(h) for h in box.get('helmet_ids', [])])))
+    for sub_box in box.get('sub_boxes', []) or []:
+        insert_box_tree(conn, owner_id, sub_box, box['id'])
+
+def migrate_legacy_users(conn):
+    """
+    One-shot import of the old users.json store. Runs only once per database;
+    the JSON file is left in place untouched.
+    The check, the import and the marker share one write transaction, so a
+    crash cannot leave users without the marker, and of several processes
+    starting together only the first imports.
+    """
+    count = 0
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_users_migrated'").fetchone():
+            return
+        if os.path.exists(LEGACY_USERS_FILE) and os.path.getsize(LEGACY_USERS_FILE) > 0:
+            with open(LEGACY_USERS_FILE, encoding='utf-8') as f:
+                records = json.load(f)
+            for user in records:
+                conn.execute('INSERT INTO users (unique_id, username, password) VALUES (?, ?, ?)',
+                             (int(user['unique_id']), user['username'], user['password']))
+                for box in user.get('boxes') or []:
+                    insert_box_tree(conn, int(user['unique_id']), box)
+                count += 1
+        conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_users_migrated', ?)", (str(time.time()),))
+    if count:
+        print(f"📦 Migrated {count} users from {LEGACY_USERS_FILE} to {DATABASE_FILE}")
 
-def save_users(df):
+@timed_store
+def get_user_by_username(username):
     """
-    Saves the pandas DataFrame back to the JSON file in records format.
+    Returns the user row with this username, or None.
     """
-    df.to_json(DATABASE_FILE, orient='records', indent=4)
+    return get_db().execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
 
-def generate_unique_id(df):
+@timed_store
+def create_user(username, password):
     """
-    Generates a unique 6-digit ID that is not already in the DataFrame.
+    Creates a user with a random unused 6-digit ID and returns the ID.
+    Raises sqlite3.IntegrityError if the username is taken.
     """
-    if 'unique_id' not in df.columns:
-        return random.randint(100000, 999999)
-    existing_ids = set(df['unique_id'].tolist())
+    conn = get_db()
     while True:
         new_id = random.randint(100000, 999999)
-        if new_id not in existing_ids:
+        try:
+            with conn:
+                conn.execute('INSERT INTO users (unique_id, username, password) VALUES (?, ?, ?)',
+                             (new_id, username, password))
             return new_id
+        except sqlite3.IntegrityError:
+            if get_user_by_username(username):
+                raise
+
+def box_from_row(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'location': row['location'],
+        'type': row['type'],
+        'helmet_ids': json.loads(row['helmet_ids']),
+        'sub_boxes': [],
+    }
 
-def find_box_by_id(box_list, box_id):
+def build_box_tree(rows):
     """
-    Recursively searches for a box with a specific ID in a list of boxes.
+    Assembles box rows (ordered by insertion) into the nested
+    boxes -> sub_boxes structure the templates expect.
     """
-    for box in box_list:
-        if box.get('id') == box_id:
-            return box
-        found = find_box_by_id(box.get('sub_boxes', []), box_id)
-        if found:
-            return found
-    return None
+    nodes = {row['id']: box_from_row(row) for row in rows}
+    roots = []
+    for row in rows:
+        node = nodes[row['id']]
+        parent = nodes.get(row['parent_id'])
+        if parent is not None:
+            parent['sub_boxes'].append(node)
+        elif row['parent_id'] is None:
+            roots.append(node)
+    return roots
 
-def find_and_add_sub_box(box_list, parent_id, new_sub_box):
+def find_in_tree(boxes, box_id, parent=None):
     """
-    Recursively finds the parent box by its ID and adds a new sub-box.
+    Returns (node, parent) for a box anywhere in a tree, or (None, None).
     """
-    for box in box_list:
-        if box.get('id') == parent_id:
-            if 'sub_boxes' not in box:
-                box['sub_boxes'] = []
-            box['sub_boxes'].append(new_sub_box)
-            return True
-        if find_and_add_sub_box(box.get('sub_boxes', []), parent_id, new_sub_box):
-            return True
-    return False
+    for box in boxes:
+        if box['id'] == box_id:
+            return box, parent
+        node, node_parent = find_in_tree(box['sub_boxes'], box_id, box)
+        if node is not None:
+            return node, node_parent
+    return None, None
 
-#########################################################
+@timed_store
+def load_user_boxes(unique_id):
+    """
+    Reads the full box tree of a user from the database.
+    """
+    rows = get_db().execute('SELECT * FROM boxes WHERE owner_id = ? ORDER BY rowid', (unique_id,)).fetchall()
+    return build_box_tree(rows)
 
-# --- HTML Template with JavaScript ---
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Live Sensor Data</title>
-
-    <script src="https://cdn.tailwindcss.com"></script>
-
-    <script>
-      tailwind.config = {
-        theme: {
-          extend: {
-            colors: {
-              'light-gold': '#f6cf9a',
-              'dark-slate': '#474454',
-              'medium-slate': '#76737c',
-              'muted-tan': '#d0bc8f',
-              'terracotta-rose': '#c0786a',
-            }
-          }
-        }
-      }
-    </script>
-
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;700&display=swap" rel="stylesheet">
-    <style>
-      body { font-family: 'Inter', sans-serif; }
-    </style>
-</head>
-<body class="bg-dark-slate flex items-center justify-center min-h-screen">
-
-    <div class="bg-white p-6 sm:p-8 rounded-xl shadow-lg w-full max-w-md">
-        
-        <h1 class="text-3xl font-bold text-center text-terracotta-rose mb-6">
-            🔴 Live Sensor Feed
-        </h1>
-        
-        <ul id="sensor-list" class="space-y-3">
-        </ul>
-
-    </div>
-
-    <!-- 🚨 Evacuation Popup Modal -->
-    <div id="evac-modal" class="fixed inset-0 bg-black bg-opacity-50 flex items-center justify-center hidden">
-      <div class="bg-white p-6 rounded-xl shadow-lg max-w-sm w-full">
-        <h2 class="text-xl font-bold text-red-600 mb-4">⚠️ Emergency Warning</h2>
-        <p class="mb-6 text-dark-slate">Do you want workers to evacuate?</p>
-        <div class="flex justify-end space-x-4">
-          <button id="btn-no" class="px-4 py-2 bg-gray-300 rounded-lg hover:bg-gray-400">No</button>
-          <button id="btn-yes" class="px-4 py-2 bg-red-600 text-white rounded-lg hover:bg-red-700">Yes</button>
-        </div>
-      </div>
-    </div>
-
-    <script>
-        const sensorLabels = [
-            "ID", "MQ2", "MQ7", "MQ135", "Fall dec", 
-            "X-cor", "Y-cor", "SP-O₂", "Heart rate"
-        ];
-
-        let popupShown = false; // 🚨 Flag to avoid repeated popups
-
-        // Show/hide popup functions
-        function showEvacModal() {
-            if (!popupShown) {
-                document.getElementById('evac-modal').classList.remove('hidden');
-                popupShown = true; // mark popup as shown
-            }
-        }
-        function hideEvacModal() {
-            document.getElementById('evac-modal').classList.add('hidden');
-        }
+# --- Box Model Cache ---
+BOX_CACHE_TENANTS = int(os.environ.get('BOX_CACHE_TENANTS', 256))
 
-        // Button actions
-        document.addEventListener("DOMContentLoaded", () => {
-            document.getElementById("btn-yes").addEventListener("click", () => {
-                alert("🚨 Evacuation initiated!");
-                hideEvacModal();
-            });
-            document.getElementById("btn-no").addEventListener("click", () => {
-                hideEvacModal();
-            });
-        });
-
-        function updateSensorValues() {
-            fetch('/data')
-                .then(response => response.json())
-                .then(data => {
-                    const sensorList = document.getElementById('sensor-list');
-                    sensorList.innerHTML = ''; // Clear previous data
-
-                    data.values.forEach((value, index) => {
-                        // Create the list item with Tailwind classes
-                        const listItem = document.createElement('li');
-                        listItem.className = 'flex justify-between items-center py-3 border-b border-muted-tan/50';
-
-                        // Create the label span
-                        const labelSpan = document.createElement('span');
-                        labelSpan.className = 'text-medium-slate';
-                        labelSpan.textContent = `${sensorLabels[index]}:`;
-                        
-                        // Create the value span
-                        const valueSpan = document.createElement('span');
-                        valueSpan.className = 'font-bold text-dark-slate font-mono text-xl';
-                        
-                        if (!isNaN(value) && value.trim() !== "") {
-                            // Numeric value
-                            if (index === 0 ) { 
-                                valueSpan.textContent = parseInt(value);
-                                valueSpan.classList.add("text-green-800");
-                            } else if (index === 4 ) { 
-                                valueSpan.textContent = "NORMAL";
-                                valueSpan.classList.add("text-green-800");
-                            } else if (index === 7 ) { 
-                                valueSpan.textContent = parseFloat(value) + "%";
-                                valueSpan.classList.add("text-green-800");
-                            } else {
-                                valueSpan.textContent = parseFloat(value).toFixed(2);
-                                valueSpan.classList.add("text-green-800");
-                            }
-                        } else {
-                            // Non-numeric (string alert, error, etc.)
-                            valueSpan.textContent = "ALERT";
-                            valueSpan.classList.add("text-red-800");
-
-                            // 🚨 Trigger popup only once
-                            showEvacModal();
-                        }
-                        
-                        listItem.appendChild(labelSpan);
-                        listItem.appendChild(valueSpan);
-                        sensorList.appendChild(listItem);
-                    });
-                })
-                .catch(error => console.error('Error fetching data:', error));
-        }
+class BoxCache:
+    """
+    Process-wide LRU cache of parsed box trees, one entry per user, plus a flat
+    box_id -> (owner, node, parent) index over every cached tree.
+    Entries are dropped when this process writes a user's boxes, and the whole
+    cache is cleared when the database files change on disk (another process
+    wrote to them).
+    Cached trees are shared between requests and must be treated as read-only.
+    Every drop bumps a generation counter; a tree loaded while the generation
+    moved may predate the write and is returned uncached.
+    """
+    def __init__(self, max_tenants):
+        self.max_tenants = max_tenants
+        self.lock = threading.Lock()
+        self.trees = OrderedDict()     # owner_id -> list of root boxes
+        self.index = {}                # box_id -> (owner_id, node, parent node or None)
+        self.signature = None
+        self.generation = 0
+
+    def file_signature(self):
+        signature = []
+        for path in (DATABASE_FILE, DATABASE_FILE + '-wal'):
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def check_files(self):
+        # Caller holds self.lock
+        signature = self.file_signature()
+        if signature != self.signature:
+            if self.signature is not None:
+                # Helmet assignments may have changed too (e.g. provision.py);
+                # the next ensure_rollups_loaded() reads them again
+                box_rollups.loaded = False
+            self.trees.clear()
+            self.index.clear()
+            self.signature = signature
+            self.generation += 1
+
+    def index_tree(self, owner_id, boxes, parent=None):
+        for box in boxes:
+            self.index[box['id']] = (owner_id, box, parent)
+            self.index_tree(owner_id, box['sub_boxes'], box)
+
+    def unindex_tree(self, boxes):
+        for box in boxes:
+            self.index.pop(box['id'], None)
+            self.unindex_tree(box['sub_boxes'])
+
+    def tree(self, owner_id):
+        """
+        Returns a user's cached box tree, loading it on a miss.
+        """
+        with self.lock:
+            self.check_files()
+            boxes = self.trees.get(owner_id)
+            if boxes is not None:
+                self.trees.move_to_end(owner_id)
+                return boxes
+            generation = self.generation
+        boxes = load_user_boxes(owner_id)
+        with self.lock:
+            if self.generation != generation:
+                return boxes
+            if owner_id not in self.trees:
+                self.trees[owner_id] = boxes
+                self.index_tree(owner_id, boxes)
+                while len(self.trees) > self.max_tenants:
+                    _, evicted = self.trees.popitem(last=False)
+                    self.unindex_tree(evicted)
+            return self.trees[owner_id]
+
+    def find(self, owner_id, box_id):
+        """
+        Returns (node, parent) for one of a user's boxes, or (None, None).
+        """
+        boxes = self.tree(owner_id)
+        with self.lock:
+            entry = self.index.get(box_id)
+        if entry is None or entry[0] != owner_id:
+            # The tree may not have been cached; look in the copy we were given
+            return find_in_tree(boxes, box_id)
+        return entry[1], entry[2]
+
+    def invalidate(self, owner_id):
+        """
+        Drops a user's entry after this process wrote to their boxes.
+        """
+        with self.lock:
+            boxes = self.trees.pop(owner_id, None)
+            if boxes is not None:
+                self.unindex_tree(boxes)
+            # Our own write changed the files; don't let it flush everyone else
+            self.signature = self.file_signature()
+            self.generation += 1
+
+box_cache = BoxCache(BOX_CACHE_TENANTS)
+
+def get_user_boxes(unique_id):
+    """
+    Returns the full box tree of a user.
+    """
+    return box_cache.tree(unique_id)
+
+def get_box(unique_id, box_id):
+    """
+    Returns one of a user's boxes with its nested sub_boxes, or None.
+    """
+    return box_cache.find(unique_id, box_id)[0]
+
+@timed_store
+def insert_box(unique_id, box, parent_id=None):
+    """
+    Adds a single box for a user, optionally under one of their boxes.
+    Returns False if the parent box does not belong to the user.
+    """
+    conn = get_db()
+    with conn:
+        if parent_id is not None:
+            owned = conn.execute('SELECT 1 FROM boxes WHERE id = ? AND owner_id = ?', (parent_id, unique_id)).fetchone()
+            if not owned:
+                return False
+        insert_box_tree(conn, unique_id, box, parent_id)
+    box_cache.invalidate(unique_id)
+    with data_lock:
+        register_box_parents(box, parent_id)
+    return True
+
+def register_box_parents(box, parent_id):
+    box_rollups.add_box(box['id'], parent_id)
+    for sub_box in box.get('sub_boxes', []) or []:
+        register_box_parents(sub_box, box['id'])
+
+@timed_store
+def set_box_helmets(unique_id, box_id, helmet_ids):
+    """
+    Replaces the helmets assigned directly to one of a user's boxes.
+    Returns False if the box does not belong to the user.
+    """
+    conn = get_db()
+    with conn:
+        cursor = conn.execute('UPDATE boxes SET helmet_ids = ? WHERE id = ? AND owner_id = ?',
+                              (json.dumps(helmet_ids), box_id, unique_id))
+    if cursor.rowcount != 1:
+        return False
+    box_cache.invalidate(unique_id)
+    ensure_rollups_loaded()
+    with data_lock:
+        box_rollups.assign(box_id, helmet_ids)
+    return True
+
+def ensure_rollups_loaded():
+    """
+    Loads every box's parent and helmet assignments into box_rollups once.
+    """
+    if box_rollups.loaded:
+        return
+    rows = get_db().execute('SELECT id, parent_id, helmet_ids FROM boxes').fetchall()
+    with data_lock:
+        if not box_rollups.loaded:
+            box_rollups.load([tuple(row) for row in rows])
 
-        updateSensorValues();
-        setInterval(updateSensorValues, 1000); // Refresh every second
-    </script>
+def box_helmet_ids(box):
+    """
+    Collects the helmet IDs assigned to a box and all of its sub-boxes.
+    """
+    ids = {str(helmet_id) for helmet_id in box.get('helmet_ids', [])}
+    for sub_box in box.get('sub_boxes', []):
+        ids |= box_helmet_ids(sub_box)
+    return ids
 
-</body>
-</html>
+def user_helmet_ids(unique_id):
+    """
+    Every helmet assigned to any of a user's boxes.
+    """
+    ids = set()
+    for box in get_user_boxes(unique_id):
+        ids |= box_helmet_ids(box)
+    return ids
 
+# --- Paginated Box Listing ---
+# Pages render one level of the tree at a time, so their cost follows what is
+# on screen rather than the size of a user's whole tree. These read SQLite
+# directly instead of going through box_cache, which loads full trees.
+BOX_PAGE_SIZE = int(os.environ.get('BOX_PAGE_SIZE', 24))
+BOX_PAGE_MAX = 200
 
+BOX_SUMMARY_SQL = """
+SELECT b.rowid, b.id, b.name, b.location, b.type, b.helmet_ids,
+       (SELECT COUNT(*) FROM boxes c WHERE c.parent_id = b.id) AS child_count
+FROM boxes b
 """
 
+def box_summary(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'location': row['location'],
+        'type': row['type'],
+        'helmet_ids': json.loads(row['helmet_ids']),
+        'child_count': row['child_count'],
+    }
+
+@timed_store
+def load_box(unique_id, box_id):
+    """
+    Reads one of a user's boxes without its subtree (child_count holds the
+    number of direct sub-boxes), or None.
+    """
+    row = get_db().execute(BOX_SUMMARY_SQL + 'WHERE b.id = ? AND b.owner_id = ?',
+                           (box_id, unique_id)).fetchone()
+    return box_summary(row) if row else None
+
+@timed_store
+def load_box_page(unique_id, parent_id, after=0, limit=BOX_PAGE_SIZE):
+    """
+    Reads up to `limit` of a user's boxes directly under parent_id (None for
+    top-level projects) in insertion order, starting after rowid `after`.
+    Returns (boxes, next_cursor); next_cursor is None on the last page.
+    """
+    # Keyset pagination on idx_boxes_owner_parent, whose entries are ordered
+    # by rowid within each (owner, parent), so no page scans earlier ones
+    rows = get_db().execute(
+        BOX_SUMMARY_SQL + 'WHERE b.owner_id = ? AND b.parent_id IS ? AND b.rowid > ? ORDER BY b.rowid LIMIT ?',
+        (unique_id, parent_id, after, limit + 1)).fetchall()
+    next_cursor = str(rows[limit - 1]['rowid']) if len(rows) > limit else None
+    return [box_summary(row) for row in rows[:limit]], next_cursor
+
+# --- Bulk Provisioning ---
+# Creates a whole site (projects, their workers and helmet assignments) in one
+# request or one provision.py run. A batch is validated as a whole and written
+# in a single transaction, so it is applied entirely or not at all.
+#
+# JSON: a list (or {"boxes": [...]}) of projects,
+#   {"name": "Tunnel B", "location": "North shaft", "helmet_ids": [],
+#    "sub_boxes": [{"name": "Asha", "helmet_ids": ["12"]}, ...]}
+# or {"project_id": "<existing project>", "helmet_ids": [...], "sub_boxes": [...]}
+# to add helmets and workers to a project that already exists.
+#
+# CSV: one row per worker, with a header naming the columns
+#   project,location,worker,helmet_ids[,project_id]
+# Rows with the same project (or project_id) form one project; a row without
+# a worker adds helmets to the project itself. Several helmet IDs in one
+# cell are separated by ';' or spaces.
+PROVISION_MAX_BOXES = int(os.environ.get('PROVISION_MAX_BOXES', 10000))
+PROVISION_CSV_COLUMNS = ["project", "location", "worker", "helmet_ids", "project_id"]
+
+def split_helmet_ids(cell):
+    return [h for h in re.split(r'[;,\s]+', cell or '') if h]
+
+def parse_provision_csv(text):
+    """
+    Turns provisioning CSV into the JSON batch form.
+    Returns (projects, errors); each project and worker carries its row numbers.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    columns = [c.strip() for c in reader.fieldnames or []]
+    reader.fieldnames = columns
+    unknown = [c for c in columns if c not in PROVISION_CSV_COLUMNS]
+    if 'project' not in columns and 'project_id' not in columns:
+        return [], ["CSV header must have a project or project_id column"]
+    if unknown:
+        return [], [f"Unknown CSV column(s): {', '.join(unknown)}"]
+    projects = {}
+    errors = []
+    for line, row in enumerate(reader, start=2):
+        row = {key: (value or '').strip() for key, value in row.items() if key is not None}
+        key = ('id', row['project_id']) if row.get('project_id') else ('name', row.get('project', ''))
+        if not key[1]:
+            errors.append(f"row {line}: project is empty")
+            continue
+        project = projects.get(key)
+        if project is None:
+            project = projects[key] = {"where": f"row {line}", "sub_boxes": []}
+            if key[0] == 'id':
+                project["project_id"] = key[1]
+            else:
+                project["name"] = key[1]
+        if row.get('location') and key[0] == 'name':
+            project["location"] = row['location']
+        if row.get('worker'):
+            project["sub_boxes"].append({"where": f"row {line}", "name": row['worker'],
+                                         "helmet_ids": split_helmet_ids(row.get('helmet_ids'))})
+        elif row.get('helmet_ids'):
+            project["helmet_ids"] = project.get("helmet_ids", []) + split_helmet_ids(row['helmet_ids'])
+    return list(projects.values()), errors
+
+def clean_helmet_ids(value, where, errors):
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(h, (str, int)) for h in value):
+        errors.append(f"{where}: helmet_ids must be a list of IDs")
+        return []
+    return sorted({str(h).strip() for h in value if str(h).strip()})
+
+def plan_provision(conn, unique_id, projects):
+    """
+    Validates a batch against the user's existing boxes and assigns IDs to the
+    new ones. Returns (plan, assign, errors) where plan is a list of
+    (parent_id, box) ready for insert_box_tree and assign a list of
+    (existing project, its full new helmet list).
+    """
+    errors = []
+    if not isinstance(projects, list):
+        return [], [], ["Expected a list of projects"]
+    existing = {row['id']: row for row in conn.execute(
+        'SELECT id, name, type, helmet_ids FROM boxes WHERE owner_id = ?', (unique_id,))}
+    # helmet -> where it is assigned, so one helmet never ends up on two boxes
+    assigned = {}
+    for row in existing.values():
+        for helmet_id in json.loads(row['helmet_ids']):
+            assigned[helmet_id] = f"existing box '{row['name']}'"
+
+    def claim(helmet_ids, where):
+        for helmet_id in helmet_ids:
+            if helmet_id in assigned:
+                errors.append(f"{where}: helmet {helmet_id} is already assigned to {assigned[helmet_id]}")
+            else:
+                assigned[helmet_id] = where
+
+    plan = []
+    assign = {}
+    total = 0
+    for i, project in enumerate(projects):
+        where = f"boxes[{i}]"
+        if not isinstance(project, dict):
+            errors.append(f"{where}: expected an object")
+            continue
+        where = project.get("where", where)
+        sub_boxes = project.get("sub_boxes") or []
+        if not isinstance(sub_boxes, list):
+            errors.append(f"{where}: sub_boxes must be a list")
+            continue
+        parent_id = project.get("project_id")
+        if parent_id is not None:
+            parent = existing.get(parent_id)
+            if parent is None:
+                errors.append(f"{where}: project '{parent_id}' not found")
+            elif parent['type'] != 'parent':
+                errors.append(f"{where}: '{parent['name']}' is a worker, not a project")
+            else:
+                # Helmets for the existing project are added to the ones it already has
+                current = assign.get(parent_id) or json.loads(parent['helmet_ids'])
+                helmet_ids = [h for h in clean_helmet_ids(project.get("helmet_ids"), where, errors) if h not in current]
+                claim(helmet_ids, where)
+                if helmet_ids:
+                    assign[parent_id] = sorted(set(current) | set(helmet_ids))
+            box = None
+        else:
+            name = project.get("name")
+            location = project.get("location")
+            if not isinstance(name, str) or not name.strip():
+                errors.append(f"{where}: project name is required")
+            if not isinstance(location, str) or not location.strip():
+                errors.append(f"{where}: project location is required")
+            helmet_ids = clean_helmet_ids(project.get("helmet_ids"), where, errors)
+            claim(helmet_ids, where)
+            box = {'id': str(uuid.uuid4()), 'name': str(name).strip(), 'location': str(location).strip(),
+                   'type': 'parent', 'helmet_ids': helmet_ids, 'sub_boxes': []}
+            total += 1
+        workers = []
+        for j, sub_box in enumerate(sub_boxes):
+            sub_where = f"{where}.sub_boxes[{j}]"
+            if not isinstance(sub_box, dict):
+                errors.append(f"{sub_where}: expected an object")
+                continue
+            sub_where = sub_box.get("where", sub_where)
+            name = sub_box.get("name")
+            if not isinstance(name, str) or not name.strip():
+                errors.append(f"{sub_where}: worker name is required")
+            if sub_box.get("sub_boxes"):
+                errors.append(f"{sub_where}: workers cannot have sub_boxes")
+            helmet_ids = clean_helmet_ids(sub_box.get("helmet_ids"), sub_where, errors)
+            claim(helmet_ids, sub_where)
+            workers.append({'id': str(uuid.uuid4()), 'name': str(name).strip(), 'type': 'sub-box',
+                            'helmet_ids': helmet_ids, 'sub_boxes': []})
+        total += len(workers)
+        if box is not None:
+            box['sub_boxes'] = workers
+            plan.append((None, box))
+        else:
+            plan.extend((parent_id, worker) for worker in workers)
+    if total > PROVISION_MAX_BOXES:
+        errors.append(f"Batch creates {total} boxes, more than PROVISION_MAX_BOXES ({PROVISION_MAX_BOXES})")
+    if not total and not assign and not errors:
+        errors.append("Batch is empty")
+    return plan, list(assign.items()), errors
+
+@timed_store
+def provision_boxes(unique_id, projects, dry_run=False):
+    """
+    Validates and creates a batch of projects and workers for a user in one
+    transaction. Returns (report, errors); nothing is written when there are
+    errors or dry_run is set.
+    """
+    conn = get_db()
+    with conn:
+        # Take the write lock first so the batch is checked against what it will be written next to
+        conn.execute('BEGIN IMMEDIATE')
+        plan, assign, errors = plan_provision(conn, unique_id, projects)
+        if not errors and not dry_run:
+            for parent_id, box in plan:
+                insert_box_tree(conn, unique_id, box, parent_id)
+            for box_id, helmet_ids in assign:
+                conn.execute('UPDATE boxes SET helmet_ids = ? WHERE id = ? AND owner_id = ?',
+                             (json.dumps(helmet_ids), box_id, unique_id))
+    if errors:
+        return None, errors
+
+    created = []
+    for parent_id, box in plan:
+        created.append((parent_id, box))
+        created.extend((box['id'], sub_box) for sub_box in box['sub_boxes'])
+    if not dry_run:
+        box_cache.invalidate(unique_id)
+        ensure_rollups_loaded()
+        with data_lock:
+            for parent_id, box in plan:
+                register_box_parents(box, parent_id)
+            box_rollups.assign_many([(box['id'], box['helmet_ids']) for _, box in created if box['helmet_ids']]
+                                    + assign)
+    report = {
+        "dry_run": dry_run,
+        "created": {
+            "projects": sum(1 for _, box in created if box['type'] == 'parent'),
+            "workers": sum(1 for _, box in created if box['type'] == 'sub-box'),
+            "helmets": sum(len(box['helmet_ids']) for _, box in created),
+        },
+        "boxes": [{"id": box['id'], "name": box['name'], "type": box['type'], "parent_id": parent_id,
+                   "helmet_ids": box['helmet_ids']} for parent_id, box in created],
+        # Existing projects that were given more helmets, with their full helmet lists
+        "updated": [{"id": box_id, "helmet_ids": helmet_ids} for box_id, helmet_ids in assign],
+    }
+    return report, []
+
+#########################################################
+
 # --- Flask Routes ---
 @app.route('/', methods=['GET', 'POST'])
 def home():
@@ -288,7 +3505,6 @@ def login():
         login_username = request.form.get('login_username')
         login_id_str = request.form.get('login_unique_id')
         login_password = request.form.get('login_password')
-        users_df = load_users()
         error = None
 
         if not login_username or not login_id_str or not login_password:
@@ -296,22 +3512,20 @@ def login():
         else:
             try:
                 login_id = int(login_id_str)
-                user_match = users_df[users_df['username'] == login_username]
+                user_data = get_user_by_username(login_username)
 
-                if user_match.empty:
+                if user_data is None:
                     error = "Invalid username."
+                elif user_data['unique_id'] != login_id:
+                    error = "Invalid unique ID."
+                elif user_data['password'] != login_password:
+                    error = "Invalid password."
                 else:
-                    user_data = user_match.iloc[0]
-                    if user_data['unique_id'] != login_id:
-                        error = "Invalid unique ID."
-                    elif user_data['password'] != login_password:
-                        error = "Invalid password."
-                    else:
-                        session['username'] = user_data['username']
-                        session['unique_id'] = int(user_data['unique_id'])
-                        return redirect(url_for('next_page'))
-
-            except (ValueError, KeyError):
+                    session['username'] = user_data['username']
+                    session['unique_id'] = int(user_data['unique_id'])
+                    return redirect(url_for('next_page'))
+
+            except ValueError:
                 error = "Invalid unique ID format."
 
         return render_template('login.html', error=error)
@@ -326,28 +3540,19 @@ def signup():
     if request.method == 'POST':
         signup_username = request.form.get('signup_username')
         signup_password = request.form.get('signup_password')
-        users_df = load_users()
         error = None
 
         if not signup_username or not signup_password:
             error = "Both username and password are required for sign up."
-        elif not users_df[users_df['username'] == signup_username].empty:
-            error = "Username already exists. Please choose a different one."
         else:
-            new_id = generate_unique_id(users_df)
-            new_user = pd.DataFrame([{
-                'unique_id': new_id,
-                'username': signup_username,
-                'password': signup_password,
-                'boxes': []  # <-- Important: Initializes the box list
-            }])
-
-            users_df = pd.concat([users_df, new_user], ignore_index=True)
-            save_users(users_df)
-
-            session['username'] = signup_username
-            session['unique_id'] = int(new_id)
-            return redirect(url_for('next_page'))
+            try:
+                new_id = create_user(signup_username, signup_password)
+            except sqlite3.IntegrityError:
+                error = "Username already exists. Please choose a different one."
+            else:
+                session['username'] = signup_username
+                session['unique_id'] = int(new_id)
+                return redirect(url_for('next_page'))
 
         return render_template('signup.html', error=error)
 
@@ -364,19 +3569,14 @@ def next_page():
     username = session['username']
     unique_id = session['unique_id']
 
-    users_df = load_users()
-    user_row = users_df[users_df['unique_id'] == unique_id]
-
-    box_data = []
-    if not user_row.empty:
-        user_boxes = user_row.iloc[0].get('boxes')
-        if isinstance(user_boxes, list):
-            box_data = user_boxes
+    # First page only; the rest is fetched from /api/boxes as the user scrolls
+    boxes, next_cursor = load_box_page(unique_id, None)
 
     return render_template('next_page.html',
                            username=username,
                            unique_id=unique_id,
-                           boxes=box_data)
+                           boxes=boxes,
+                           next_cursor=next_cursor)
 
 @app.route('/add_box', methods=['POST'])
 def add_box():
@@ -393,31 +3593,15 @@ def add_box():
     if not box_name or not box_location:
         return redirect(url_for('next_page'))
 
-    users_df = load_users()
-    user_row_index_list = users_df.index[users_df['unique_id'] == unique_id].tolist()
-
-    if user_row_index_list:
-        user_row_index = user_row_index_list[0]
-
-        if 'boxes' not in users_df.columns:
-            users_df['boxes'] = [[] for _ in range(len(users_df))]
-
-        user_boxes = users_df.at[user_row_index, 'boxes']
-        if not isinstance(user_boxes, list):
-            user_boxes = []
-
-        # Create a new box with a unique ID and a place for sub-boxes
-        new_box = {
-            'id': str(uuid.uuid4()),
-            'name': box_name,
-            'location': box_location,
-            'sub_boxes': [],
-            'type': 'parent'
-        }
-        user_boxes.append(new_box)
-
-        users_df.at[user_row_index, 'boxes'] = user_boxes
-        save_users(users_df)
+    # Create a new box with a unique ID and a place for sub-boxes
+    new_box = {
+        'id': str(uuid.uuid4()),
+        'name': box_name,
+        'location': box_location,
+        'sub_boxes': [],
+        'type': 'parent'
+    }
+    insert_box(unique_id, new_box)
 
     return redirect(url_for('next_page'))
 
@@ -435,20 +3619,62 @@ def add_sub_box(parent_box_id):
     if not sub_box_name:
         return redirect(url_for('details', box_id=parent_box_id))
 
-    users_df = load_users()
-    user_row_index_list = users_df.index[users_df['unique_id'] == unique_id].tolist()
-
-    if user_row_index_list:
-        user_row_index = user_row_index_list[0]
-        user_boxes = users_df.at[user_row_index, 'boxes']
-        return render_template_string(HTML_TEMPLATE)
-        
+    new_sub_box = {
+        'id': str(uuid.uuid4()),
+        'name': sub_box_name,
+        'sub_boxes': [],
+        'type': 'sub-box'
+    }
+    insert_box(unique_id, new_sub_box, parent_box_id)
 
     return redirect(url_for('details', box_id=parent_box_id))
 
+@app.route('/assign_helmets/<box_id>', methods=['POST'])
+def assign_helmets(box_id):
+    """
+    Sets the helmet IDs (comma-separated) worn in a box or sub-box.
+    """
+    if 'unique_id' not in session:
+        return redirect(url_for('login'))
+
+    helmet_ids = sorted({h.strip() for h in request.form.get('helmet_ids', '').split(',') if h.strip()})
+    set_box_helmets(session['unique_id'], box_id, helmet_ids)
+    return redirect(url_for('details', box_id=box_id))
+
+@app.route('/get_live_com_data/<box_id>')
+def get_live_com_data(box_id):
+    """
+    Live aggregates for every helmet in a box subtree. s1-s3 are the worst
+    MQ2/MQ7/MQ135 readings and s4 the number of fallen workers, as used by
+    details.html.
+    """
+    if 'unique_id' not in session:
+        return jsonify({"error": "Login required"}), 401
+    if get_box(session['unique_id'], box_id) is None:
+        return jsonify({"error": "Box not found"}), 404
+    ensure_rollups_loaded()
+    with data_lock:
+        summary = box_rollups.summary(box_id, time.time())
+    if summary is None:
+        return jsonify({"error": "No helmets assigned to this box"})
+    gas = [summary["worst_gas"][SENSOR_LABELS[field]]["value"] for field in GAS_FIELDS]
+    summary.update({"s1": gas[0], "s2": gas[1], "s3": gas[2], "s4": summary["fallen"]})
+    return jsonify(summary)
+
 @app.route('/details/<box_id>/okdata')
 def okdata(box_id):
-     return render_template_string(HTML_TEMPLATE)
+    """
+    Live sensor feed for a box. Streams only the box's helmets when it has
+    any assigned, otherwise every helmet.
+    """
+    stream_url = url_for('stream')
+    command_box = ''
+    if 'unique_id' in session:
+        box = get_box(session['unique_id'], box_id)
+        if box and box_helmet_ids(box):
+            stream_url = url_for('stream', box=box_id)
+            command_box = box_id
+    return render_template('live_feed.html', stream_url=stream_url, command_box=command_box)
 
 @app.route('/details/<box_id>')
 def details(box_id):
@@ -458,32 +3684,583 @@ def details(box_id):
     if 'unique_id' not in session:
         return redirect(url_for('login'))
 
-    unique_id = session['unique_id']
-    users_df = load_users()
-    user_row = users_df[users_df['unique_id'] == unique_id]
-
-    if not user_row.empty:
-        user_boxes = user_row.iloc[0].get('boxes', [])
-        box = find_box_by_id(user_boxes, box_id)
-        if box:
-            return render_template('details.html', box=box)
+    box = load_box(session['unique_id'], box_id)
+    if box:
+        sub_boxes, next_cursor = load_box_page(session['unique_id'], box_id)
+        return render_template('details.html', box=box, sub_boxes=sub_boxes, next_cursor=next_cursor)
 
     # If the box isn't found, redirect to the main page
     return redirect(url_for('next_page'))
 
+@app.route('/api/boxes')
+def list_boxes():
+    """
+    Returns one page of the logged-in user's boxes directly under ?parent=<id>
+    (top-level projects when omitted), each with its number of sub-boxes.
+    Pass the returned next_cursor as ?cursor= to get the following page;
+    ?limit= sets the page size.
+    """
+    if 'unique_id' not in session:
+        return jsonify({"error": "Login required"}), 401
+    unique_id = session['unique_id']
+    parent_id = request.args.get('parent') or None
+    try:
+        after = int(request.args.get('cursor') or 0)
+        limit = int(request.args.get('limit', BOX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    if parent_id is not None and load_box(unique_id, parent_id) is None:
+        return jsonify({"error": "Box not found"}), 404
+    boxes, next_cursor = load_box_page(unique_id, parent_id, after, max(1, min(limit, BOX_PAGE_MAX)))
+    for box in boxes:
+        box['url'] = url_for('details', box_id=box['id'])
+    return jsonify({"parent": parent_id, "boxes": boxes, "next_cursor": next_cursor})
+
+@app.route('/api/boxes/bulk', methods=['POST'])
+def bulk_provision():
+    """
+    Creates many projects, workers and helmet assignments for the logged-in
+    user in one transaction (format described above plan_provision).
+    Takes a JSON body, a text/csv body, or a multipart upload named "file"
+    (.csv or .json). ?dry_run=1 validates and reports without writing.
+    """
+    if 'unique_id' not in session:
+        return jsonify({"error": "Login required"}), 401
+    upload = request.files.get('file')
+    if upload is not None:
+        is_csv = upload.filename.lower().endswith('.csv')
+        text = upload.read().decode('utf-8-sig', errors='replace')
+    else:
+        is_csv = request.mimetype in ('text/csv', 'text/plain')
+        text = request.get_data(as_text=True)
+    if is_csv:
+        projects, errors = parse_provision_csv(text)
+    else:
+        try:
+            projects = json.loads(text)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid JSON: {e}"}), 400
+        if isinstance(projects, dict):
+            projects = projects.get("boxes")
+        errors = []
+    dry_run = request.args.get('dry_run') in ('1', 'true')
+    if not errors:
+        report, errors = provision_boxes(session['unique_id'], projects, dry_run)
+    if errors:
+        return jsonify({"error": "Nothing was created", "errors": errors}), 400
+    return jsonify(report), 200 if dry_run else 201
+
+class SnapshotCache:
+    """
+    Encoded /data bodies for the current table version, keyed by request
+    parameters. Encoding happens under the cache lock, so any number of
+    concurrent pollers at the same version share a single encode.
+    """
+    def __init__(self, max_entries=64):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = {}
+
+    def get(self, version, key, build):
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.entries = {}
+            entry = self.entries.get(key)
+            if entry is None:
+                payload = build()
+                # The table may have moved on since `version` was read; tag the body with what it holds
+                entry = (json.dumps(payload, separators=(',', ':')).encode('utf-8'), payload["version"])
+                if len(self.entries) < self.max_entries:
+                    self.entries[key] = entry
+            return entry
+
+data_cache = SnapshotCache()
+
 @app.route('/data')
 def get_data():
+    """
+    Returns the latest packet plus the per-helmet table, tagged with the
+    table version.
+    Use ?ids=1,2,3 to restrict the response to a set of helmets, and
+    ?since=<version> to get only the helmets and fields changed after that
+    version. The ETag is the version, so If-None-Match gets a 304 while
+    nothing has changed.
+    """
+    ids_arg = request.args.get('ids')
+    ids = tuple(sorted({i.strip() for i in ids_arg.split(',') if i.strip()})) if ids_arg else None
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"error": "since must be an integer version"}), 400
+
+    with data_lock:
+        version = helmet_table.version
+    if f'"{version}"' in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': f'"{version}"', 'Cache-Control': 'no-cache'})
+
+    def build():
+        with data_lock:
+            if since is not None:
+                return {"version": helmet_table.version, "since": since, "helmets": helmet_table.delta(since, ids)}
+            return {"version": helmet_table.version, "values": list(latest_data["values"]),
+                    "helmets": helmet_table.snapshot(ids)}
+
+    body, body_version = data_cache.get(version, (ids, since), build)
+    return Response(body, mimetype='application/json',
+                    headers={'ETag': f'"{body_version}"', 'Cache-Control': 'no-cache'})
+
+@app.route('/stream')
+def stream():
+    """
+    Server-Sent Events feed of live helmet data.
+    Filter with ?helmet=<id>, ?ids=1,2,3 or ?box=<box_id> (every helmet assigned
+    to the box and its sub-boxes); without a filter every helmet is streamed.
+    The first event is a full snapshot, later events carry only changed fields
+    as {helmet ID: {field index: value}}.
+    """
+    helmet_ids = None
+    if request.args.get('helmet'):
+        helmet_ids = {request.args['helmet']}
+    elif request.args.get('ids'):
+        helmet_ids = {i.strip() for i in request.args['ids'].split(',') if i.strip()}
+    elif request.args.get('box'):
+        if 'unique_id' not in session:
+            return jsonify({"error": "Login required to stream a box"}), 401
+        box = get_box(session['unique_id'], request.args['box'])
+        if box is None:
+            return jsonify({"error": "Box not found"}), 404
+        helmet_ids = box_helmet_ids(box)
+
+    subscriber = live_feed.subscribe(helmet_ids)
+    with data_lock:
+        helmets = helmet_table.snapshot(sorted(helmet_ids) if helmet_ids is not None else None)
+    snapshot = {helmet_id: dict(enumerate(row["values"])) for helmet_id, row in helmets.items()}
+
+    def events():
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+            while True:
+                if not subscriber.event.wait(STREAM_KEEPALIVE_SECONDS):
+                    yield ": keepalive\n\n"
+                    continue
+                # Let packets arriving within the coalescing window share one push
+                time.sleep(STREAM_COALESCE_SECONDS)
+                changes = live_feed.take(subscriber)
+                if changes:
+                    yield f"data: {json.dumps(changes)}\n\n"
+        finally:
+            live_feed.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/data/<helmet_id>')
+def get_helmet_data(helmet_id):
+    """
+    Returns the latest packet of a single helmet.
+    """
+    with data_lock:
+        row = helmet_table.row(helmet_id)
+    if row is None:
+        return jsonify({"error": f"Unknown helmet '{helmet_id}'"}), 404
+    return jsonify(row)
+
+@app.route('/links')
+def get_links():
+    """
+    Link quality of every helmet (or ?ids=1,2,3): state (ok, degraded or
+    stale), last seen, nominal interval, jitter, loss and parse-error rates.
+    """
+    return ingest_query("links", request.args.to_dict())
+
+def links_response(args):
+    wanted = {i.strip() for i in args['ids'].split(',') if i.strip()} if args.get('ids') else None
+    now = time.time()
+    with data_lock:
+        links = {helmet_id: link_quality.describe(slot, now)
+                 for helmet_id, slot in helmet_table.slots.items()
+                 if wanted is None or helmet_id in wanted}
+    counts = {state: 0 for state in LINK_STATES}
+    for link in links.values():
+        counts[link["state"]] += 1
+    return {"time": now, "counts": counts, "helmets": links}, 200
+
+@app.route('/commands', methods=['GET', 'POST', 'DELETE'])
+def commands():
+    """
+    Downlink commands; login required. POST queues a command (JSON body):
+    command (evacuate, acknowledge or buzzer) for helmets (list or
+    comma-separated IDs, each assigned to one of the user's boxes) and/or
+    every helmet of a box. DELETE takes the same body, with command optional,
+    and cancels what is still owed to those helmets. GET returns the
+    deliveries of the user's helmets still waiting for an ACK and the last
+    delivery latency of each.
+    """
+    if 'unique_id' not in session:
+        return jsonify({"error": "Login required for commands"}), 401
+    own_helmets = user_helmet_ids(session['unique_id'])
+    if request.method == 'GET':
+        if SERVER_ROLE == 'web':
+            try:
+                status = forward_to_ingest({"op": "status"})
+            except OSError as e:
+                return jsonify({"error": f"Ingest process not reachable: {e}"}), 503
+        else:
+            status = downlink.status()
+        return jsonify({
+            "pending": [d for d in status.get("pending", []) if d["helmet"] in own_helmets],
+            "latency": {h: latency for h, latency in status.get("latency", {}).items() if h in own_helmets},
+        })
+    # A cross-site page can submit a form but cannot send a JSON body without
+    # a CORS preflight, so only accept JSON, and only from our own origin
+    origin = request.headers.get('Origin')
+    if not request.is_json or (origin and origin.rstrip('/') != request.host_url.rstrip('/')):
+        return jsonify({"error": "Commands must be sent as JSON from this site"}), 403
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    command = body.get('command')
+    if command not in DOWNLINK_COMMANDS and not (request.method == 'DELETE' and command is None):
+        return jsonify({"error": f"command must be one of {', '.join(DOWNLINK_COMMANDS)}"}), 400
+    helmets = body.get('helmets') or []
+    if isinstance(helmets, str):
+        helmets = helmets.split(',')
+    helmet_ids = {str(h).strip() for h in helmets if str(h).strip()}
+    unassigned = helmet_ids - own_helmets
+    if unassigned:
+        return jsonify({"error": f"Helmets not assigned to your boxes: {', '.join(sorted(unassigned))}"}), 403
+    if body.get('box'):
+        box = get_box(session['unique_id'], body['box'])
+        if box is None:
+            return jsonify({"error": "Box not found"}), 404
+        helmet_ids |= box_helmet_ids(box)
+    if not helmet_ids:
+        return jsonify({"error": "No helmets given"}), 400
+    message = {"op": "cancel" if request.method == 'DELETE' else "send", "command": command,
+               "helmets": sorted(helmet_ids)}
+    if SERVER_ROLE == 'web':
+        try:
+            reply = forward_to_ingest(message)
+        except OSError as e:
+            return jsonify({"error": f"Ingest process not reachable: {e}"}), 503
+    else:
+        reply = handle_forwarded(message)
+    if request.method == 'DELETE':
+        return jsonify({"command": command, "helmets": sorted(helmet_ids), "cancelled": reply.get("cancelled", 0)})
+    return jsonify({"command": command, "helmets": sorted(helmet_ids)}), 202
+
+@app.route('/alerts')
+def get_alerts():
+    """
+    Returns the alert log, newest first.
+    Filters: helmet, rule, since (unix time), limit. ?active=1 returns the
+    alerts that are currently raised instead.
+    """
+    return ingest_query("alerts", request.args.to_dict())
+
+def alerts_response(args):
+    if args.get('active'):
+        return {"active": alert_engine.active_alerts()}, 200
+    try:
+        since = float(args['since']) if args.get('since') else None
+        limit = int(args.get('limit', 500))
+    except ValueError:
+        return {"error": "since and limit must be numbers"}, 400
+    events = alert_engine.query(args.get('helmet'), args.get('rule'), since, limit)
+    return {"alerts": events}, 200
+
+@app.route('/anomalies/<helmet_id>')
+def get_anomalies(helmet_id):
+    """
+    Returns the running statistics and anomaly scores of one helmet.
+    """
+    return ingest_query("anomalies", request.args.to_dict(), helmet_id)
+
+def anomalies_response(args, helmet_id):
+    with data_lock:
+        slot = helmet_table.slots.get(helmet_id)
+        if slot is not None:
+            stats = anomaly_detector.describe(slot)
+    if slot is None:
+        return {"error": f"Unknown helmet '{helmet_id}'"}, 404
+    stats["helmet"] = helmet_id
+    return stats, 200
+
+@app.route('/history/<helmet_id>')
+def get_history(helmet_id):
+    """
+    Returns min/max/mean buckets of a helmet's recent readings.
+    Query parameters (seconds): window (default 3600) and resolution (default 60).
+    The resolution is widened if the window would produce too many buckets.
+    """
+    return ingest_query("history", request.args.to_dict(), helmet_id)
+
+def history_response(args, helmet_id):
+    try:
+        window = float(args.get('window', 3600))
+        resolution = float(args.get('resolution', 60))
+    except ValueError:
+        return {"error": "window and resolution must be numbers"}, 400
+    if window <= 0 or resolution <= 0:
+        return {"error": "window and resolution must be positive"}, 400
+    resolution = max(resolution, window / MAX_HISTORY_BUCKETS)
+
+    start = time.time() - window
+    with data_lock:
+        slot = helmet_table.slots.get(helmet_id)
+        if slot is not None:
+            times, samples = helmet_history.since(slot, start)
+    if slot is None:
+        return {"error": f"Unknown helmet '{helmet_id}'"}, 404
+
+    bucket_times, counts, mins, maxs, means = downsample(times, samples, start, resolution)
+    series = {}
+    for i, label in enumerate(HISTORY_CHANNELS):
+        series[label] = {
+            "min": nan_to_none(mins[:, i]),
+            "max": nan_to_none(maxs[:, i]),
+            "mean": nan_to_none(means[:, i]),
+        }
+    return {
+        "id": helmet_id,
+        "window": window,
+        "resolution": resolution,
+        "t": bucket_times.tolist(),
+        "count": counts.tolist(),
+        "series": series,
+    }, 200
+
+# Live state that only the ingest process keeps (alert engine, history rings,
+# anomaly and link statistics); web workers ask it for these over the command
+# socket so every worker serves the same answer
+INGEST_QUERIES = {
+    "alerts": alerts_response,
+    "links": links_response,
+    "anomalies": anomalies_response,
+    "history": history_response,
+}
+
+def ingest_query(name, args, *path):
+    """
+    Answers a query from this process's state, or from the ingest process
+    when running as a web worker.
+    """
+    if SERVER_ROLE == 'web':
+        try:
+            reply = forward_to_ingest({"op": "query", "name": name, "args": args, "path": list(path)})
+        except OSError as e:
+            return jsonify({"error": f"Ingest process not reachable: {e}"}), 503
+        if "body" not in reply:
+            return jsonify(reply), 502
+        return jsonify(reply["body"]), reply["status"]
+    body, status = INGEST_QUERIES[name](args, *path)
+    return jsonify(body), status
+
+@app.route('/telemetry/<helmet_id>')
+def get_telemetry(helmet_id):
+    """
+    Returns min/max/mean buckets of a helmet's stored readings between start
+    and end (unix time; default the last 24 hours) at the given resolution.
+    """
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 86400))
+        resolution = float(request.args.get('resolution', 300))
+        helmet_number = int(helmet_id)
+    except ValueError:
+        return jsonify({"error": "helmet_id, start, end and resolution must be numbers"}), 400
+    if end <= start or resolution <= 0:
+        return jsonify({"error": "end must be after start and resolution positive"}), 400
+    resolution = max(resolution, (end - start) / MAX_HISTORY_BUCKETS)
+
+    channels = [name for name, _ in TELEMETRY_COLUMNS[2:]]
+    times, samples = [np.zeros(0)], [np.zeros((0, len(channels)), dtype=np.float32)]
+    for chunk in telemetry_store.scan(start, end, [helmet_number]):
+        times.append(chunk["time"])
+        samples.append(np.column_stack([chunk[name] for name in channels]))
+    bucket_times, counts, mins, maxs, means = downsample(np.concatenate(times), np.concatenate(samples), start, resolution)
+    series = {}
+    for i, label in enumerate(HISTORY_CHANNELS):
+        series[label] = {
+            "min": nan_to_none(mins[:, i]),
+            "max": nan_to_none(maxs[:, i]),
+            "mean": nan_to_none(means[:, i]),
+        }
+    return jsonify({
+        "id": helmet_id,
+        "start": start,
+        "end": end,
+        "resolution": resolution,
+        "t": bucket_times.tolist(),
+        "count": counts.tolist(),
+        "series": series,
+    })
+
+@app.route('/export')
+def export():
+    """
+    Streams stored telemetry as a download.
+    Query parameters: format (csv, ndjson or parquet; default csv), helmets
+    (comma-separated IDs) or box (every helmet assigned to the box and its
+    sub-boxes; login required), start and end (unix time; default the last
+    24 hours), and resolution (seconds) to export per-helmet averages instead
+    of every packet.
+    """
+    fmt = request.args.get('format', 'csv')
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 86400))
+        resolution = float(request.args['resolution']) if request.args.get('resolution') else None
+    except ValueError:
+        return jsonify({"error": "start, end and resolution must be numbers"}), 400
+    if end <= start or (resolution is not None and resolution <= 0):
+        return jsonify({"error": "end must be after start and resolution positive"}), 400
+
+    helmet_ids = None
+    if request.args.get('helmets'):
+        helmet_ids = numeric_helmet_ids(request.args['helmets'].split(','))
+    elif request.args.get('box'):
+        if 'unique_id' not in session:
+            return jsonify({"error": "Login required to export a box"}), 401
+        box = get_box(session['unique_id'], request.args['box'])
+        if box is None:
+            return jsonify({"error": "Box not found"}), 404
+        helmet_ids = numeric_helmet_ids(box_helmet_ids(box))
+
+    try:
+        chunks = export_telemetry(fmt, start, end, helmet_ids, resolution)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    filename = f"telemetry-{int(start)}-{int(end)}.{fmt}"
+    return Response(chunks, mimetype=EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus text exposition of ingest, lock, HTTP and user store metrics.
+    """
+    with data_lock:
+        helmets = len(helmet_table)
+    lines = [
+        "# HELP aura_helmets Helmets in the live state table.",
+        "# TYPE aura_helmets gauge",
+        f"aura_helmets {helmets}",
+        "# HELP aura_stream_subscribers Open /stream connections.",
+        "# TYPE aura_stream_subscribers gauge",
+        f"aura_stream_subscribers {len(live_feed.subscribers)}",
+        "# HELP aura_telemetry_pending_rows Packets waiting for the telemetry writer.",
+        "# TYPE aura_telemetry_pending_rows gauge",
+        f"aura_telemetry_pending_rows {len(telemetry_store.pending)}",
+        "# HELP aura_pipeline_queue_depth Entries (bytes for parse stages) waiting in each ingest stage queue.",
+        "# TYPE aura_pipeline_queue_depth gauge",
+    ]
+    stage_queues = [packet_queue, sink_queue, log_queue] + list(raw_queues.values())
+    for queue in stage_queues:
+        lines.append(f"aura_pipeline_queue_depth{format_labels(('stage',), (queue.stage,))} {len(queue)}")
+    lines += [
+        "# HELP aura_pipeline_queue_high_water Deepest each ingest stage queue has been.",
+        "# TYPE aura_pipeline_queue_high_water gauge",
+    ]
+    for queue in stage_queues:
+        lines.append(f"aura_pipeline_queue_high_water{format_labels(('stage',), (queue.stage,))} {queue.high_water}")
+    for metric in (packets_total, helmet_packets_total, duplicate_packets_total, parse_failures_total,
+                   serial_reconnects_total, lock_wait_seconds, lock_hold_seconds, request_seconds,
+                   user_store_seconds, pipeline_dropped_total, pipeline_dropped_bytes_total,
+                   downlink_frames_total, downlink_retries_total, downlink_expired_total, downlink_latency_seconds,
+                   state_snapshot_seconds):
+        lines.extend(metric.render())
+    return Response("\n".join(lines) + "\n", mimetype='text/plain; version=0.0.4')
+
+def query_point():
+    """
+    Reads the query point from ?x=&y= or from the position of ?helmet=.
+    Returns (x, y, error response).
+    """
+    if request.args.get('helmet'):
+        with data_lock:
+            point = helmet_grid.location(request.args['helmet'])
+        if point is None:
+            return None, None, (jsonify({"error": f"No position for helmet '{request.args['helmet']}'"}), 404)
+        return point[0], point[1], None
+    try:
+        x, y = float(request.args['x']), float(request.args['y'])
+    except (KeyError, ValueError):
+        return None, None, (jsonify({"error": "Give numeric x and y, or helmet"}), 400)
+    if not (math.isfinite(x) and math.isfinite(y)):
+        return None, None, (jsonify({"error": "x and y must be finite numbers"}), 400)
+    return x, y, None
+
+@app.route('/nearby')
+def nearby():
+    """
+    Helmets within ?radius= metres of a point (?x=&y= or ?helmet=), nearest first.
+    """
+    x, y, error = query_point()
+    if error:
+        return error
+    try:
+        radius = float(request.args.get('radius', 25))
+    except ValueError:
+        return jsonify({"error": "radius must be a number"}), 400
+    if not math.isfinite(radius) or radius < 0:
+        return jsonify({"error": "radius must be a finite, non-negative number"}), 400
     with data_lock:
-        return jsonify(latest_data)
-    
+        found = helmet_grid.within(x, y, radius)
+        positions = {h: helmet_grid.location(h) for _, h in found}
+    return jsonify({"x": x, "y": y, "radius": radius, "helmets": [
+        {"id": h, "distance": d, "x": positions[h][0], "y": positions[h][1]} for d, h in found]})
+
+@app.route('/nearest')
+def nearest():
+    """
+    The ?k= helmets nearest to a point (?x=&y= or ?helmet=), at most NEAREST_MAX_K.
+    The search runs on a copy of the grid so it never holds data_lock.
+    """
+    x, y, error = query_point()
+    if error:
+        return error
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    k = max(0, min(k, NEAREST_MAX_K))
+    with data_lock:
+        grid = helmet_grid.copy()
+    found = grid.nearest(x, y, k)
+    positions = {h: grid.location(h) for _, h in found}
+    return jsonify({"x": x, "y": y, "k": k, "helmets": [
+        {"id": h, "distance": d, "x": positions[h][0], "y": positions[h][1]} for d, h in found]})
+
 @app.route('/fetch_location/<item_id>')
 def fetch_location(item_id):
-    # This is still a placeholder as requested
-    return render_template("fetch_location.html", item_id=item_id, location="Sensor Location Pending")
+    """
+    Shows the last known position of a helmet, or of every helmet assigned
+    to a box when item_id is one of the user's boxes.
+    """
+    helmet_ids = [item_id]
+    if 'unique_id' in session:
+        box = get_box(session['unique_id'], item_id)
+        if box is not None:
+            helmet_ids = sorted(box_helmet_ids(box))
+    with data_lock:
+        points = [(h, helmet_grid.location(h)) for h in helmet_ids]
+    known = [f"Helmet {h}: X {p[0]:.2f}, Y {p[1]:.2f}" for h, p in points if p is not None]
+    location = "; ".join(known) if known else "Sensor Location Pending"
+    return render_template("fetch_location.html", item_id=item_id, location=location)
 
-if __name__ == '__main__':
-    serial_thread = threading.Thread(target=read_from_port, daemon=True)
-    serial_thread.start()
+if __name__ == '__main__' and SERVER_ROLE == 'ingest':
+    run_ingest_process()
+elif __name__ == '__main__':
+    if not asset_manifest:
+        print("⚠️ No built assets found, pages fall back to the Tailwind CDN. Run: python build_assets.py")
+    restore_state()
+    start_serial_readers(SERIAL_PORTS)
+    start_background_work()
     app.run(debug=True, host='0.0.0.0', use_reloader=False)
     # Run Flask with host=0.0.0.0 if you want access from other devices on network
     app.run(debug=True , port = 8000)
\ No newline at end of file
@@ -0,0 +1,74 @@
+import argparse
+import json
+import sys
+
+# --- Bulk Provisioning ---
+# Command-line twin of POST /api/boxes/bulk: creates a site's projects,
+# workers and helmet assignments from a CSV or JSON file in one transaction.
+# Run it next to main.py so it uses the same users.db; a running server picks
+# the new boxes up on its next request. The file format is described above
+# plan_provision in main.py.
+#
+#   python provision.py site.csv --user 123456 --dry-run
+#   python provision.py site.json --user alice -o created.json
+
+def find_user(main, user):
+    """
+    Accepts a 6-digit user ID or a username.
+    """
+    row = main.get_user_by_username(user)
+    if row is None and user.isdigit():
+        row = main.get_db().execute('SELECT * FROM users WHERE unique_id = ?', (int(user),)).fetchone()
+    if row is None:
+        sys.exit(f"❌ User '{user}' not found in {main.DATABASE_FILE}")
+    return row['unique_id']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create projects, workers and helmet assignments in bulk.")
+    parser.add_argument('file', help="CSV or JSON batch ('-' reads stdin)")
+    parser.add_argument('--user', required=True, help="owner: 6-digit user ID or username")
+    parser.add_argument('--format', choices=['csv', 'json'], help="default: from the file extension, else JSON")
+    parser.add_argument('--dry-run', action='store_true', help="validate and report without writing")
+    parser.add_argument('-o', '--output', help="write the JSON report (every created box and its ID) here")
+    args = parser.parse_args()
+
+    if args.file == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.file, encoding='utf-8-sig') as f:
+            text = f.read()
+    is_csv = args.format == 'csv' or (args.format is None and args.file.lower().endswith('.csv'))
+
+    import main
+
+    unique_id = find_user(main, args.user)
+    if is_csv:
+        projects, errors = main.parse_provision_csv(text)
+    else:
+        try:
+            projects = json.loads(text)
+        except ValueError as e:
+            sys.exit(f"❌ Invalid JSON: {e}")
+        if isinstance(projects, dict):
+            projects = projects.get("boxes")
+        errors = []
+    if not errors:
+        report, errors = main.provision_boxes(unique_id, projects, args.dry_run)
+    if errors:
+        for error in errors:
+            print(f"❌ {error}", file=sys.stderr)
+        sys.exit(f"Nothing was created ({len(errors)} problem(s))")
+
+    created = report["created"]
+    verb = "Would create" if args.dry_run else "Created"
+    print(f"✅ {verb} {created['projects']} projects, {created['workers']} workers "
+          f"and {created['helmets']} helmet assignments", file=sys.stderr)
+    if report["updated"]:
+        print(f"✅ {'Would add' if args.dry_run else 'Added'} helmets to {len(report['updated'])} existing projects",
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,133 @@
+import argparse
+import os
+import random
+import socket
+import time
+
+# --- Helmet Fleet Simulator ---
+# Stands in for an HC-12 receiver: emits the 9-field CSV packets main.py reads
+# (ID, MQ2, MQ7, MQ135, Fall dec, X-cor, Y-cor, SP-O₂, Heart rate).
+#
+#   python simulator.py --pty                      # prints a device path for SERIAL_PORTS
+#   python simulator.py --tcp 7777                 # SERIAL_PORTS=socket://localhost:7777
+#   python simulator.py --tcp 7777 --helmets 200 --rate 1 --corrupt 0.02 --disconnect-every 60
+
+class Helmet:
+    """
+    One simulated worker: a random walk over the site plus noisy sensors.
+    """
+    def __init__(self, helmet_id, site_size):
+        self.helmet_id = helmet_id
+        self.site_size = site_size
+        self.x = random.uniform(0, site_size)
+        self.y = random.uniform(0, site_size)
+        self.heart_rate = random.uniform(65, 90)
+        self.co_spike = 0
+
+    def packet(self):
+        self.x = min(max(self.x + random.gauss(0, 1.5), 0), self.site_size)
+        self.y = min(max(self.y + random.gauss(0, 1.5), 0), self.site_size)
+        self.heart_rate = min(max(self.heart_rate + random.gauss(0, 1), 50), 150)
+        if self.co_spike == 0 and random.random() < 0.001:
+            self.co_spike = 30
+        self.co_spike = max(self.co_spike - 1, 0)
+        mq7 = random.gauss(10, 3) + (60 if self.co_spike else 0)
+        fall = 1 if random.random() < 0.0005 else 0
+        values = [
+            str(self.helmet_id),
+            f"{random.gauss(200, 30):.2f}",
+            f"{max(mq7, 0):.2f}",
+            f"{random.gauss(150, 20):.2f}",
+            str(fall),
+            f"{self.x:.2f}",
+            f"{self.y:.2f}",
+            str(int(min(max(random.gauss(97, 1.2), 85), 100))),
+            str(int(self.heart_rate)),
+        ]
+        return ",".join(values) + "\n"
+
+def corrupt(line):
+    """
+    Damages a packet the way a noisy radio link does.
+    """
+    kind = random.choice(("truncate", "drop_field", "garbage", "bad_bytes"))
+    if kind == "truncate":
+        return line[:random.randint(1, len(line) - 2)] + "\n"
+    if kind == "drop_field":
+        parts = line.strip().split(",")
+        parts.pop(random.randrange(len(parts)))
+        return ",".join(parts) + "\n"
+    if kind == "garbage":
+        return "".join(random.choice("0123456789,.#@!") for _ in range(random.randint(5, 60))) + "\n"
+    return line[:5] + "\udcff" + line[5:]
+
+def packet_stream(args):
+    """
+    Yields (delay, packet bytes) forever, spreading every helmet's packets
+    over its send interval with the requested jitter.
+    """
+    helmets = [Helmet(i + 1, args.site_size) for i in range(args.helmets)]
+    interval = 1.0 / args.rate
+    next_send = [time.monotonic() + random.uniform(0, interval) for _ in helmets]
+    while True:
+        i = min(range(len(helmets)), key=next_send.__getitem__)
+        delay = max(next_send[i] - time.monotonic(), 0)
+        next_send[i] += interval * (1 + random.uniform(-args.jitter, args.jitter))
+        line = helmets[i].packet()
+        if random.random() < args.corrupt:
+            line = corrupt(line)
+        yield delay, line.encode('utf-8', errors='surrogateescape')
+
+def send_packets(write, args, stop_at=None):
+    """
+    Writes packets until stop_at (monotonic time) or forever.
+    """
+    sent = 0
+    for delay, data in packet_stream(args):
+        if delay:
+            time.sleep(delay)
+        write(data)
+        sent += 1
+        if stop_at is not None and time.monotonic() >= stop_at:
+            return sent
+
+def run_pty(args):
+    master, slave = os.openpty()
+    print(f"🛰️  Simulating {args.helmets} helmets on {os.ttyname(slave)} (set SERIAL_PORTS to this path)")
+    send_packets(lambda data: os.write(master, data), args)
+
+def run_tcp(args):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('0.0.0.0', args.tcp))
+    server.listen()
+    print(f"🛰️  Simulating {args.helmets} helmets on socket://localhost:{args.tcp}")
+    while True:
+        conn, address = server.accept()
+        print(f"✅ Receiver connected from {address[0]}:{address[1]}")
+        stop_at = time.monotonic() + args.disconnect_every if args.disconnect_every else None
+        try:
+            sent = send_packets(conn.sendall, args, stop_at)
+            print(f"🔌 Dropping the link after {sent} packets")
+        except OSError:
+            print("🔌 Receiver disconnected")
+        finally:
+            conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate a fleet of helmets behind an HC-12 receiver.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--pty', action='store_true', help="serve packets on a pseudo-terminal")
+    target.add_argument('--tcp', type=int, metavar='PORT', help="serve packets on a TCP port")
+    parser.add_argument('--helmets', type=int, default=40, help="number of helmets (default 40)")
+    parser.add_argument('--rate', type=float, default=1.0, help="packets per second per helmet (default 1)")
+    parser.add_argument('--jitter', type=float, default=0.1, help="send interval jitter as a fraction (default 0.1)")
+    parser.add_argument('--corrupt', type=float, default=0.0, help="fraction of corrupted lines (default 0)")
+    parser.add_argument('--disconnect-every', type=float, default=0, metavar='SECONDS',
+                        help="TCP only: drop the connection this often to exercise reconnects")
+    parser.add_argument('--site-size', type=float, default=200.0, help="site width/height in metres (default 200)")
+    args = parser.parse_args()
+    if args.pty:
+        run_pty(args)
+    else:
+        run_tcp(args)
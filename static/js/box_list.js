@@ -0,0 +1,80 @@
+// Progressive box lists (templates/next_page.html and details.html).
+// The page renders the first page of boxes; later pages come from /api/boxes
+// as the "Load more" button scrolls into view (or is clicked).
+//
+// A list is an element with data-box-list, holding:
+//   data-api-url      /api/boxes URL for this level (parent already set)
+//   data-next-cursor  cursor of the next page, empty when there is none
+//   <template data-box-card>  markup cloned for each box; [data-box-name],
+//                             [data-box-count] and the <a> are filled in
+//   [data-box-more]   the load-more button
+
+function setupBoxList(list) {
+    const template = list.querySelector("template[data-box-card]");
+    const items = list.querySelector("[data-box-items]");
+    const more = list.querySelector("[data-box-more]");
+    let cursor = list.dataset.nextCursor;
+    let loading = false;
+
+    function render(box) {
+        const card = template.content.firstElementChild.cloneNode(true);
+        const link = card.matches("a") ? card : card.querySelector("a");
+        link.href = box.url;
+        card.querySelector("[data-box-name]").textContent = box.name;
+        const count = card.querySelector("[data-box-count]");
+        if (count) {
+            const noun = count.dataset.noun || "item";
+            count.textContent = `${box.child_count} ${noun}${box.child_count === 1 ? "" : "s"}`;
+        }
+        items.appendChild(card);
+    }
+
+    function finish() {
+        more.remove();
+        if (observer) observer.disconnect();
+    }
+
+    function loadMore() {
+        if (loading || !cursor) return;
+        loading = true;
+        more.disabled = true;
+        const url = new URL(list.dataset.apiUrl, window.location.href);
+        url.searchParams.set("cursor", cursor);
+        fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) { console.error("Error loading boxes:", data.error); return; }
+                data.boxes.forEach(render);
+                cursor = data.next_cursor;
+                if (!cursor) finish();
+            })
+            .catch(error => console.error("Network error:", error))
+            .finally(() => {
+                loading = false;
+                more.disabled = false;
+                // Re-observe so a button still in view after a short page loads the next one
+                if (cursor && observer) {
+                    observer.unobserve(more);
+                    observer.observe(more);
+                }
+            });
+    }
+
+    const observer = "IntersectionObserver" in window
+        ? new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadMore();
+        }, { rootMargin: "200px" })
+        : null;
+
+    if (!cursor) {
+        finish();
+        return;
+    }
+    more.classList.remove("hidden");
+    more.addEventListener("click", loadMore);
+    if (observer) observer.observe(more);
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    document.querySelectorAll("[data-box-list]").forEach(setupBoxList);
+});
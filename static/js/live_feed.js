@@ -0,0 +1,183 @@
+// Live sensor feed page (templates/live_feed.html).
+// The stream URL comes from the page's data-stream-url attribute.
+
+const sensorLabels = [
+    "ID", "MQ2", "MQ7", "MQ135", "Fall dec", 
+    "X-cor", "Y-cor", "SP-O₂", "Heart rate"
+];
+
+let popupShown = false; // 🚨 Flag to avoid repeated popups
+
+// Show/hide popup functions
+function showEvacModal() {
+    if (!popupShown) {
+        document.getElementById('evac-modal').classList.remove('hidden');
+        popupShown = true; // mark popup as shown
+    }
+}
+function hideEvacModal() {
+    document.getElementById('evac-modal').classList.add('hidden');
+}
+
+// Button actions
+document.addEventListener("DOMContentLoaded", () => {
+    document.getElementById("btn-yes").addEventListener("click", () => {
+        // Evacuate the box's helmets, or every helmet on screen when no box is set
+        const box = document.body.dataset.box;
+        const command = box ? { command: "evacuate", box } : { command: "evacuate", helmets: Object.keys(helmets) };
+        fetch(document.body.dataset.commandsUrl, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify(command),
+        })
+            .then(response => response.json().then(data => ({ ok: response.ok, data })))
+            .then(({ ok, data }) => {
+                alert(ok ? `🚨 Evacuation sent to ${data.helmets.length} helmet(s)` : `❌ Evacuation not sent: ${data.error}`);
+            })
+            .catch(error => alert(`❌ Evacuation not sent: ${error}`));
+        hideEvacModal();
+    });
+    document.getElementById("btn-no").addEventListener("click", () => {
+        hideEvacModal();
+    });
+});
+
+const helmets = {}; // helmet ID -> latest values, kept in sync by the stream
+const links = {};   // helmet ID -> link quality from /links, refreshed every few seconds
+
+const linkStyles = { ok: "text-green-800", degraded: "text-amber-700", stale: "text-red-800" };
+
+function renderLink(link) {
+    const listItem = document.createElement('li');
+    listItem.className = 'flex justify-between items-center py-3 border-b border-muted-tan/50';
+    const labelSpan = document.createElement('span');
+    labelSpan.className = 'text-medium-slate';
+    labelSpan.textContent = 'Link:';
+    const valueSpan = document.createElement('span');
+    valueSpan.className = `font-bold font-mono text-xl ${linkStyles[link.state]}`;
+    if (link.state === "stale") {
+        valueSpan.textContent = `SILENT ${Math.round(link.silent_for)}s`;
+    } else if (link.state === "degraded") {
+        valueSpan.textContent = `DEGRADED (loss ${link.loss_pct}%, errors ${link.parse_error_pct}%)`;
+    } else {
+        valueSpan.textContent = "OK";
+    }
+    listItem.appendChild(labelSpan);
+    listItem.appendChild(valueSpan);
+    return listItem;
+}
+
+function renderHelmet(values, link) {
+    const helmetList = document.createElement('ul');
+    helmetList.className = 'space-y-3 mb-6';
+    if (link) {
+        helmetList.appendChild(renderLink(link));
+    }
+
+    values.forEach((value, index) => {
+        // Create the list item with Tailwind classes
+        const listItem = document.createElement('li');
+        listItem.className = 'flex justify-between items-center py-3 border-b border-muted-tan/50';
+
+        // Create the label span
+        const labelSpan = document.createElement('span');
+        labelSpan.className = 'text-medium-slate';
+        labelSpan.textContent = `${sensorLabels[index]}:`;
+
+        // Create the value span
+        const valueSpan = document.createElement('span');
+        valueSpan.className = 'font-bold text-dark-slate font-mono text-xl';
+
+        if (!isNaN(value) && String(value).trim() !== "") {
+            // Numeric value
+            if (index === 0 ) { 
+                valueSpan.textContent = parseInt(value);
+                valueSpan.classList.add("text-green-800");
+            } else if (index === 4 ) { 
+                valueSpan.textContent = "NORMAL";
+                valueSpan.classList.add("text-green-800");
+            } else if (index === 7 ) { 
+                valueSpan.textContent = parseFloat(value) + "%";
+                valueSpan.classList.add("text-green-800");
+            } else {
+                valueSpan.textContent = parseFloat(value).toFixed(2);
+                valueSpan.classList.add("text-green-800");
+            }
+        } else {
+            // Non-numeric (string alert, error, etc.)
+            valueSpan.textContent = "ALERT";
+            valueSpan.classList.add("text-red-800");
+
+            // 🚨 Trigger popup only once
+            showEvacModal();
+        }
+
+        listItem.appendChild(labelSpan);
+        listItem.appendChild(valueSpan);
+        helmetList.appendChild(listItem);
+    });
+    return helmetList;
+}
+
+function renderHelmets() {
+    const sensorList = document.getElementById('sensor-list');
+    sensorList.innerHTML = ''; // Clear previous data
+    Object.keys(helmets)
+        .sort((a, b) => a.localeCompare(b, undefined, { numeric: true }))
+        .forEach(id => sensorList.appendChild(renderHelmet(helmets[id], links[id])));
+}
+
+// Merge {helmet ID: {field index: value}} into the local copy
+function applyChanges(changes) {
+    Object.entries(changes).forEach(([id, fields]) => {
+        const values = helmets[id] || (helmets[id] = new Array(sensorLabels.length).fill(""));
+        Object.entries(fields).forEach(([index, value]) => { values[index] = value; });
+    });
+    renderHelmets();
+}
+
+let dataVersion = null; // last /data version seen, so polls only fetch what changed
+
+function updateSensorValues() {
+    fetch(dataVersion === null ? '/data' : `/data?since=${dataVersion}`)
+        .then(response => response.json())
+        .then(data => {
+            if (dataVersion === null) {
+                Object.values(data.helmets).forEach(helmet => { helmets[helmet.id] = helmet.values; });
+                renderHelmets();
+            } else {
+                const changes = {};
+                Object.values(data.helmets).forEach(helmet => { changes[helmet.id] = helmet.changes; });
+                applyChanges(changes);
+            }
+            dataVersion = data.version;
+        })
+        .catch(error => console.error('Error fetching data:', error));
+}
+
+if (window.EventSource) {
+    // The server pushes only the helmets and fields that changed
+    const source = new EventSource(document.body.dataset.streamUrl);
+    source.addEventListener('snapshot', event => applyChanges(JSON.parse(event.data)));
+    source.onmessage = event => applyChanges(JSON.parse(event.data));
+    source.onerror = error => console.error('Live feed error, reconnecting:', error);
+} else {
+    updateSensorValues();
+    setInterval(updateSensorValues, 1000); // Refresh every second
+}
+
+// A silent helmet sends nothing to the stream, so link state is polled
+function updateLinks() {
+    const ids = Object.keys(helmets);
+    if (ids.length === 0) {
+        return;
+    }
+    fetch(`${document.body.dataset.linksUrl}?ids=${encodeURIComponent(ids.join(','))}`)
+        .then(response => response.json())
+        .then(data => {
+            Object.assign(links, data.helmets);
+            renderHelmets();
+        })
+        .catch(error => console.error('Error fetching link quality:', error));
+}
+setInterval(updateLinks, 5000);
@@ -0,0 +1,52 @@
+import pytest
+
+import main
+
+CO_RULE = {"name": "co_high", "field": 2, "direction": "above", "trigger": 50, "clear": 35, "debounce": 3}
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(main, "helmet_table", main.HelmetTable(4))
+    monkeypatch.setattr(main, "anomaly_detector", main.AnomalyDetector(4))
+    monkeypatch.setattr(main, "link_quality", main.LinkQuality(4))
+    return main.AlertEngine([CO_RULE], 4, 100)
+
+
+def feed(engine, now, co):
+    """
+    Stores one packet for helmet 1 and runs a tick right after it.
+    """
+    main.helmet_table.update(["1", "100", str(co), "100", "0", "1.0", "1.0", "98", "70"], now)
+    return [event["state"] for event in engine.tick(now + 0.1)]
+
+
+def test_raises_only_after_debounce_consecutive_breaches(engine):
+    assert feed(engine, 1000.0, 60) == []
+    assert feed(engine, 1001.0, 60) == []
+    assert feed(engine, 1002.0, 40) == []      # below trigger resets the streak
+    assert feed(engine, 1003.0, 60) == []
+    assert feed(engine, 1004.0, 60) == []
+    assert feed(engine, 1005.0, 60) == ["raised"]
+    assert [(a["helmet"], a["rule"]) for a in engine.active_alerts()] == [("1", "co_high")]
+
+
+def test_clears_only_past_the_clear_threshold(engine):
+    for i in range(3):
+        feed(engine, 1000.0 + i, 60)
+    # Between clear and trigger is neither a breach nor a recovery
+    for i in range(5):
+        assert feed(engine, 1010.0 + i, 45) == []
+    assert feed(engine, 1020.0, 30) == []
+    assert feed(engine, 1021.0, 30) == []
+    assert feed(engine, 1022.0, 30) == ["cleared"]
+    assert engine.active_alerts() == []
+    assert [event["state"] for event in engine.query()] == ["cleared", "raised"]
+
+
+def test_ticks_without_fresh_packets_do_not_advance_the_streak(engine):
+    feed(engine, 1000.0, 60)
+    feed(engine, 1001.0, 60)
+    for i in range(5):
+        assert engine.tick(1002.0 + i) == []
+    assert feed(engine, 1010.0, 60) == ["raised"]
@@ -0,0 +1,49 @@
+import main
+
+PACKET = ["7", "120", "30", "400", "0", "12.5", "-3.0", "97", "72"]
+
+
+def frames(count, start=0):
+    return [main.encode_frame(start + i, PACKET) for i in range(count)]
+
+
+def test_round_trip():
+    parser = main.BinaryFrameParser("test")
+    assert list(parser.feed(frames(1)[0])) == [(0, PACKET)]
+    assert parser.crc_errors == 0
+
+
+def test_resyncs_after_leading_garbage():
+    parser = main.BinaryFrameParser("test")
+    # Includes a stray sync byte and a full sync word with no valid frame behind it
+    stream = b"\x00\xaa\x13" + main.FRAME_SYNC + b"\x01\x02" + b"".join(frames(2))
+    assert [seq for seq, _ in parser.feed(stream)] == [0, 1]
+    assert parser.buffer == bytearray()
+
+
+def test_bad_crc_costs_only_that_frame():
+    parser = main.BinaryFrameParser("test")
+    good = frames(3)
+    corrupt = bytearray(good[1])
+    corrupt[len(main.FRAME_SYNC) + 4] ^= 0xFF
+    results = list(parser.feed(good[0] + bytes(corrupt) + good[2]))
+    assert [seq for seq, _ in results] == [0, 2]
+    assert all(fields == PACKET for _, fields in results)
+    assert parser.crc_errors >= 1
+
+
+def test_truncated_frame_resyncs_on_the_next_sync_word():
+    parser = main.BinaryFrameParser("test")
+    good = frames(2)
+    stream = good[0][:main.FRAME_SIZE // 2] + good[1]
+    assert [seq for seq, _ in parser.feed(stream)] == [1]
+
+
+def test_frames_split_across_reads():
+    parser = main.BinaryFrameParser("test")
+    stream = b"\xff" + b"".join(frames(3))
+    seqs = []
+    for i in range(0, len(stream), 5):
+        seqs += [seq for seq, _ in parser.feed(stream[i:i + 5])]
+    assert seqs == [0, 1, 2]
+    assert len(parser.buffer) < main.FRAME_SIZE
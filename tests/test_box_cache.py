@@ -0,0 +1,20 @@
+import main
+
+
+def test_fill_overlapping_a_write_is_not_cached(monkeypatch):
+    cache = main.BoxCache(4)
+    versions = [[], [{"id": "b1", "sub_boxes": []}]]
+    calls = []
+
+    def load(owner_id):
+        boxes = versions[min(len(calls), 1)]
+        if not calls:
+            # A write lands while the first load is still reading the old rows
+            cache.invalidate(owner_id)
+        calls.append(owner_id)
+        return boxes
+
+    monkeypatch.setattr(main, "load_user_boxes", load)
+    assert cache.tree(1) == []
+    assert cache.find(1, "b1")[0] == {"id": "b1", "sub_boxes": []}
+    assert len(calls) == 2
@@ -0,0 +1,48 @@
+import main
+
+
+def test_binary_ack_frame_acknowledges_a_delivery():
+    scheduler = main.DownlinkScheduler()
+    scheduler.send("buzzer", ["7"], now=1000.0)
+    frame = scheduler.next_frame(1000.0)
+    seq = int(frame[1:].split(b",")[0])
+    parser = main.BinaryFrameParser("test")
+    stream = main.encode_frame(0, ["7", "1", "1", "1", "0", "0", "0", "98", "70"]) + main.encode_ack_frame(7, seq)
+    original = main.downlink
+    main.downlink = scheduler
+    try:
+        assert [fields[0] for _, fields in parser.feed(stream)] == ["7"]
+    finally:
+        main.downlink = original
+    assert scheduler.pending == {}
+    assert parser.crc_errors == 0
+
+
+def test_delivery_expires_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(main, "DOWNLINK_TTL_SECONDS", 1e9)
+    scheduler = main.DownlinkScheduler()
+    scheduler.send("evacuate", ["1"], now=0.0)
+    now = 0.0
+    for _ in range(main.DOWNLINK_MAX_ATTEMPTS):
+        assert scheduler.expire(now) == []
+        assert scheduler.next_frame(now) is not None
+        now = scheduler.pending[("1", "evacuate")].next_attempt
+    assert len(scheduler.expire(now)) == 1
+    assert scheduler.pending == {}
+
+
+def test_delivery_expires_after_ttl():
+    scheduler = main.DownlinkScheduler()
+    scheduler.send("buzzer", ["1", "2"], now=0.0)
+    assert scheduler.expire(main.DOWNLINK_TTL_SECONDS - 1) == []
+    assert len(scheduler.expire(main.DOWNLINK_TTL_SECONDS)) == 2
+
+
+def test_cancel_drops_only_the_named_deliveries():
+    scheduler = main.DownlinkScheduler()
+    scheduler.send("buzzer", ["1", "2"], now=0.0)
+    scheduler.send("evacuate", ["1"], now=0.0)
+    assert scheduler.cancel({"1"}, "buzzer") == 1
+    assert set(scheduler.pending) == {("2", "buzzer"), ("1", "evacuate")}
+    assert scheduler.cancel({"1", "2"}) == 2
+    assert scheduler.pending == {}
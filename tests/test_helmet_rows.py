@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(main, "helmet_table", main.HelmetTable(4))
+    monkeypatch.setattr(main, "helmet_history", main.HelmetHistory(16, 1 << 20))
+    monkeypatch.setattr(main, "anomaly_detector", main.AnomalyDetector(4))
+    monkeypatch.setattr(main, "link_quality", main.LinkQuality(4))
+    monkeypatch.setattr(main, "helmet_grid", main.SpatialGrid(10))
+    monkeypatch.setattr(main, "box_rollups", main.BoxRollups())
+    monkeypatch.setattr(main, "packet_dedup", main.PacketDeduplicator(1.0))
+    monkeypatch.setattr(main, "alert_engine", main.AlertEngine(main.ALERT_RULES, 4, 100))
+    monkeypatch.setattr(main, "telemetry_store", main.TelemetryStore("unused", 3600))
+
+
+def packet(helmet_id):
+    return [helmet_id, "100", "20", "300", "0", "1.0", "2.0", "97", "70"]
+
+
+@pytest.mark.parametrize("line", [
+    b"6#6@5812,1,2,3,0,1.0,2.0,97,70\n",
+    b"7,1,2#,3,0,1.0,2.0,97,70\n",
+    b"abc,1,2,3,0,1.0,2.0,97,70\n",
+])
+def test_corrupted_lines_with_nine_fields_are_rejected(line):
+    parser = main.CsvParser("test")
+    assert list(parser.feed(line)) == []
+
+
+def test_valid_line_with_a_missing_reading_is_accepted():
+    parser = main.CsvParser("test")
+    assert list(parser.feed(b"7,1,2,3,0,1.0,2.0,,70\n")) == [(None, ["7", "1", "2", "3", "0", "1.0", "2.0", "", "70"])]
+
+
+def test_offline_helmet_row_is_freed_and_reused(fresh_state):
+    main.ingest_packet(packet("1"))
+    main.ingest_packet(packet("2"))
+    later = time.time() + main.HELMET_OFFLINE_SECONDS + 1
+    with main.data_lock:
+        main.helmet_table.updated[1] = later - 1      # helmet 2 is still online
+    assert main.evict_offline_helmets(later) == ["1"]
+    assert main.helmet_table.row("1") is None
+    assert main.helmet_grid.location("1") is None
+    assert 0 not in main.helmet_history.rings
+
+    main.ingest_packet(packet("3"))
+    assert main.helmet_table.slots == {"2": 1, "3": 0}
+    assert main.helmet_table.row("3")["values"] == packet("3")
+    assert main.anomaly_detector.count[0].max() == 1
@@ -0,0 +1,36 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("last_packet", [1000.0, 1000.3, 1000.7, 1000.99])
+def test_silent_helmet_goes_stale_within_a_tick_of_its_deadline(last_packet):
+    links = main.LinkQuality(4)
+    links.on_packet(0, last_packet)
+    deadline = last_packet + main.STALE_SECONDS
+    stale_at = None
+    now = last_packet
+    while now < deadline + 2 * main.LINK_WHEEL_SLOTS:
+        if links.advance(now):
+            stale_at = now
+            break
+        now += 0.5
+    assert stale_at is not None
+    assert deadline <= stale_at <= deadline + main.LINK_WHEEL_TICK_SECONDS + 0.5
+
+
+def test_packet_moves_the_deadline():
+    links = main.LinkQuality(4)
+    links.advance(1000.0)
+    links.on_packet(0, 1000.0)
+    links.on_packet(0, 1020.0)
+    assert links.advance(1000.0 + main.STALE_SECONDS + 1) == []
+    assert links.advance(1020.0 + main.STALE_SECONDS + 1) == [0]
+    assert links.state(0) == "stale"
+
+
+def test_sequence_gaps_count_as_loss():
+    links = main.LinkQuality(4)
+    for i, seq in enumerate([1, 2, 3, 6, 7]):
+        links.on_packet(0, 1000.0 + i, seq)
+    assert links.loss_pct(0) == pytest.approx(100 * 2 / 7, rel=0.05)
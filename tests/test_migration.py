@@ -0,0 +1,39 @@
+import json
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def legacy_file(tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps([{"unique_id": 123456, "username": "ana", "password": "x",
+                                 "boxes": [{"id": "b1", "name": "Site", "sub_boxes": []}]}]))
+    monkeypatch.setattr(main, "LEGACY_USERS_FILE", str(path))
+    conn = sqlite3.connect(str(tmp_path / "users.db"))
+    conn.executescript(main.SCHEMA)
+    return conn
+
+
+def test_migration_runs_once(legacy_file):
+    main.migrate_legacy_users(legacy_file)
+    main.migrate_legacy_users(legacy_file)
+    assert legacy_file.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+    assert legacy_file.execute("SELECT COUNT(*) FROM boxes").fetchone()[0] == 1
+
+
+def test_failed_import_leaves_nothing_behind(legacy_file, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("crash mid-import")
+
+    insert_box_tree = main.insert_box_tree
+    monkeypatch.setattr(main, "insert_box_tree", fail)
+    with pytest.raises(RuntimeError):
+        main.migrate_legacy_users(legacy_file)
+    assert legacy_file.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+    assert legacy_file.execute("SELECT COUNT(*) FROM meta").fetchone()[0] == 0
+    monkeypatch.setattr(main, "insert_box_tree", insert_box_tree)
+    main.migrate_legacy_users(legacy_file)
+    assert legacy_file.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
@@ -0,0 +1,23 @@
+import math
+import random
+
+import main
+
+
+def test_far_straggler_does_not_walk_every_ring():
+    grid = main.SpatialGrid(10)
+    grid.update("a", 0, 0)
+    grid.update("b", 50000, 0)
+    assert [h for _, h in grid.nearest(1, 1, 2)] == ["a", "b"]
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(7)
+    grid = main.SpatialGrid(10)
+    points = {str(i): (rng.uniform(-500, 500), rng.uniform(-500, 500)) for i in range(300)}
+    for helmet_id, (x, y) in points.items():
+        grid.update(helmet_id, x, y)
+    for _ in range(50):
+        x, y, k = rng.uniform(-700, 700), rng.uniform(-700, 700), rng.randint(1, 20)
+        expected = sorted((math.hypot(px - x, py - y), h) for h, (px, py) in points.items())[:k]
+        assert grid.nearest(x, y, k) == expected
@@ -0,0 +1,22 @@
+import os
+
+import main
+
+
+def write_rows(store, times):
+    for t in times:
+        store.append(t, [int(t) % 100] + [1.0] * (main.NUM_FIELDS - 1))
+    store.flush()
+
+
+def test_reopen_realigns_columns_cut_short_by_a_crash(tmp_path):
+    store = main.TelemetryStore(str(tmp_path), 3600)
+    write_rows(store, [7200.0, 7201.0, 7202.0])
+    store.close_files()
+    helmet_file = os.path.join(store.segments()[0][1], "helmet.bin")
+    os.truncate(helmet_file, os.path.getsize(helmet_file) - 4)
+
+    store = main.TelemetryStore(str(tmp_path), 3600)
+    write_rows(store, [7203.0, 7204.0, 7205.0])
+    rows = [(float(t), int(h)) for chunk in store.scan(0, 10000) for t, h in zip(chunk["time"], chunk["helmet"])]
+    assert rows == [(7200.0, 0), (7201.0, 1), (7203.0, 3), (7204.0, 4), (7205.0, 5)]
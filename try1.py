@@ -1,10 +1,11 @@
+import os
 import time
 import serial
 import threading
 from flask import Flask, jsonify, render_template_string
 
 # --- Configuration ---
-SERIAL_PORT = 'COM6'
+SERIAL_PORT = os.environ.get('SERIAL_PORT', 'COM6')
 BAUD_RATE = 9600
 
 # --- Global Variables ---